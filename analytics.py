@@ -0,0 +1,245 @@
+import copy
+import time
+import bisect
+import threading
+from operator import add
+from collections import deque
+from events import OPENED, MESSAGE, REPLY, CLOSED, EXPIRED
+from summaries import format_wait
+
+# Duration histogram bounds in seconds: 1s to about 670 days, each 15%
+# above the last. A percentile is reported as the upper bound of the
+# bucket it falls in, so it reads at most 15% high.
+DURATION_BOUNDS = tuple(1.15 ** i for i in range(128))
+PERCENTILES = (50, 90, 99)
+
+# Reported windows, newest first; aggregates are kept for the longest
+WINDOWS = (("24h", 86400), ("7d", 7 * 86400))
+
+# ------------------------- HOURLY AGGREGATES -------------------------
+class Bucket:
+    """Everything that happened in one time bucket"""
+
+    __slots__ = ("start", "opened", "closed", "expired", "messages",
+                 "first_response", "resolution", "replies", "first_responses", "closes")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.opened = 0
+        self.closed = 0
+        self.expired = 0
+        self.messages = 0
+        # Histogram counts over DURATION_BOUNDS, overflow last
+        self.first_response = [0] * (len(DURATION_BOUNDS) + 1)
+        self.resolution = [0] * (len(DURATION_BOUNDS) + 1)
+        # admin_id -> count
+        self.replies = {}
+        self.first_responses = {}
+        self.closes = {}
+
+def _bump(counts: dict, key, amount: int = 1) -> None:
+    counts[key] = counts.get(key, 0) + amount
+
+def percentile(counts: list, q: float):
+    """Upper bound (seconds) of the histogram bucket holding the q-th percentile, or None if empty"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = max(q / 100 * total, 1)
+    cumulative = 0
+    for index, count in enumerate(counts):
+        cumulative += count
+        if cumulative >= rank:
+            break
+    return round(DURATION_BOUNDS[min(index, len(DURATION_BOUNDS) - 1)], 1)
+
+# ------------------------- TICKET ANALYTICS -------------------------
+class TicketAnalytics:
+    """SLA figures folded from the ticket event stream as it happens
+
+    Each event updates one hourly Bucket: counts, a first-response or
+    resolution histogram, and per-admin counters. A report merges the
+    buckets of each window, so its cost depends on the window length,
+    not on how many tickets or messages there were, and history is
+    never read. Windows roll to the hour. The only per-ticket state is
+    the open time of open tickets and which of them still await an
+    admin's first reply.
+
+    First response is measured from a ticket opening to its first admin
+    reply; resolution from opening to a user or admin closing it.
+    Tickets closed by retention are counted as expired and left out of
+    the resolution times.
+    """
+
+    def __init__(self, window_s: float = WINDOWS[-1][1], bucket_s: float = 3600):
+        self.window = window_s
+        self.bucket_s = bucket_s
+        self.buckets = deque()
+        self.replayed = 0
+        self._opened = {}
+        self._awaiting = set()
+        self._backlog = None
+        self._lock = threading.Lock()
+
+    # ---- feeding ----
+    def record(self, ts: float, event: str, ticket_id: str, user_id: int, actor_id=None) -> None:
+        """EventLog subscriber"""
+        with self._lock:
+            if self._backlog is not None:
+                self._backlog.append((ts, event, ticket_id, user_id, actor_id))
+            else:
+                self._apply(ts, event, ticket_id, user_id, actor_id)
+
+    def hold(self) -> None:
+        """Queue live events until replay() has folded in the older ones"""
+        with self._lock:
+            if self._backlog is None:
+                self._backlog = []
+
+    def replay(self, records) -> None:
+        """Fold in events logged before this process started, then the live ones held meanwhile"""
+        self.hold()
+        try:
+            for record in records:
+                with self._lock:
+                    self._apply(*record)
+                    self.replayed += 1
+        finally:
+            with self._lock:
+                backlog, self._backlog = self._backlog, None
+                for record in backlog:
+                    self._apply(*record)
+
+    def _bucket(self, ts: float):
+        """The bucket ts falls in, created if needed; None if it is older than the window"""
+        start = ts - ts % self.bucket_s
+        if not self.buckets or start > self.buckets[-1].start:
+            self.buckets.append(Bucket(start))
+            while self.buckets[0].start <= start - self.window:
+                self.buckets.popleft()
+            return self.buckets[-1]
+        # Timestamps are taken before the log's lock, so one can trail into an earlier bucket
+        if start <= self.buckets[-1].start - self.window:
+            return None
+        index = len(self.buckets)
+        while index and self.buckets[index - 1].start >= start:
+            index -= 1
+            if self.buckets[index].start == start:
+                return self.buckets[index]
+        self.buckets.insert(index, Bucket(start))
+        return self.buckets[index]
+
+    def _apply(self, ts: float, event: str, ticket_id: str, user_id: int, actor_id) -> None:
+        bucket = self._bucket(ts)
+        if event == OPENED:
+            self._opened[ticket_id] = ts
+            self._awaiting.add(ticket_id)
+            if bucket:
+                bucket.opened += 1
+        elif event == MESSAGE:
+            if bucket:
+                bucket.messages += 1
+        elif event == REPLY:
+            first = ticket_id in self._awaiting
+            self._awaiting.discard(ticket_id)
+            opened = self._opened.get(ticket_id)
+            if bucket:
+                _bump(bucket.replies, actor_id)
+                if first and opened is not None:
+                    bucket.first_response[bisect.bisect_left(DURATION_BOUNDS, ts - opened)] += 1
+                    _bump(bucket.first_responses, actor_id)
+        elif event in (CLOSED, EXPIRED):
+            opened = self._opened.pop(ticket_id, None)
+            self._awaiting.discard(ticket_id)
+            if not bucket:
+                return
+            if event == EXPIRED:
+                bucket.expired += 1
+                return
+            bucket.closed += 1
+            if opened is not None:
+                bucket.resolution[bisect.bisect_left(DURATION_BOUNDS, ts - opened)] += 1
+            if actor_id is not None and actor_id != user_id:
+                _bump(bucket.closes, actor_id)
+
+    # ---- reporting ----
+    def report(self, now: float = None) -> dict:
+        """JSON-friendly figures for every window in WINDOWS"""
+        # Buckets keep changing while events arrive; merge a consistent view
+        with self._lock:
+            return build_report([(self.buckets, len(self._opened), len(self._awaiting))], now, self.bucket_s)
+
+    def snapshot(self) -> tuple:
+        """(buckets, open, awaiting) copied under the lock, for build_report() in another process"""
+        with self._lock:
+            return copy.deepcopy(list(self.buckets)), len(self._opened), len(self._awaiting)
+
+def build_report(parts: list, now: float = None, bucket_s: float = 3600) -> dict:
+    """Report over the (buckets, open, awaiting) parts of one or more shards
+
+    Every shard buckets by the same hour boundaries, so merging all of
+    their buckets per window gives the same figures one process would.
+    """
+    now = time.time() if now is None else now
+    windows = {}
+    for name, seconds in WINDOWS:
+        since = now - seconds
+        since -= since % bucket_s
+        windows[name] = _merge([b for buckets, _, _ in parts for b in buckets if b.start >= since])
+    return {
+        "windows": windows,
+        "open": sum(open_count for _, open_count, _ in parts),
+        "awaiting_first_response": sum(awaiting for _, _, awaiting in parts),
+    }
+
+def _merge(buckets: list) -> dict:
+    first_response = [0] * (len(DURATION_BOUNDS) + 1)
+    resolution = [0] * (len(DURATION_BOUNDS) + 1)
+    admins = {}
+    totals = {"opened": 0, "closed": 0, "expired": 0, "messages": 0}
+    for b in buckets:
+        totals["opened"] += b.opened
+        totals["closed"] += b.closed
+        totals["expired"] += b.expired
+        totals["messages"] += b.messages
+        first_response = list(map(add, first_response, b.first_response))
+        resolution = list(map(add, resolution, b.resolution))
+        for field in ("replies", "first_responses", "closes"):
+            for admin_id, count in getattr(b, field).items():
+                _bump(admins.setdefault(str(admin_id), {"replies": 0, "first_responses": 0, "closes": 0}),
+                      field, count)
+    totals["replies"] = sum(a["replies"] for a in admins.values())
+    totals["first_response_s"] = {"count": sum(first_response),
+                                  **{f"p{q}": percentile(first_response, q) for q in PERCENTILES}}
+    totals["resolution_s"] = {"count": sum(resolution),
+                              **{f"p{q}": percentile(resolution, q) for q in PERCENTILES}}
+    totals["admins"] = admins
+    return totals
+
+# ------------------------- FORMATTING -------------------------
+def format_duration(seconds) -> str:
+    if seconds is None:
+        return "—"
+    return f"{int(seconds)}s" if seconds < 60 else format_wait(seconds)
+
+def format_stats(report: dict) -> str:
+    """Text for the admin /stats command"""
+    lines = [f"📊 Support stats — {report['open']} open, "
+             f"{report['awaiting_first_response']} waiting for a first reply"]
+    for name, w in report["windows"].items():
+        fr, res = w["first_response_s"], w["resolution_s"]
+        lines.append(
+            f"\nLast {name}: {w['opened']} opened · {w['closed']} closed · {w['expired']} expired · "
+            f"{w['messages']} messages · {w['replies']} replies\n"
+            f"⏱ First response: median {format_duration(fr['p50'])}, p90 {format_duration(fr['p90'])} "
+            f"({fr['count']} tickets)\n"
+            f"✅ Resolution: median {format_duration(res['p50'])}, p90 {format_duration(res['p90'])} "
+            f"({res['count']} tickets)"
+        )
+    name, longest = list(report["windows"].items())[-1]
+    if longest["admins"]:
+        lines.append(f"\n👤 Admins (last {name}):")
+        ranked = sorted(longest["admins"].items(), key=lambda item: -item[1]["replies"])
+        for admin_id, a in ranked:
+            lines.append(f"• {admin_id}: {a['replies']} replies, {a['first_responses']} first, {a['closes']} closed")
+    return "\n".join(lines)
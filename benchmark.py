@@ -0,0 +1,836 @@
+"""Benchmarks for the ticket store and bot hot paths
+
+Usage:
+    python benchmark.py load [--mappings 100000 1000000] [--admins 3]
+    python benchmark.py shards [--workers 1 2 4] [--updates 20000] [--work-us 500]
+    python benchmark.py engine [--users 2000] [--messages 5] [--admins 3] [--store journal]
+    python benchmark.py stress [--updates 20000] [--users 500] [--threads 16] [--store journal]
+    python benchmark.py loadtest [--bot bot.py] [--users 100] [--messages 3] [--latency-ms 20]
+                                 [--flood-rate 0.01] [--max-p99-ms 500] [--min-throughput 50] [--group]
+    python benchmark.py checks [NAME ...]
+
+loadtest runs a bot against fake_telegram.py and exits non-zero when a
+--max-p99-ms or --min-throughput budget is missed, so it can gate CI.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import signal
+import resource
+import subprocess
+
+# ------------------------- HELPERS -------------------------
+def rss_mb() -> float:
+    """Current resident set size of this process in MiB"""
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+def dir_bytes(path: str) -> int:
+    """Total size of every file under path"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def write_ticket_file(path: str, mappings: int, admins: int) -> None:
+    """Write a legacy-format ticket_data.json with the given number of mappings"""
+    # Each user message fans out to one mapping per admin, and a ticket
+    # typically collects a handful of messages.
+    per_ticket = admins * 5
+    ticket_mappings = {}
+    user_tickets = {}
+    for message_id in range(mappings):
+        ticket_no = message_id // per_ticket
+        ticket_id = f"{ticket_no:08X}"
+        user_id = 10_000_000 + ticket_no
+        ticket_mappings[str(message_id)] = [ticket_id, user_id]
+        user_tickets[str(user_id)] = ticket_id
+    with open(path, "w") as f:
+        json.dump({"ticket_mappings": ticket_mappings, "user_tickets": user_tickets}, f, indent=2)
+
+# ------------------------- LOAD -------------------------
+def measure_load(path: str) -> dict:
+    """Load a ticket file into a fresh JournalStore and report time and memory"""
+    from storage import JournalStore
+
+    base_rss = rss_mb()
+    store = JournalStore(path)
+    started = time.perf_counter()
+    store.load()
+    elapsed = time.perf_counter() - started
+
+    # Round-trip check: typed keys must survive load and answer int lookups
+    message_id, ticket_id, user_id = next(store.index.mappings())
+    assert store.get_mapping(message_id) == (ticket_id, user_id)
+    assert store.get_user_ticket(user_id) == ticket_id
+
+    return {
+        "mappings": len(store.index.messages),
+        "tickets": len(store.index),
+        "load_s": round(elapsed, 3),
+        "rss_mb": round(rss_mb() - base_rss, 1),
+    }
+
+def bench_load(args) -> None:
+    from storage import JournalStore, binary_snapshot_path
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for mappings in args.mappings:
+            path = os.path.join(tmp, f"ticket_data_{mappings}.json")
+            write_ticket_file(path, mappings, args.admins)
+            for label, file_path in (("json", path), ("binary", binary_snapshot_path(path))):
+                if label == "binary":
+                    # The first compaction converts the JSON snapshot
+                    store = JournalStore(path)
+                    store.load()
+                    store.close()
+                size_mb = os.path.getsize(file_path) / (1024 * 1024)
+                # Measure in a fresh interpreter so earlier runs don't skew RSS
+                out = subprocess.run(
+                    [sys.executable, __file__, "_load_child", path],
+                    check=True, capture_output=True, text=True,
+                ).stdout
+                result = json.loads(out)
+                print(
+                    f"{result['mappings']:>9} mappings  {result['tickets']:>8} tickets  {label:<6} "
+                    f"file {size_mb:7.1f} MiB  load {result['load_s']:6.3f}s  rss +{result['rss_mb']:.1f} MiB"
+                )
+
+# ------------------------- SHARDS -------------------------
+def busy_wait(microseconds: int) -> None:
+    """Burn CPU for the given time, standing in for handler work"""
+    end = time.perf_counter() + microseconds / 1_000_000
+    while time.perf_counter() < end:
+        pass
+
+def shard_worker(shard, count, queue, workdir, work_us, admins, results):
+    """Worker target for the shards benchmark: real store work plus simulated handler CPU"""
+    from sharding import shard_store
+    from persistence import WriteBehind
+
+    os.chdir(workdir)
+    store = shard_store(shard, count, "ticket_index.db")
+    persistence = WriteBehind(store)
+    store.load()
+    persistence.start_thread()
+    results.put("ready")
+
+    handled = 0
+    message_id = (shard + 1) * 1_000_000_000
+    while True:
+        update = queue.get()
+        if update is None:
+            break
+        user_id = update["message"]["from"]["id"]
+        ticket_id = store.get_user_ticket(user_id)
+        if not ticket_id:
+            ticket_id = f"{user_id:08X}"
+            store.open_ticket(user_id, ticket_id)
+        for _ in range(admins):
+            message_id += 1
+            store.add_mapping(message_id, ticket_id, user_id)
+        busy_wait(work_us)
+        handled += 1
+
+    persistence.stop()
+    store.close()
+    results.put(handled)
+
+def bench_shards(args) -> None:
+    """Router and shard-process scaling with synthetic handler work
+
+    Each worker does the real store work of an update (open ticket, map
+    one message per admin) and then busy-waits --work-us instead of
+    running the bot's handler: no engine, history, search or Bot API
+    calls. The figures show how the ShardPool spreads CPU-bound work,
+    not what the bots themselves reach; use loadtest for that.
+    """
+    import multiprocessing
+    from sharding import ShardPool
+
+    updates = [
+        {"update_id": i, "message": {"message_id": i, "from": {"id": 1000 + i % args.users}, "text": "help"}}
+        for i in range(args.updates)
+    ]
+    print(f"synthetic handler: store writes plus {args.work_us} us busy-wait per update, not the bot's handler")
+    baseline = None
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = multiprocessing.get_context("spawn").Queue()
+            pool = ShardPool(
+                workers, shard_worker, os.path.join(tmp, "ticket_index.db"),
+                args=(tmp, args.work_us, args.admins, results),
+            )
+            pool.start()
+            for _ in range(workers):
+                results.get()
+
+            started = time.perf_counter()
+            for update in updates:
+                pool.dispatch(update)
+            pool.stop()
+            elapsed = time.perf_counter() - started
+            handled = sum(results.get() for _ in range(workers))
+
+        throughput = handled / elapsed
+        baseline = baseline or throughput
+        print(f"{workers:>3} workers  {handled:>7} updates  {elapsed:6.2f}s  "
+              f"{throughput:8.0f} updates/s  x{throughput / baseline:.2f}")
+
+# ------------------------- LOAD TEST -------------------------
+ADMIN_CHAT = -100_100
+ADMIN_USER = 42
+
+def process_stats(pid: int) -> dict:
+    """Resident memory and bytes written to storage by a running process"""
+    with open(f"/proc/{pid}/statm") as f:
+        rss = int(f.read().split()[1]) * resource.getpagesize()
+    written = 0
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+        written = int(io.get("write_bytes", 0))
+    except (OSError, ValueError):
+        pass
+    return {"rss": rss, "write_bytes": written}
+
+def run_phase(fake, name: str, updates: list, pid: int, workdir: str, timeout: float) -> dict:
+    """Push a batch of updates, wait for every one to be answered and measure the bot
+
+    An update may be given as (update, answer_chat) when its answer goes
+    to another chat than the one it came from.
+    """
+    before = process_stats(pid)
+    disk_before = dir_bytes(workdir)
+    first_latency = len(fake.latencies)
+    started = time.perf_counter()
+    for update in updates:
+        if isinstance(update, tuple):
+            fake.push(*update)
+        else:
+            fake.push(update)
+    completed = fake.wait_idle(timeout)
+    elapsed = time.perf_counter() - started
+    fake.wait_quiet()
+    after = process_stats(pid)
+    latencies = fake.latencies[first_latency:]
+    # Page-cache writes on some filesystems never show up in write_bytes;
+    # fall back to how much the bot's files grew
+    written = after["write_bytes"] - before["write_bytes"] or max(dir_bytes(workdir) - disk_before, 0)
+    return {
+        "phase": name,
+        "updates": len(updates),
+        "answered": len(latencies),
+        "completed": completed,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "rss_growth_mb": round((after["rss"] - before["rss"]) / (1024 * 1024), 2),
+        "disk_bytes_per_update": round(written / len(updates)) if updates else 0,
+    }
+
+def bench_loadtest(args) -> int:
+    from fake_telegram import FakeTelegram, text_update
+
+    fake = FakeTelegram(0, args.latency_ms, args.flood_rate, seed=args.seed)
+    fake.start()
+    bot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.bot)
+    env = dict(
+        os.environ,
+        BOT_TOKEN="123456:LOADTEST",
+        ADMIN_CHAT_ID=str(ADMIN_CHAT),
+        TELEGRAM_API_URL=f"http://127.0.0.1:{fake.port}",
+        WEBHOOK_URL="",
+        WORKERS="1",
+    )
+    if not args.real_limits:
+        # Measure the bot, not Telegram's flood limits
+        env.update(SEND_GLOBAL_RATE="100000", SEND_CHAT_RATE="100000")
+    if args.group:
+        # The admin chat becomes a forum supergroup with one topic per ticket
+        env.update(SUPPORT_GROUP_ID=str(ADMIN_CHAT))
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        log = open(os.path.join(workdir, "bot.log"), "w")
+        proc = subprocess.Popen([sys.executable, bot_path], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            if not fake.polled.wait(60):
+                raise SystemExit("Bot never called getUpdates; see its output above")
+            message_id = 0
+            users = [1_000_000 + i for i in range(args.users)]
+
+            updates = []
+            for round_no in range(args.messages):
+                for user_id in users:
+                    message_id += 1
+                    updates.append(text_update(user_id, user_id, message_id, f"Question {round_no} from {user_id}"))
+            results.append(run_phase(fake, "open", updates, proc.pid, workdir, args.timeout))
+
+            updates = []
+            if args.group:
+                # Write once in every ticket's topic; it is answered by the send to that user
+                for thread_id, posts in fake.topics.items():
+                    user_id = int(re.search(r"\(ID: (\d+)\)", posts[0][1]).group(1))
+                    message_id += 1
+                    updates.append((text_update(ADMIN_CHAT, ADMIN_USER, message_id, "Thanks, looking into it",
+                                                thread_id=thread_id), user_id))
+            else:
+                forwards = [m for m, text in fake.sent[ADMIN_CHAT] if text.startswith("🆕")]
+                for forward_id in forwards:
+                    message_id += 1
+                    updates.append(text_update(ADMIN_CHAT, ADMIN_USER, message_id, "Thanks, looking into it", forward_id))
+            results.append(run_phase(fake, "reply", updates, proc.pid, workdir, args.timeout))
+
+            updates = []
+            for user_id in users:
+                message_id += 1
+                updates.append(text_update(user_id, user_id, message_id, "/close"))
+            results.append(run_phase(fake, "close", updates, proc.pid, workdir, args.timeout))
+        finally:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                proc.wait(30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            log.close()
+            if proc.returncode not in (0, -signal.SIGTERM):
+                with open(os.path.join(workdir, "bot.log")) as f:
+                    print(f.read()[-4000:], file=sys.stderr)
+            fake.stop()
+
+    if args.json:
+        print(json.dumps({"results": results, "api_calls": dict(fake.calls), "floods": fake.floods}, indent=2))
+    else:
+        for r in results:
+            print(f"{r['phase']:>6}  {r['answered']:>6}/{r['updates']:<6} answered  {r['seconds']:7.2f}s  "
+                  f"{r['throughput']:8.1f} upd/s  p50 {r['p50_ms']:7.1f} ms  p99 {r['p99_ms']:7.1f} ms  "
+                  f"rss {r['rss_growth_mb']:+6.2f} MiB  disk {r['disk_bytes_per_update']:>6} B/upd")
+        print(f"API calls: {dict(fake.calls)}  injected 429s: {fake.floods}")
+
+    failures = []
+    for r in results:
+        if not r["completed"]:
+            failures.append(f"{r['phase']}: only {r['answered']} of {r['updates']} updates answered")
+        if args.max_p99_ms and r["p99_ms"] > args.max_p99_ms:
+            failures.append(f"{r['phase']}: p99 {r['p99_ms']} ms over budget {args.max_p99_ms} ms")
+        if args.min_throughput and r["throughput"] < args.min_throughput:
+            failures.append(f"{r['phase']}: {r['throughput']} upd/s under budget {args.min_throughput}")
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+# ------------------------- ENGINE -------------------------
+def bench_engine(args) -> None:
+    """Drive TicketEngine directly: no bot library, no network, real store and history"""
+    from types import SimpleNamespace
+    from storage import open_store
+    from history import HistoryLog
+    from search_index import SearchIndex
+    from events import EventLog
+    from ticket_engine import TicketEngine
+
+    admins = list(range(-100, -100 - args.admins, -1))
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # The store writes its files to the working directory
+        os.chdir(tmp)
+        engine = TicketEngine(
+            open_store(args.store), admin_ids=admins,
+            history=HistoryLog(os.path.join(tmp, "history")),
+            search=SearchIndex(os.path.join(tmp, "search.db")),
+            events=EventLog(os.path.join(tmp, "events.jsonl")),
+        )
+        engine.load()
+        engine.warm()
+        engine.persistence.start_thread()
+        engine.search.start_thread()
+
+        message_id = 0
+        timings = {"user_message": [], "route_reply": [], "admin_message": [], "range_scan": [], "stats": [], "close": []}
+        forwarded = {}
+        for round_no in range(args.messages):
+            for user_id in range(1, args.users + 1):
+                start = time.perf_counter()
+                ticket_id, _ = engine.user_message(user_id, f"question {round_no} about order {user_id}")
+                results = []
+                for admin_id in admins:
+                    message_id += 1
+                    results.append(SimpleNamespace(chat_id=admin_id, ok=True, message=SimpleNamespace(message_id=message_id)))
+                engine.map_delivered(results, ticket_id, user_id)
+                timings["user_message"].append(time.perf_counter() - start)
+                forwarded[user_id] = message_id
+        for user_id, last in forwarded.items():
+            start = time.perf_counter()
+            ticket_id, owner = engine.route_reply(last)
+            timings["route_reply"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            engine.admin_message(ticket_id, owner, admins[0], "thanks, looking into it")
+            timings["admin_message"].append(time.perf_counter() - start)
+        for _ in range(100):
+            start = time.perf_counter()
+            engine.tickets_opened_between(time.time() - 3600, time.time() + 1)
+            timings["range_scan"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            engine.stats_text()
+            timings["stats"].append(time.perf_counter() - start)
+        for user_id in forwarded:
+            start = time.perf_counter()
+            engine.close_user_ticket(user_id)
+            timings["close"].append(time.perf_counter() - start)
+
+        engine.stop_threads()
+        os.chdir(cwd)
+
+    for name, values in timings.items():
+        total = sum(values)
+        print(
+            f"{name:>14} {len(values):>8} ops  {len(values) / total if total else 0:>10.0f} ops/s  "
+            f"p50 {percentile(values, 50) * 1e6:7.1f} us  p99 {percentile(values, 99) * 1e6:7.1f} us"
+        )
+
+# ------------------------- STRESS -------------------------
+def bench_stress(args) -> int:
+    """Hammer TicketEngine from many threads, then check the state is consistent
+
+    Users message, admins reply and tickets close concurrently while the
+    write-behind flusher and forced compactions run, the way telebot's
+    worker threads drive the engine. Afterwards every user must have at
+    most one open ticket, every user message must be in history, and a
+    store reloaded from disk must match the one in memory, and no ticket a
+    message was filed under may be lost: each one is either still open or
+    was closed.
+    """
+    import random
+    import itertools
+    import threading
+    from types import SimpleNamespace
+    from concurrent.futures import ThreadPoolExecutor
+    from storage import JournalStore, SqliteStore
+    from history import HistoryLog, USER
+    from search_index import SearchIndex
+    from events import EventLog
+    from ticket_engine import TicketEngine
+
+    def make_store(tmp):
+        if args.store == "sqlite":
+            return SqliteStore(os.path.join(tmp, "ticket_data.db"), os.path.join(tmp, "ticket_data.json"))
+        return JournalStore(os.path.join(tmp, "ticket_data.json"), compact_every=args.compact_every)
+
+    admins = list(range(-100, -100 - args.admins, -1))
+    rng = random.Random(args.seed)
+    plan = []
+    for _ in range(args.updates):
+        roll = rng.random()
+        kind = "message" if roll < 0.8 else "reply" if roll < 0.92 else "close"
+        plan.append((kind, rng.randrange(1, args.users + 1)))
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        store = make_store(tmp)
+        engine = TicketEngine(
+            store, admin_ids=admins,
+            history=HistoryLog(os.path.join(tmp, "history")),
+            search=SearchIndex(os.path.join(tmp, "search.db")),
+            events=EventLog(os.path.join(tmp, "events.jsonl")),
+        )
+        engine.load()
+        engine.warm()
+        engine.persistence.start_thread()
+        engine.search.start_thread()
+
+        message_ids = itertools.count(1)
+        forwards = {}                     # user_id -> last admin-chat message_id
+        sent = {"message": 0, "reply": 0, "close": 0}
+        filed, closed = set(), set()
+        counted = threading.Lock()
+        errors = []
+
+        def handle(kind, user_id):
+            try:
+                if kind == "message":
+                    ticket_id, _ = engine.user_message(user_id, f"stress message from {user_id}")
+                    with counted:
+                        filed.add(ticket_id)
+                    results = [SimpleNamespace(chat_id=a, ok=True, message=SimpleNamespace(message_id=next(message_ids)))
+                               for a in admins]
+                    engine.map_delivered(results, ticket_id, user_id)
+                    forwards[user_id] = results[-1].message.message_id
+                elif kind == "reply":
+                    mapping = engine.route_reply(forwards.get(user_id, 0))
+                    if mapping:
+                        engine.admin_message(mapping[0], mapping[1], admins[0], "stress reply")
+                else:
+                    ticket_id = engine.close_user_ticket(user_id)
+                    with counted:
+                        closed.add(ticket_id)
+                with counted:
+                    sent[kind] += 1
+            except Exception as e:
+                errors.append(f"{kind} for {user_id}: {type(e).__name__}: {e}")
+
+        stop = threading.Event()
+
+        def compactor():
+            # Snapshots taken while handlers write must still be consistent
+            while not stop.wait(0.05):
+                if hasattr(store, "compact"):
+                    store.compact()
+
+        compaction = threading.Thread(target=compactor, daemon=True)
+        compaction.start()
+        # Switch threads far more often than the default 5 ms to widen race windows
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            for kind, user_id in plan:
+                pool.submit(handle, kind, user_id)
+        elapsed = time.perf_counter() - start
+        sys.setswitchinterval(switch_interval)
+        stop.set()
+        compaction.join()
+
+        failures += errors[:5]
+        if len(errors) > 5:
+            failures.append(f"... {len(errors) - 5} more handler errors")
+
+        open_tickets = store.open_tickets()
+        users = [u for _, u in open_tickets]
+        if len(users) != len(set(users)):
+            failures.append(f"{len(users) - len(set(users))} users have more than one open ticket")
+        lost = filed - closed - {t for t, _ in open_tickets}
+        if lost:
+            failures.append(f"{len(lost)} tickets received messages but are neither open nor closed")
+        for ticket_id, user_id in open_tickets:
+            if store.get_user_ticket(user_id) != ticket_id or store.get_ticket_user(ticket_id) != user_id:
+                failures.append(f"ticket {ticket_id} and user {user_id} don't point at each other")
+                break
+
+        # History lines still queued for the write-behind flush count too
+        engine.persistence.flush()
+        logged = 0
+        for root, _, files in os.walk(os.path.join(tmp, "history")):
+            for name in files:
+                logged += sum(1 for _, role, _, _ in engine.history.entries(name[:-len(".jsonl")]) if role == USER)
+        if logged != sent["message"]:
+            failures.append(f"history holds {logged} user messages, {sent['message']} were sent")
+
+        expected = (sorted(open_tickets), store.counts())
+        engine.stop_threads()
+        reloaded = make_store(tmp)
+        reloaded.load()
+        if (sorted(reloaded.open_tickets()), reloaded.counts()) != expected:
+            failures.append(f"reloaded store differs: {reloaded.counts()} vs {expected[1]}")
+        reloaded.close()
+
+    total = sum(sent.values())
+    print(f"{args.store} store, {args.threads} threads: {total} updates in {elapsed:.2f}s "
+          f"({total / elapsed:.0f} upd/s) — {sent['message']} messages, {sent['reply']} replies, "
+          f"{sent['close']} closes, {len(open_tickets)} tickets open")
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    if not failures:
+        print("OK: one open ticket per user, no lost tickets, history complete, reload matches memory")
+    return 1 if failures else 0
+
+# ------------------------- CHECKS -------------------------
+def check_topic_expiry(store_kind: str, tmp: str) -> list:
+    """A forum-topic ticket that keeps getting messages must outlive the idle TTL, then expire once quiet"""
+    import storage
+    from storage import JournalStore, SqliteStore
+    from history import HistoryLog
+    from search_index import SearchIndex
+    from events import EventLog
+    from retention import Retention
+    from ticket_engine import TicketEngine
+
+    ttl_s = 2.0
+    if store_kind == "sqlite":
+        store = SqliteStore(os.path.join(tmp, "ticket_data.db"), "")
+    else:
+        store = JournalStore(os.path.join(tmp, "ticket_data.json"))
+    # Shrink the activity resolution along with the TTL so this runs in seconds
+    resolution, storage.TOUCH_RESOLUTION_S = storage.TOUCH_RESOLUTION_S, 0.1
+    engine = TicketEngine(
+        store, admin_ids=[], support_group=-100,
+        history=HistoryLog(os.path.join(tmp, "history")),
+        search=SearchIndex(os.path.join(tmp, "search.db")),
+        events=EventLog(None),
+        retention=Retention(store, ticket_ttl_hours=ttl_s / 3600, max_mappings=0),
+    )
+    failures = []
+    try:
+        engine.load()
+        ticket_id, _ = engine.user_message(7, "hello")
+        engine.attach_thread(ticket_id, 7, 555)
+        # Topic mode maps nothing per message; only the messages themselves show activity
+        for i in range(8):
+            time.sleep(ttl_s / 4)
+            if i % 2:
+                engine.admin_message(ticket_id, 7, 42, "still looking")
+            else:
+                engine.user_message(7, f"any news? {i}")
+            if engine.expire():
+                failures.append(f"{store_kind}: active ticket expired {(i + 1) * ttl_s / 4:.1f}s in")
+                break
+        if not failures:
+            time.sleep(ttl_s * 1.25)
+            closed = engine.expire()
+            if [c[0] for c in closed] != [ticket_id]:
+                failures.append(f"{store_kind}: quiet ticket not expired, got {closed}")
+            elif closed[0][2] != 555:
+                failures.append(f"{store_kind}: expiry lost the ticket's topic, got {closed[0][2]}")
+    finally:
+        storage.TOUCH_RESOLUTION_S = resolution
+        engine.stop_threads()
+    return failures
+
+def check_thread_eviction(store_kind: str, tmp: str) -> list:
+    """Capping mappings must never evict a ticket's forum-topic binding while the ticket is open"""
+    from types import SimpleNamespace
+    from storage import JournalStore, SqliteStore
+    from history import HistoryLog
+    from search_index import SearchIndex
+    from events import EventLog
+    from retention import Retention
+    from ticket_engine import TicketEngine
+
+    path = os.path.join(tmp, store_kind)
+    os.makedirs(path)
+    if store_kind == "sqlite":
+        store = SqliteStore(os.path.join(path, "ticket_data.db"), "")
+    else:
+        store = JournalStore(os.path.join(path, "ticket_data.json"))
+    engine = TicketEngine(
+        store, admin_ids=[], support_group=-100,
+        history=HistoryLog(os.path.join(path, "history")),
+        search=SearchIndex(os.path.join(path, "search.db")),
+        events=EventLog(None),
+        retention=Retention(store, ticket_ttl_hours=0, max_mappings=2),
+    )
+    failures = []
+    try:
+        engine.load()
+        topics = {}
+        for user_id in (1, 2, 3):
+            ticket_id, _ = engine.user_message(user_id, "hello")
+            thread_id = 1000 + user_id
+            engine.attach_thread(ticket_id, user_id, thread_id)
+            # Headers posted into the topic are mapped like forwards
+            results = [SimpleNamespace(chat_id=-100, ok=True, message=SimpleNamespace(message_id=thread_id * 10 + i))
+                       for i in range(5)]
+            engine.map_delivered(results, ticket_id, user_id)
+            topics[thread_id] = (ticket_id, user_id)
+        engine.expire()
+        for thread_id, mapping in topics.items():
+            routed = engine.route_reply(thread_id)
+            if routed is None or tuple(routed) != mapping:
+                failures.append(f"{store_kind}: topic {thread_id} no longer routes to {mapping[0]} after eviction")
+        if store.counts()[1] != len(topics):
+            failures.append(f"{store_kind}: {store.counts()[1]} mappings left, expected only the {len(topics)} topics")
+    finally:
+        engine.stop_threads()
+    return failures
+
+def check_webhook_malformed(tmp: str) -> list:
+    """Non-object webhook bodies are refused, and an update that breaks the handler doesn't stop the worker"""
+    import asyncio
+    import urllib.error
+    import urllib.request
+    from webhook_server import WebhookServer
+    from sharding import routing_user
+
+    failures = []
+    handled = []
+
+    async def handler(update):
+        if update.get("update_id") == 2:
+            raise SystemExit("handler bailed out")
+        handled.append(update["update_id"])
+
+    def post(port, body: bytes) -> int:
+        request = urllib.request.Request(f"http://127.0.0.1:{port}/webhook", data=body, method="POST")
+        try:
+            return urllib.request.urlopen(request, timeout=10).status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    async def scenario():
+        server = WebhookServer(handler, host="127.0.0.1", port=0)
+        await server.start()
+        port = server._server.sockets[0].getsockname()[1]
+        loop = asyncio.get_running_loop()
+        for body in (b"[]", b"null", b'"update"', b"42"):
+            status = await loop.run_in_executor(None, post, port, body)
+            if status != 400:
+                failures.append(f"webhook: body {body.decode()} answered {status}, expected 400")
+        # Bypass the HTTP check: a non-object and a handler raising SystemExit reach the worker
+        server.queue.put_nowait([])
+        for update_id in (2, 3):
+            status = await loop.run_in_executor(None, post, port, json.dumps({"update_id": update_id}).encode())
+            if status != 200:
+                failures.append(f"webhook: update {update_id} answered {status}, expected 200")
+        await asyncio.wait_for(server.queue.join(), 5)
+        if handled != [3]:
+            failures.append(f"webhook: worker handled {handled}, expected [3] after the failures")
+        if server.handler_errors != 2:
+            failures.append(f"webhook: {server.handler_errors} handler errors counted, expected 2")
+        await server.stop()
+
+    try:
+        asyncio.run(scenario())
+    except asyncio.TimeoutError:
+        failures.append("webhook: the worker stopped handling updates")
+    for update in ([], None, {"message": []}, {"message": {"reply_to_message": 5, "from": []}}):
+        if routing_user(update, None) != 0:
+            failures.append(f"router: {update!r} did not route to user 0")
+    return failures
+
+def check_chat_isolation(tmp: str) -> list:
+    """One user's burst, waiting out their chat's 1 msg/s limit, must not delay another user's confirmation"""
+    from fake_telegram import FakeTelegram, text_update
+
+    failures = []
+    bot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+    fake = FakeTelegram(0, 20)
+    fake.start()
+    env = dict(os.environ, BOT_TOKEN="123456:CHECK", ADMIN_CHAT_ID=str(ADMIN_CHAT),
+               TELEGRAM_API_URL=f"http://127.0.0.1:{fake.port}", WEBHOOK_URL="", WORKERS="1")
+    with open(os.path.join(tmp, "bot.log"), "w") as log:
+        proc = subprocess.Popen([sys.executable, bot_path], cwd=tmp, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        if not fake.polled.wait(60):
+            return ["chat isolation: bot never polled"]
+        for message_id in range(1, 11):
+            fake.push(text_update(1_000_001, 1_000_001, message_id, f"burst {message_id}"))
+        time.sleep(0.5)
+        started = time.monotonic()
+        fake.push(text_update(1_000_002, 1_000_002, 100, "a single question"))
+        while not fake.sent.get(1_000_002) and time.monotonic() - started < 30:
+            time.sleep(0.02)
+        waited = time.monotonic() - started
+        if waited > 1.0:
+            failures.append(f"chat isolation: the other user's confirmation took {waited:.2f}s")
+        # The burst's replies still arrive, paced by the chat limit
+        while len(fake.sent.get(1_000_001, [])) < 10 and time.monotonic() - started < 30:
+            time.sleep(0.1)
+        if len(fake.sent.get(1_000_001, [])) < 10:
+            failures.append(f"chat isolation: the burst got {len(fake.sent.get(1_000_001, []))} of 10 replies")
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        fake.stop()
+    return failures
+
+CHECKS = {
+    "topic-expiry": lambda tmp: check_topic_expiry("journal", tmp) + check_topic_expiry("sqlite", tmp),
+    "thread-eviction": lambda tmp: check_thread_eviction("journal", tmp) + check_thread_eviction("sqlite", tmp),
+    "webhook-malformed": check_webhook_malformed,
+    "chat-isolation": check_chat_isolation,
+}
+
+def run_checks(args) -> int:
+    """Run the named regression scenarios (default all); exits non-zero if any fails"""
+    unknown = [name for name in args.names if name not in CHECKS]
+    if unknown:
+        print(f"unknown checks: {', '.join(unknown)}; choose from {', '.join(CHECKS)}", file=sys.stderr)
+        return 2
+    failures = []
+    for name in args.names or CHECKS:
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                found = CHECKS[name](tmp)
+            finally:
+                os.chdir(cwd)
+        print(f"{'FAIL' if found else 'OK':>4}  {name}")
+        failures += found
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+# ------------------------- MAIN -------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", help="startup load time and resident memory")
+    load.add_argument("--mappings", type=int, nargs="+", default=[100_000, 1_000_000])
+    load.add_argument("--admins", type=int, default=3)
+    load.set_defaults(func=bench_load)
+
+    shards = sub.add_parser("shards", help="update throughput against worker count, with synthetic handler work")
+    shards.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    shards.add_argument("--updates", type=int, default=20_000)
+    shards.add_argument("--users", type=int, default=2_000)
+    shards.add_argument("--admins", type=int, default=3)
+    shards.add_argument("--work-us", type=int, default=500)
+    shards.set_defaults(func=bench_shards)
+
+    loadtest = sub.add_parser("loadtest", help="scripted workload against a fake Bot API")
+    loadtest.add_argument("--bot", default="bot.py", choices=["bot.py", "working_bot.py"])
+    loadtest.add_argument("--users", type=int, default=100)
+    loadtest.add_argument("--messages", type=int, default=3, help="messages per user in the open phase")
+    loadtest.add_argument("--latency-ms", type=float, default=20, help="fake API latency per request")
+    loadtest.add_argument("--flood-rate", type=float, default=0.0, help="fraction of sendMessage calls answered 429")
+    loadtest.add_argument("--seed", type=int, default=1)
+    loadtest.add_argument("--timeout", type=float, default=120, help="seconds to wait for each phase")
+    loadtest.add_argument("--real-limits", action="store_true", help="keep Telegram's send rate limits")
+    loadtest.add_argument("--group", action="store_true", help="support-group mode: one forum topic per ticket")
+    loadtest.add_argument("--max-p99-ms", type=float, default=0)
+    loadtest.add_argument("--min-throughput", type=float, default=0)
+    loadtest.add_argument("--json", action="store_true")
+    loadtest.set_defaults(func=bench_loadtest)
+
+    engine = sub.add_parser("engine", help="ticket engine operations without any bot library")
+    engine.add_argument("--users", type=int, default=2_000)
+    engine.add_argument("--messages", type=int, default=5, help="messages per user")
+    engine.add_argument("--admins", type=int, default=3)
+    engine.add_argument("--store", default="journal", choices=["journal", "sqlite"])
+    engine.set_defaults(func=bench_engine)
+
+    stress = sub.add_parser("stress", help="concurrent engine updates with consistency checks")
+    stress.add_argument("--updates", type=int, default=20_000)
+    stress.add_argument("--users", type=int, default=500)
+    stress.add_argument("--threads", type=int, default=16)
+    stress.add_argument("--admins", type=int, default=2)
+    stress.add_argument("--store", default="journal", choices=["journal", "sqlite"])
+    stress.add_argument("--compact-every", type=int, default=500)
+    stress.add_argument("--seed", type=int, default=1)
+    stress.set_defaults(func=bench_stress)
+
+    checks = sub.add_parser("checks", help="regression scenarios with pass/fail results")
+    checks.add_argument("names", nargs="*", metavar="NAME", help=f"checks to run (default all): {', '.join(CHECKS)}")
+    checks.set_defaults(func=run_checks)
+
+    child = sub.add_parser("_load_child")
+    child.add_argument("path")
+    child.set_defaults(func=lambda a: print(json.dumps(measure_load(a.path))))
+
+    args = parser.parse_args()
+    sys.exit(args.func(args) or 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,97 +1,255 @@
+import time
+# Startup phases are measured from here; see health.py
+STARTED = time.perf_counter()
+
 import os
-import json
-from uuid import uuid4
+import signal
+import asyncio
 from dotenv import load_dotenv
 try:
-    from telegram import Update
+    from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
     from telegram.ext import (
-        ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
+        ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
     )
+    from telegram.error import BadRequest
 except ImportError:
     # Alternative import for python-telegram-bot
     from telegram.update import Update
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
     from telegram.ext import (
-        ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
+        ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
     )
+    from telegram.error import BadRequest
 from keep_alive import keep_alive
+import ticket_engine as te
+from ticket_engine import TicketEngine
+from coalesce import AsyncCoalescer
+from media import media_kind, file_id_of, describe, fingerprint, caption_with, ALBUM_WINDOW_MS, ALBUM_MAX_ITEMS
+import metrics
+from fanout import fan_out
+from send_queue import AsyncSendQueue, PRIORITY_USER, PRIORITY_ADMIN, PRIORITY_ECHO, GLOBAL_RATE, CHAT_RATE
+from locks import StripedLock
+from ingress import RATE_LIMITED
+import health
+import log
+
+# webhook_server and sharding are imported where they're used, so polling
+# mode with one worker doesn't pay for them at startup
+health.record_phase("imports", time.perf_counter() - STARTED)
+
+# python-telegram-bot adapter for ticket_engine: handlers translate
+# updates into engine calls and send the results through the outbox.
 
 # ------------------------- LOAD ENV -------------------------
 load_dotenv()
+# JSON log lines via a background writer; LOG_LEVEL, LOG_REDACT, LOG_SAMPLE
+log.setup()
+logger = log.get("bot")
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
-ADMIN_CHAT_ID_ENV = os.getenv("ADMIN_CHAT_ID", "").strip()
 
-# Support multiple admin IDs (comma-separated)
-ADMIN_CHAT_IDS = []
-if ADMIN_CHAT_ID_ENV:
-    try:
-        ADMIN_CHAT_IDS = [int(id_str.strip()) for id_str in ADMIN_CHAT_ID_ENV.split(",") if id_str.strip()]
-        print(f"DEBUG: Loaded admin IDs: {ADMIN_CHAT_IDS}")
-    except ValueError as e:
-        print(f"ERROR: Invalid ADMIN_CHAT_ID format: {e}")
-        ADMIN_CHAT_IDS = []
+# Webhook mode is enabled by setting WEBHOOK_URL to the bot's public base URL
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+PORT = int(os.getenv("PORT", "8000"))
+
+# WORKERS > 1 partitions updates by user across that many worker processes
+WORKERS = int(os.getenv("WORKERS", "1"))
+SHARED_INDEX_DB = os.getenv("SHARED_INDEX_DB", "ticket_index.db")
+
+# Bot API base URL; only set to point the bot at a local fake API
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+
+# Maximum number of admin sends in flight at once
+FANOUT_CONCURRENCY = int(os.getenv("ADMIN_FANOUT_CONCURRENCY", "10"))
+
+# All hot-path sends go through one rate-limited queue so bursts stay
+# under Telegram's flood limits and 429s are retried instead of surfaced.
+# SEND_GLOBAL_RATE / SEND_CHAT_RATE override the limits (load tests only).
+outbox = AsyncSendQueue(
+    global_rate=float(os.getenv("SEND_GLOBAL_RATE", GLOBAL_RATE)),
+    chat_rate=float(os.getenv("SEND_CHAT_RATE", CHAT_RATE)),
+)
+
+# Messages a user sends within COALESCE_WINDOW_MS of each other are
+# forwarded to admins as one message (at most COALESCE_MAX_BATCH); 0 disables
+COALESCE_WINDOW_MS = int(os.getenv("COALESCE_WINDOW_MS", "0"))
+COALESCE_MAX_BATCH = int(os.getenv("COALESCE_MAX_BATCH", "10"))
+
+# ------------------------- TICKET ENGINE -------------------------
+# TICKET_STORE selects the backend: "journal" (default) or "sqlite"
+engine = TicketEngine.from_env()
+ADMIN_CHAT_IDS = engine.admin_ids
+if ADMIN_CHAT_IDS:
+    logger.info("config.admins", admin_ids=ADMIN_CHAT_IDS)
+
+# With SUPPORT_GROUP_ID set, tickets go to one forum topic each in that
+# supergroup instead of a copy per admin chat
+SUPPORT_GROUP_ID = engine.support_group
+
+# One topic per ticket even if a text and an album flush at the same time
+topic_locks = StripedLock(64, factory=asyncio.Lock)
 
-# ------------------------- DATA PERSISTENCE -------------------------
 def load_data():
-    """Load ticket data from JSON file"""
-    try:
-        with open("ticket_data.json", "r") as f:
-            data = json.load(f)
-            return data.get("ticket_mappings", {}), data.get("user_tickets", {})
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}, {}
-
-def save_data():
-    """Save ticket data to JSON file"""
-    with open("ticket_data.json", "w") as f:
-        json.dump({
-            "ticket_mappings": ticket_mappings,
-            "user_tickets": user_tickets
-        }, f, indent=2)
-
-# Load data on startup
-ticket_mappings, user_tickets = load_data()
+    """Load ticket data from the configured store; dashboard summaries warm up in the background"""
+    with health.phase("load"):
+        engine.load()
+    engine.warm_async()
+    metrics.watch_store(engine.store, engine.persistence, outbox)
+    health.watch_analytics(engine.analytics.report)
 
 # ------------------------- HELPERS -------------------------
-def new_ticket_id() -> str:
-    """Generate a new unique ticket ID"""
-    return str(uuid4())[:8].upper()
-
-def pretty_user(user) -> str:
-    """Format user information for display"""
-    username = f"@{user.username}" if user.username else "(no username)"
-    first_name = user.first_name or ""
-    last_name = user.last_name or ""
-    return f"{first_name} {last_name} {username}".strip()
+# Sends run as tracked tasks rather than being awaited in the handler:
+# updates are handled one at a time, so waiting out one chat's 1 msg/s
+# limit would hold up every other chat's next update. The send queue
+# keeps each chat's messages in the order they were scheduled.
+background = set()
+
+def in_background(coro) -> None:
+    """Run an admin-side send without waiting for it; on_shutdown waits for what's left"""
+    task = asyncio.get_running_loop().create_task(coro)
+    background.add(task)
+    task.add_done_callback(background_done)
+
+def background_done(task) -> None:
+    background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("background.failed", error=repr(task.exception()))
 
 def is_admin(chat_id: int) -> bool:
     """Check if the given chat ID belongs to an admin"""
-    return chat_id in ADMIN_CHAT_IDS
+    return engine.is_admin(chat_id)
+
+def reply(msg, text: str, **kwargs) -> None:
+    """Reply to msg through the send queue without waiting for delivery; 429s are retried"""
+    in_background(outbox.send(msg.chat_id, lambda: msg.reply_text(text, **kwargs), PRIORITY_USER))
+
+async def notify(bot, user_id: int, ticket_id: str, text: str, priority: int = PRIORITY_USER) -> None:
+    """Send a notice to a ticket's user; a failure is logged, not raised"""
+    try:
+        await outbox.send(user_id, lambda: bot.send_message(chat_id=user_id, text=text), priority)
+    except Exception as e:
+        logger.error("user.notify_failed", ticket_id=ticket_id, user_id=user_id, error=str(e))
+
+async def admit(msg) -> bool:
+    """Anti-spam check for a user's message; False means drop it without doing anything else"""
+    verdict = engine.guard.check(msg.from_user.id, fingerprint(msg), msg.media_group_id)
+    if verdict is None:
+        return True
+    metrics.ingress_dropped.inc(verdict)
+    if verdict == RATE_LIMITED:
+        # Told once per mute; further messages are dropped silently
+        in_background(outbox.send(msg.chat_id, lambda: msg.reply_text(te.muted_notice(engine.guard.mute_s)),
+                                   PRIORITY_ECHO))
+    return False
+
+def open_keyboard(page: int, has_previous: bool, has_next: bool):
+    buttons = []
+    if has_previous:
+        buttons.append(InlineKeyboardButton("◀️ Previous", callback_data=f"open:{page - 1}"))
+    buttons.append(InlineKeyboardButton("🔄 Refresh", callback_data=f"open:{page}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Next ▶️", callback_data=f"open:{page + 1}"))
+    return InlineKeyboardMarkup([buttons])
+
+async def ticket_topic(bot, ticket_id: str, user):
+    """The ticket's forum topic in the support group, created on first use; None if it can't be created"""
+    async with topic_locks(ticket_id):
+        thread_id = engine.ticket_thread(ticket_id)
+        if thread_id is not None or engine.ticket_user(ticket_id) != user.id:
+            # No new topic for a ticket closed while its forward waited
+            return thread_id
+        try:
+            topic = await outbox.send(
+                SUPPORT_GROUP_ID,
+                lambda: bot.create_forum_topic(chat_id=SUPPORT_GROUP_ID, name=te.topic_name(ticket_id, user)),
+                PRIORITY_ADMIN, "createForumTopic",
+            )
+        except Exception as e:
+            logger.error("topic.create_failed", ticket_id=ticket_id, error=str(e))
+            return None
+        engine.attach_thread(ticket_id, user.id, topic.message_thread_id)
+        return topic.message_thread_id
+
+async def close_topic(bot, thread_id) -> None:
+    """Close a closed ticket's forum topic so the group's topic list only shows live tickets"""
+    if thread_id is None:
+        return
+    try:
+        await outbox.send(
+            SUPPORT_GROUP_ID,
+            lambda: bot.close_forum_topic(chat_id=SUPPORT_GROUP_ID, message_thread_id=thread_id),
+            PRIORITY_ECHO, "closeForumTopic",
+        )
+    except Exception as e:
+        logger.error("topic.close_failed", thread_id=thread_id, error=str(e))
+
+async def relay_to_admins(call_for, ticket_id: str, user_id: int, priority: int = PRIORITY_ADMIN,
+                          method: str = "sendMessage", thread_id=None) -> int:
+    """Send call_for(chat_id, thread_id)() to the admins and return how many got it
+
+    In support-group mode (thread_id given) that is one post into the
+    ticket's topic, which routes by thread and needs no mapping;
+    otherwise every admin chat gets a copy concurrently and each
+    delivered copy is mapped to the ticket.
+    """
+    if thread_id is not None:
+        try:
+            await outbox.send(SUPPORT_GROUP_ID, call_for(SUPPORT_GROUP_ID, thread_id), priority, method)
+        except Exception as e:
+            logger.error("topic.post_failed", ticket_id=ticket_id, thread_id=thread_id, error=str(e))
+            return 0
+        return 1
+    results = await fan_out(
+        lambda admin_id: outbox.send(admin_id, call_for(admin_id, None), priority, method),
+        ADMIN_CHAT_IDS,
+        FANOUT_CONCURRENCY,
+    )
+    return engine.map_delivered(results, ticket_id, user_id)
+
+async def send_to_admins(bot, text: str, ticket_id: str, user_id: int, priority: int = PRIORITY_ADMIN,
+                         thread_id=None) -> int:
+    """Send text to every admin, or into the ticket's topic, mapping each delivered copy to the ticket"""
+    return await relay_to_admins(
+        lambda chat_id, thread: lambda: bot.send_message(chat_id=chat_id, text=text, message_thread_id=thread),
+        ticket_id, user_id, priority, thread_id=thread_id,
+    )
+
+async def copy_or_resend(bot, chat_id: int, msg, caption: str, thread_id=None):
+    """Copy a media message server-side, or re-send it by file_id if it can't be copied"""
+    try:
+        return await bot.copy_message(chat_id=chat_id, from_chat_id=msg.chat_id, message_id=msg.message_id,
+                                      caption=caption, message_thread_id=thread_id)
+    except BadRequest:
+        # Protected content can't be copied, but its file_id is still reusable
+        kind = media_kind(msg)
+        return await getattr(bot, f"send_{kind}")(chat_id, file_id_of(msg, kind), caption=caption,
+                                                   message_thread_id=thread_id)
+
+async def copy_album(bot, chat_id: int, messages: list, thread_id=None):
+    """Copy an album as one grouped message, or item by item if it can't be copied as a whole"""
+    # copy_messages only exists from python-telegram-bot 20.8; uv.lock pins 20.7
+    if hasattr(bot, "copy_messages"):
+        try:
+            return await bot.copy_messages(chat_id=chat_id, from_chat_id=messages[0].chat_id,
+                                           message_ids=[m.message_id for m in messages], message_thread_id=thread_id)
+        except BadRequest:
+            pass
+    return [await copy_or_resend(bot, chat_id, m, m.caption, thread_id) for m in messages]
 
 # ------------------------- HANDLERS -------------------------
+@metrics.timed("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
-    chat_id = update.effective_chat.id
-    
-    if is_admin(chat_id):
-        await update.message.reply_text(
-            "👋 Welcome Admin!\n"
-            "You will receive user questions here.\n"
-            "Reply to any message to respond to the user.\n\n"
-            "Use /debug to check your admin status."
-        )
-    else:
-        await update.message.reply_text(
-            "👋 Welcome to Nuner Support!\n"
-            "Send your question and our team will reply here.\n"
-            "📝 Tip: Send one question per message.\n\n"
-            "Use /close to close your current ticket."
-        )
+    reply(update.message, te.START_ADMIN if is_admin(update.effective_chat.id) else te.START_USER)
 
+@metrics.timed("debug")
 async def debug(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /debug command - show debug information"""
     chat_id = update.effective_chat.id
     user = update.effective_user
-    
+    stats = engine.stats()
+
     debug_info = (
         f"🛠 DEBUG INFO:\n"
         f"• Your Chat ID: {chat_id}\n"
@@ -101,244 +259,522 @@ async def debug(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"• ADMIN_CHAT_IDS: {ADMIN_CHAT_IDS}\n"
         f"• Is Admin: {is_admin(chat_id)}\n"
         f"• Bot Token Present: {bool(BOT_TOKEN)}\n"
-        f"• Admin IDs Configured: {bool(ADMIN_CHAT_IDS)}"
+        f"• Admin IDs Configured: {bool(ADMIN_CHAT_IDS)}\n"
+        f"• Persistence: {stats['persistence']}\n"
+        f"• Retention: {stats['retention']}\n"
+        f"• Tickets: {stats['tickets']}\n"
+        f"• Events: {stats['events']}\n"
+        f"• Ingress: {stats['ingress']}\n"
+        f"• Logging: {log.stats()}"
     )
-    
-    print(f"DEBUG: {debug_info}")
-    await update.message.reply_text(debug_info)
 
+    logger.debug("debug.shown", chat_id=chat_id)
+    reply(update.message, debug_info)
+
+@metrics.timed("help")
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command"""
-    if is_admin(update.effective_chat.id):
-        await update.message.reply_text(
-            "ℹ️ Admin Help:\n"
-            "• Reply to any user message to respond\n"
-            "• /reply <TICKET_ID> <message> - reply to a specific ticket\n"
-            "• /close_ticket <TICKET_ID> - close a ticket\n"
-            "• /whoami - show your chat ID\n"
-            "• /debug - show debug information"
-        )
-    else:
-        await update.message.reply_text(
-            "ℹ️ User Help:\n"
-            "• Send a message to create a support ticket\n"
-            "• /close - close your current ticket\n"
-            "• /whoami - show your chat ID"
-        )
+    reply(update.message, te.HELP_ADMIN if is_admin(update.effective_chat.id) else te.HELP_USER)
 
+@metrics.timed("whoami")
 async def whoami(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /whoami command - show user's chat ID and admin status"""
     chat_id = update.effective_chat.id
-    await update.message.reply_text(
-        f"Your Chat ID: {chat_id}\n"
-        f"Admin Status: {'✅ Yes' if is_admin(chat_id) else '❌ No'}"
-    )
+    reply(update.message, te.whoami_text(chat_id, is_admin(chat_id)))
 
+@metrics.timed("close")
 async def close_ticket(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /close command - close user's current ticket"""
     if update.effective_chat.type != "private":
         return
-        
+
     user_id = update.effective_user.id
-    ticket_id = user_tickets.get(user_id)
-    
+    if coalescer is not None:
+        # Forward what the user sent just before /close while the ticket still exists
+        await coalescer.flush_key(user_id)
+
+    # Remove the user's ticket and all mappings for it
+    thread_id = engine.user_thread(user_id) if SUPPORT_GROUP_ID else None
+    ticket_id = engine.close_user_ticket(user_id)
     if not ticket_id:
-        await update.message.reply_text("You don't have any open tickets.")
-        return
-        
-    # Remove user's ticket
-    user_tickets.pop(user_id, None)
-    
-    # Remove all mappings for this ticket
-    global ticket_mappings
-    ticket_mappings = {k: v for k, v in ticket_mappings.items() if v[0] != ticket_id}
-    
-    save_data()
-    await update.message.reply_text(f"✅ Ticket #{ticket_id} has been closed.")
+        reply(update.message, te.NO_OPEN_TICKET)
+        return
+    reply(update.message, te.closed_notice(ticket_id))
+    in_background(close_topic(context.bot, thread_id))
 
+@metrics.timed("close_ticket")
 async def close_ticket_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /close_ticket command - admin closes a specific ticket"""
-    chat_id = update.effective_chat.id
-    
-    if not is_admin(chat_id):
-        await update.message.reply_text("❌ Admin only command.")
-        return
-        
-    if not context.args:
-        await update.message.reply_text("Usage: /close_ticket <TICKET_ID>")
-        return
-        
-    ticket_id = context.args[0].upper()
-    
-    # Find user ID for this ticket
-    user_id = None
-    for uid, tid in user_tickets.items():
-        if tid == ticket_id:
-            user_id = uid
-            break
-            
+    if not is_admin(update.effective_chat.id):
+        reply(update.message, te.ADMIN_ONLY)
+        return
+
+    ticket_id = te.parse_ticket_id(context.args) or topic_ticket(update.message)
+    if not ticket_id:
+        reply(update.message, te.USAGE_CLOSE_TICKET)
+        return
+
+    thread_id = engine.ticket_thread(ticket_id) if SUPPORT_GROUP_ID else None
+    user_id = engine.close_by_admin(ticket_id, update.effective_user.id)
     if not user_id:
-        await update.message.reply_text("Ticket not found.")
-        return
-        
-    # Remove user's ticket
-    user_tickets.pop(user_id, None)
-    
-    # Remove all mappings for this ticket
-    global ticket_mappings
-    ticket_mappings = {k: v for k, v in ticket_mappings.items() if v[0] != ticket_id}
-    
-    save_data()
-    await update.message.reply_text(f"✅ Ticket #{ticket_id} has been closed.")
-    try:
-        await context.bot.send_message(chat_id=user_id, text=f"✅ Your ticket #{ticket_id} has been closed by support.")
-    except Exception as e:
-        print(f"Error notifying user: {e}")
+        reply(update.message, te.TICKET_NOT_FOUND)
+        return
+
+    reply(update.message, te.closed_notice(ticket_id))
+    in_background(close_topic(context.bot, thread_id))
+    in_background(notify(context.bot, user_id, ticket_id, te.closed_by_support(ticket_id)))
 
 # ------------------------- USER HANDLER -------------------------
+@metrics.timed("user_question")
 async def handle_user_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle user questions and create/update tickets"""
-    chat_id = update.effective_chat.id
-    
     # Prevent admins from creating tickets accidentally
-    if is_admin(chat_id):
-        await update.message.reply_text(
-            "👋 You're an admin! \n"
-            "If you want to test user functionality, please use a different account.\n"
-            "To reply to users, reply to their messages in the admin chat."
-        )
+    if is_admin(update.effective_chat.id):
+        reply(update.message, te.ADMIN_AS_USER)
         return
-        
+
     if update.effective_chat.type != "private":
         return
 
     msg = update.message
+    if not await admit(msg):
+        return
     text = (msg.text or "").strip()
     if not text:
-        await msg.reply_text("Please send a text question.")
+        reply(msg, "Please send a text question.")
         return
 
     user_id = msg.from_user.id
+    ticket_id, created = engine.user_message(user_id, text)
 
-    # Check if user already has an open ticket
-    ticket_id = user_tickets.get(user_id)
-    if not ticket_id:
-        ticket_id = new_ticket_id()
-        user_tickets[user_id] = ticket_id
-        await msg.reply_text(f"✅ Your ticket #{ticket_id} has been created. Admin will reply here.\nUse /close to close this ticket.")
+    item = (msg, ticket_id, created, text, context.bot)
+    if coalescer is None:
+        await forward_user_messages(user_id, [item])
     else:
-        await msg.reply_text(f"ℹ️ Your message has been added to ticket #{ticket_id}.")
+        await coalescer.add(user_id, item, len(text))
+
+async def forward_user_messages(user_id: int, items: list):
+    """Confirm and forward one message, or a coalesced burst, from the same ticket"""
+    msg, ticket_id, _, _, bot = items[-1]
+    texts = [text for _, _, _, text, _ in items]
+    created = any(created for _, _, created, _, _ in items)
+    confirmation = te.confirmation(ticket_id, created, len(items))
+    reply(msg, confirmation)
 
     # Forward to admin if admin chat is configured
-    if ADMIN_CHAT_IDS:
-        header = (
-            f"🆕 Ticket #{ticket_id}\n"
-            f"From: {pretty_user(msg.from_user)} (ID: {user_id})\n\n"
-            f"{text}\n\n"
-            f"↩️ Reply by replying to this message."
+    if not engine.admins_configured:
+        reply(msg, te.ADMIN_NOT_CONFIGURED)
+        return
+    in_background(forward_to_admins(msg, ticket_id, user_id, texts, bot))
+
+async def forward_to_admins(msg, ticket_id: str, user_id: int, texts: list, bot) -> None:
+    """Send the forward to every admin, or into the ticket's topic; runs in the background"""
+    thread_id = await ticket_topic(bot, ticket_id, msg.from_user) if SUPPORT_GROUP_ID else None
+    header = te.forward_header(ticket_id, msg.from_user, user_id, texts, in_topic=thread_id is not None)
+    if (SUPPORT_GROUP_ID and thread_id is None) or not await send_to_admins(
+            bot, header, ticket_id, user_id, thread_id=thread_id):
+        reply(msg, te.FORWARD_FAILED)
+
+coalescer = (
+    AsyncCoalescer(forward_user_messages, COALESCE_WINDOW_MS, COALESCE_MAX_BATCH)
+    if COALESCE_WINDOW_MS > 0 else None
+)
+
+# ------------------------- MEDIA -------------------------
+USER_MEDIA = filters.PHOTO | filters.Document.ALL | filters.VIDEO | filters.ANIMATION | filters.AUDIO | filters.VOICE
+
+@metrics.timed("user_media")
+async def handle_user_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Relay a user's photo, document, voice note or video into their ticket"""
+    if is_admin(update.effective_chat.id) or update.effective_chat.type != "private":
+        return
+
+    msg = update.message
+    if not await admit(msg):
+        return
+    user_id = msg.from_user.id
+    if coalescer is not None:
+        # Keep text sent just before the file ahead of it in the admin chat
+        await coalescer.flush_key(user_id)
+    ticket_id, created = engine.user_message(user_id, describe(msg))
+
+    item = (msg, ticket_id, created, context.bot)
+    if msg.media_group_id:
+        await albums.add(("user", msg.media_group_id), item)
+    else:
+        await relay_user_media([item])
+
+async def relay_user_media(items: list):
+    """Confirm and copy one media message, or one album, to every admin"""
+    msg, ticket_id, _, bot = items[0]
+    user_id = msg.from_user.id
+    created = any(created for _, _, created, _ in items)
+    confirmation = te.confirmation(ticket_id, created, len(items), media_kind(msg))
+    reply(msg, confirmation)
+
+    if not engine.admins_configured:
+        reply(msg, te.ADMIN_NOT_CONFIGURED)
+        return
+    in_background(copy_to_admins(items, ticket_id, user_id, bot))
+
+async def copy_to_admins(items: list, ticket_id: str, user_id: int, bot) -> None:
+    """Copy the file or album to every admin, or into the ticket's topic; runs in the background"""
+    msg = items[0][0]
+    thread_id = await ticket_topic(bot, ticket_id, msg.from_user) if SUPPORT_GROUP_ID else None
+    if SUPPORT_GROUP_ID and thread_id is None:
+        reply(msg, te.FORWARD_FAILED)
+        return
+    header = te.media_header(ticket_id, msg.from_user, user_id, len(items), in_topic=thread_id is not None)
+    if len(items) == 1:
+        delivered = await relay_to_admins(
+            lambda chat_id, thread: lambda: copy_or_resend(bot, chat_id, msg, caption_with(header, msg.caption), thread),
+            ticket_id, user_id, method="copyMessage", thread_id=thread_id,
         )
-        try:
-            for admin_id in ADMIN_CHAT_IDS:
-                admin_msg = await context.bot.send_message(chat_id=admin_id, text=header)
-                ticket_mappings[admin_msg.message_id] = (ticket_id, user_id)
-            save_data()
-        except Exception as e:
-            await msg.reply_text("Error sending message to admin. Please try again later.")
-            print(f"Error sending to admin: {e}")
     else:
-        await msg.reply_text("(Admin chat not configured. Set ADMIN_CHAT_ID in .env)")
+        # Albums can't carry a header caption, so the header goes first and every copy is mapped
+        messages = sorted((m for m, _, _, _ in items), key=lambda m: m.message_id)
+        delivered = await send_to_admins(bot, header, ticket_id, user_id, thread_id=thread_id)
+        if delivered:
+            delivered = await relay_to_admins(
+                lambda chat_id, thread: lambda: copy_album(bot, chat_id, messages, thread),
+                ticket_id, user_id, method="copyMessages", thread_id=thread_id,
+            )
+    if not delivered:
+        reply(msg, te.FORWARD_FAILED)
+
+async def relay_admin_media(items: list):
+    """Copy an admin's media reply, or album reply, to the ticket's user"""
+    msg, ticket_id, user_id, bot = items[0]
+    header = te.support_reply(ticket_id)
+    try:
+        if len(items) == 1:
+            caption = caption_with(header, msg.caption)
+            await outbox.send(user_id, lambda: copy_or_resend(bot, user_id, msg, caption), PRIORITY_USER, "copyMessage")
+        else:
+            messages = sorted((m for m, _, _, _ in items), key=lambda m: m.message_id)
+            await outbox.send(user_id, lambda: bot.send_message(chat_id=user_id, text=header), PRIORITY_USER)
+            await outbox.send(user_id, lambda: copy_album(bot, user_id, messages), PRIORITY_USER, "copyMessages")
+    except Exception as e:
+        reply(msg, f"Error sending message to user: {e}")
+        return
+
+    descriptions = [describe(m) for m, _, _, _ in items]
+    for (m, _, _, _), text in zip(items, descriptions):
+        engine.admin_message(ticket_id, user_id, m.from_user.id, text)
+    if not SUPPORT_GROUP_ID:
+        # In the support group everyone already sees the reply in the topic
+        in_background(send_to_admins(bot, te.reply_echo(ticket_id, "\n".join(descriptions)), ticket_id, user_id,
+                                     PRIORITY_ECHO))
+
+async def flush_album(key, items: list):
+    direction, _ = key
+    await (relay_user_media if direction == "user" else relay_admin_media)(items)
+
+# Album items arrive as separate updates; they are relayed together once the group is complete
+albums = AsyncCoalescer(flush_album, ALBUM_WINDOW_MS, ALBUM_MAX_ITEMS)
 
 # ------------------------- ADMIN HANDLERS -------------------------
+@metrics.timed("admin_reply")
 async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle admin replies to user tickets"""
-    chat_id = update.effective_chat.id
-    
-    if not is_admin(chat_id):
+    if not is_admin(update.effective_chat.id):
         return
 
     msg = update.message
     if not msg or not msg.reply_to_message:
         return
 
-    mapping = ticket_mappings.get(msg.reply_to_message.message_id)
+    mapping = engine.route_reply(msg.reply_to_message.message_id)
     if not mapping:
-        await msg.reply_text("This message is not associated with any ticket.")
+        reply(msg, te.NOT_A_TICKET)
         return
 
-    ticket_id, user_id = mapping
+    await relay_admin_message(msg, *mapping, context.bot)
+
+def topic_ticket(msg):
+    """The ticket whose support-group topic msg was posted in, or None"""
+    if not SUPPORT_GROUP_ID or msg.chat_id != SUPPORT_GROUP_ID or not msg.is_topic_message:
+        return None
+    mapping = engine.route_reply(msg.message_thread_id)
+    return mapping[0] if mapping else None
+
+@metrics.timed("topic_reply")
+async def handle_topic_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Relay anything written in a ticket's support-group topic to the ticket's user"""
+    msg = update.message
+    if not msg or not msg.is_topic_message or msg.from_user is None or msg.from_user.is_bot:
+        return
+
+    mapping = engine.route_reply(msg.message_thread_id)
+    if not mapping:
+        reply(msg, te.NOT_A_TICKET)
+        return
+    await relay_admin_message(msg, *mapping, context.bot)
+
+async def relay_admin_message(msg, ticket_id: str, user_id: int, bot) -> None:
+    """Send an admin's text or file to the ticket's user"""
+    if media_kind(msg):
+        item = (msg, ticket_id, user_id, bot)
+        if msg.media_group_id:
+            await albums.add(("admin", msg.media_group_id), item)
+        else:
+            in_background(relay_admin_media([item]))
+        return
     content = msg.text or msg.caption or "(Sent without text)"
+    in_background(deliver_admin_reply(bot, msg, ticket_id, user_id, content))
 
-    # Send reply to user
+async def deliver_admin_reply(bot, msg, ticket_id: str, user_id: int, content: str, sent_notice: str = None) -> None:
+    """Send the text of an admin's msg to the user, record it and echo it to the admin chats; runs in the background"""
     try:
-        await context.bot.send_message(chat_id=user_id, text=f"💬 Support (#{ticket_id}):\n{content}")
-        
-        # Forward admin reply as new message in admin chat and map it
-        for admin_id in ADMIN_CHAT_IDS:
-            admin_forward = await context.bot.send_message(
-                chat_id=admin_id,
-                text=f"💬 You replied to #{ticket_id}:\n{content}"
-            )
-            ticket_mappings[admin_forward.message_id] = (ticket_id, user_id)
-        save_data()
+        await outbox.send(
+            user_id,
+            lambda: bot.send_message(chat_id=user_id, text=te.support_reply(ticket_id, content)),
+            PRIORITY_USER,
+        )
     except Exception as e:
-        await msg.reply_text(f"Error sending message to user: {e}")
+        reply(msg, f"Error sending message to user: {e}")
+        return
+    engine.admin_message(ticket_id, user_id, msg.from_user.id, content)
+
+    # Forward admin reply as new message in admin chat and map it; the
+    # support group needs no echo, the reply is already in the topic
+    if not SUPPORT_GROUP_ID:
+        in_background(send_to_admins(bot, te.reply_echo(ticket_id, content), ticket_id, user_id, PRIORITY_ECHO))
+    if sent_notice:
+        reply(msg, sent_notice)
 
+@metrics.timed("reply")
 async def reply_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /reply command - admin replies to specific ticket"""
-    chat_id = update.effective_chat.id
-    
-    if not is_admin(chat_id):
-        await update.message.reply_text("❌ Admin only command.")
+    if not is_admin(update.effective_chat.id):
+        reply(update.message, te.ADMIN_ONLY)
         return
 
     args = context.args or []
     if len(args) < 2:
-        await update.message.reply_text("Usage: /reply <TICKET_ID> <message>")
+        reply(update.message, te.USAGE_REPLY)
         return
 
-    ticket_id = args[0].upper()
-    message_text = " ".join(args[1:])
-    
-    # Look for ticket in memory
-    user_id = None
-    for uid, t_id in user_tickets.items():
-        if t_id == ticket_id:
-            user_id = uid
+    ticket_id = te.parse_ticket_id(args)
+    user_id = engine.ticket_user(ticket_id)
+    if not user_id:
+        reply(update.message, te.TICKET_NOT_FOUND)
+        return
+
+    content = " ".join(args[1:])
+    in_background(deliver_admin_reply(context.bot, update.message, ticket_id, user_id, content, "✅ Sent to user."))
+
+@metrics.timed("history")
+async def history_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /history command - stream a ticket's conversation in message-sized pages"""
+    chat_id = update.effective_chat.id
+
+    if not is_admin(chat_id):
+        reply(update.message, te.ADMIN_ONLY)
+        return
+
+    parsed = te.parse_history(context.args or [])
+    if not parsed:
+        reply(update.message, te.USAGE_HISTORY)
+        return
+    ticket_id, first = parsed
+
+    # Pages are produced one at a time off the event loop and sent as
+    # soon as they are ready; nothing past the last sent page is read
+    loop = asyncio.get_running_loop()
+    pages = engine.history_pages(ticket_id, first)
+    sent = 0
+    while True:
+        item = await loop.run_in_executor(None, next, pages, None)
+        if item is None:
             break
+        page_no, page = item
+        if page is None:
+            reply(update.message, te.more_history(ticket_id, page_no))
+            break
+        in_background(outbox.send(chat_id, lambda page=page: context.bot.send_message(chat_id=chat_id, text=page),
+                                  PRIORITY_USER))
+        sent += 1
+
+    if not sent:
+        reply(update.message, te.no_history(ticket_id, first))
+
+@metrics.timed("search")
+async def search_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /search command - find tickets whose messages match all terms"""
+    if not is_admin(update.effective_chat.id):
+        reply(update.message, te.ADMIN_ONLY)
+        return
 
-    if not user_id:
-        await update.message.reply_text("Ticket not found.")
+    parsed = te.parse_search(list(context.args or []))
+    if not parsed:
+        reply(update.message, te.USAGE_SEARCH)
         return
 
+    loop = asyncio.get_running_loop()
+    text = await loop.run_in_executor(None, lambda: engine.search_tickets(*parsed))
+    reply(update.message, text)
+
+@metrics.timed("open")
+async def open_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /open command - list open tickets, longest waiting first"""
+    if not is_admin(update.effective_chat.id):
+        reply(update.message, te.ADMIN_ONLY)
+        return
+    # Off the loop: in multi-worker mode the other shards are asked too
+    text, has_previous, has_next = await asyncio.get_running_loop().run_in_executor(None, engine.open_page, 0)
+    reply(update.message, text, reply_markup=open_keyboard(0, has_previous, has_next))
+
+@metrics.timed("stats")
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /stats command - response and resolution times from the running aggregates"""
+    if not is_admin(update.effective_chat.id):
+        reply(update.message, te.ADMIN_ONLY)
+        return
+    text = await asyncio.get_running_loop().run_in_executor(None, engine.stats_text)
+    reply(update.message, text)
+
+@metrics.timed("open_page")
+async def open_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /open pagination buttons by editing the dashboard in place"""
+    query = update.callback_query
+    if not is_admin(query.message.chat.id):
+        await query.answer()
+        return
+    page = int(query.data.split(":", 1)[1])
+    text, has_previous, has_next = await asyncio.get_running_loop().run_in_executor(None, engine.open_page, page)
+    await query.answer()
     try:
-        await context.bot.send_message(chat_id=user_id, text=f"💬 Support (#{ticket_id}):\n{message_text}")
-        await update.message.reply_text("✅ Sent to user.")
-        
-        # Create a mapping for this reply
-        for admin_id in ADMIN_CHAT_IDS:
-            admin_msg = await context.bot.send_message(
-                chat_id=admin_id,
-                text=f"💬 You replied to #{ticket_id}:\n{message_text}"
-            )
-            ticket_mappings[admin_msg.message_id] = (ticket_id, user_id)
-        save_data()
+        await outbox.send(
+            query.message.chat_id,
+            lambda: query.edit_message_text(text, reply_markup=open_keyboard(page, has_previous, has_next)),
+            PRIORITY_USER, "editMessageText",
+        )
     except Exception as e:
-        await update.message.reply_text(f"Error sending message: {e}")
+        # Refresh with nothing changed is rejected as "message is not modified"
+        logger.debug("dashboard.not_updated", error=str(e))
+
+# ------------------------- RETENTION JOB -------------------------
+async def retention_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job queue callback for expire_idle()"""
+    await expire_idle(context.bot)
+
+async def expire_idle(bot) -> None:
+    """Expire idle tickets and cap mappings, then tell each affected user and close their topics"""
+    loop = asyncio.get_running_loop()
+    closed = await loop.run_in_executor(None, engine.expire)
+    for ticket_id, user_id, thread_id in closed:
+        in_background(close_topic(bot, thread_id))
+        in_background(notify(bot, user_id, ticket_id, te.expiry_notice(ticket_id), PRIORITY_ECHO))
+
+async def retention_loop(bot, interval: float) -> None:
+    """expire_idle() every interval seconds until cancelled; used when there is no job queue"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await expire_idle(bot)
+        except Exception:
+            logger.exception("retention.sweep_failed")
 
 # ------------------------- BOT START -------------------------
-def main():
-    """Main function to start the bot"""
-    if not BOT_TOKEN:
-        raise SystemExit("BOT_TOKEN missing. Put it in .env")
-
-    print(f"DEBUG: BOT_TOKEN present: {bool(BOT_TOKEN)}")
-    print(f"DEBUG: ADMIN_CHAT_IDS: {ADMIN_CHAT_IDS}")
-
-    # Start the keep-alive server
-    keep_alive()
-
-    # Build the application
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+retention_task = None
+
+async def on_startup(app):
+    """Start background workers once the event loop is running"""
+    global retention_task
+    engine.persistence.start_async()
+    engine.search.start_thread()
+    interval = engine.retention.interval
+    if app.job_queue is None:
+        # python-telegram-bot without the job-queue extra (APScheduler): sweep from a plain task
+        retention_task = asyncio.get_running_loop().create_task(retention_loop(app.bot, interval))
+    else:
+        app.job_queue.run_repeating(retention_job, interval=interval, first=interval, name="retention")
+    health.mark_ready(STARTED)
+
+async def on_shutdown(app):
+    """Stop the send queue workers and flush pending writes when the application shuts down"""
+    if retention_task is not None:
+        retention_task.cancel()
+        await asyncio.gather(retention_task, return_exceptions=True)
+    await albums.drain()
+    if coalescer is not None:
+        await coalescer.drain()
+    # Background sends can schedule more (a failed delivery answers the admin)
+    while background:
+        await asyncio.gather(*list(background), return_exceptions=True)
+    await outbox.stop()
+    await engine.persistence.stop_async()
+    await asyncio.get_running_loop().run_in_executor(None, engine.history.close)
+    await asyncio.get_running_loop().run_in_executor(None, engine.search.stop)
+    engine.events.close()
+
+async def run_webhook(app):
+    """Serve updates and health routes from one HTTP server on the bot's event loop"""
+    from webhook_server import WebhookServer
+
+    async def process(data):
+        await app.process_update(Update.de_json(data, app.bot))
+
+    server = WebhookServer(process, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET, port=PORT)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await app.initialize()
+    await on_startup(app)
+    await server.start()
+    await app.bot.set_webhook(
+        url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET or None,
+        drop_pending_updates=True,
+    )
+    await app.start()
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        await app.stop()
+        await on_shutdown(app)
+        await app.shutdown()
+
+def run_shard(shard: int, count: int, queue):
+    """Worker process entry point for multi-worker mode"""
+    from sharding import shard_store, serve_views, gather
+    global engine
+    engine = TicketEngine.from_env(shard_store(shard, count, SHARED_INDEX_DB), f"ticket_events.shard{shard}.jsonl")
+    engine.gather = gather
+    load_data()
+    serve_views(engine.views())
+
+    async def serve():
+        app = build_app()
+        await app.initialize()
+        await on_startup(app)
+        await app.start()
+        loop = asyncio.get_running_loop()
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            try:
+                await app.process_update(Update.de_json(data, app.bot))
+            except Exception:
+                logger.exception("shard.update_failed", shard=shard, update_id=data.get("update_id"))
+        await app.stop()
+        await on_shutdown(app)
+        await app.shutdown()
+
+    asyncio.run(serve())
+    engine.store.close()
+
+def build_app():
+    """Build the application and register every handler"""
+    builder = ApplicationBuilder().token(BOT_TOKEN).post_init(on_startup).post_shutdown(on_shutdown)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot")
+    app = builder.build()
 
     # Register command handlers
     app.add_handler(CommandHandler("start", start))
@@ -348,20 +784,72 @@ def main():
     app.add_handler(CommandHandler("close", close_ticket))
     app.add_handler(CommandHandler("close_ticket", close_ticket_admin))
     app.add_handler(CommandHandler("debug", debug))
+    app.add_handler(CommandHandler("history", history_cmd))
+    app.add_handler(CommandHandler("search", search_cmd))
+    app.add_handler(CommandHandler("open", open_cmd))
+    app.add_handler(CommandHandler("stats", stats_cmd))
+    app.add_handler(CallbackQueryHandler(open_page, pattern=r"^open:\d+$"))
 
     # Register message handlers
     app.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.TEXT & ~filters.COMMAND, handle_user_question))
-    
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & USER_MEDIA, handle_user_media))
+
     # Add admin message handlers for each admin chat
     for admin_id in ADMIN_CHAT_IDS:
-        app.add_handler(MessageHandler(filters.Chat(admin_id) & filters.REPLY & ~filters.COMMAND, handle_admin_reply))
-
-    print("🤖 Nuner Support Bot is running...")
-    print("🌐 Keep-alive server is active on port 8000")
-    print("📧 Bot is ready to handle support tickets!")
-    
-    # Start polling for messages
-    app.run_polling(drop_pending_updates=True)
+        if admin_id != SUPPORT_GROUP_ID:
+            app.add_handler(MessageHandler(filters.Chat(admin_id) & filters.REPLY & ~filters.COMMAND, handle_admin_reply))
+    if SUPPORT_GROUP_ID:
+        app.add_handler(MessageHandler(
+            filters.Chat(SUPPORT_GROUP_ID) & ~filters.COMMAND & ~filters.StatusUpdate.ALL, handle_topic_message
+        ))
+
+    return app
+
+def main():
+    """Main function to start the bot"""
+    if not BOT_TOKEN:
+        raise SystemExit("BOT_TOKEN missing. Put it in .env")
+
+    logger.info("config.loaded", bot_token_present=bool(BOT_TOKEN), admin_ids=ADMIN_CHAT_IDS,
+                support_group=SUPPORT_GROUP_ID)
+
+    if WORKERS > 1:
+        from sharding import ShardPool, run_router
+
+        logger.info("bot.running", mode="multi-worker", workers=WORKERS)
+        if not WEBHOOK_URL:
+            keep_alive()
+        pool = ShardPool(WORKERS, run_shard, SHARED_INDEX_DB)
+        pool.start()
+        metrics.add_source(pool.metrics)
+        health.watch_analytics(pool.stats)
+        # Workers load their shards while the router already queues updates for them
+        health.mark_ready(STARTED)
+        try:
+            asyncio.run(run_router(pool, BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, PORT))
+        finally:
+            pool.stop()
+        return
+
+    if not WEBHOOK_URL:
+        # Start the keep-alive server first so /healthz answers while state loads
+        keep_alive()
+
+    load_data()
+    with health.phase("build"):
+        app = build_app()
+
+    if WEBHOOK_URL:
+        logger.info("bot.running", mode="webhook", port=PORT)
+        asyncio.run(run_webhook(app))
+    else:
+        logger.info("bot.running", mode="polling", keep_alive_port=8000)
+
+        # Start polling for messages; SIGINT/SIGTERM stop the app and run on_shutdown
+        app.run_polling(drop_pending_updates=True)
+
+    # Flush and release the store on the way out
+    engine.store.close()
 
 if __name__ == "__main__":
     main()
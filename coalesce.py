@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import log
+
+logger = log.get("coalesce")
+
+# ------------------------- BURST COALESCING -------------------------
+# Messages a user sends in quick succession are held for window_ms after
+# the first one and then handed to flush(key, items) together, so a
+# burst costs one confirmation, one admin forward and one batch of
+# mappings. A batch is flushed early once it holds max_batch items or
+# the next item would push it past max_chars (Telegram rejects messages
+# over 4096 characters).
+
+class AsyncCoalescer:
+    """Per-key burst buffer for the asyncio bot; flush is a coroutine function"""
+
+    def __init__(self, flush, window_ms: int = 1500, max_batch: int = 10, max_chars: int = 3500):
+        self.flush = flush
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.max_chars = max_chars
+        self.batches = 0
+        self.items = 0
+        self._pending = {}
+        self._timers = {}
+
+    def _size(self, key) -> int:
+        return sum(size for _, size in self._pending.get(key, ()))
+
+    async def add(self, key, item, size: int = 0) -> None:
+        if key in self._pending and self._size(key) + size > self.max_chars:
+            await self.flush_key(key)
+        if key not in self._pending:
+            self._pending[key] = []
+            loop = asyncio.get_running_loop()
+            self._timers[key] = loop.call_later(self.window, lambda: loop.create_task(self._expire(key)))
+        self._pending[key].append((item, size))
+        if len(self._pending[key]) >= self.max_batch:
+            await self.flush_key(key)
+
+    async def _expire(self, key) -> None:
+        try:
+            await self.flush_key(key)
+        except Exception:
+            logger.exception("coalesce.flush_failed", key=key)
+
+    async def flush_key(self, key) -> None:
+        """Flush one key's batch now, e.g. before its ticket is closed"""
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            self.batches += 1
+            self.items += len(batch)
+            await self.flush(key, [item for item, _ in batch])
+
+    async def drain(self) -> None:
+        """Flush every pending batch; used on shutdown"""
+        for key in list(self._pending):
+            await self.flush_key(key)
+
+class SyncCoalescer:
+    """Per-key burst buffer for the threaded telebot bot; flush runs on a timer thread"""
+
+    def __init__(self, flush, window_ms: int = 1500, max_batch: int = 10, max_chars: int = 3500):
+        self.flush = flush
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.max_chars = max_chars
+        self.batches = 0
+        self.items = 0
+        self._pending = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, item, size: int = 0) -> None:
+        ready = []
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch and sum(s for _, s in batch) + size > self.max_chars:
+                ready.append(self._take(key))
+                batch = None
+            if batch is None:
+                batch = self._pending[key] = []
+                timer = self._timers[key] = threading.Timer(self.window, self._expire, (key,))
+                timer.daemon = True
+                timer.start()
+            batch.append((item, size))
+            if len(batch) >= self.max_batch:
+                ready.append(self._take(key))
+        # Send outside the lock so other users' messages aren't held up
+        for items in ready:
+            self.flush(key, items)
+
+    def _take(self, key) -> list:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None) or []
+        if batch:
+            self.batches += 1
+            self.items += len(batch)
+        return [item for item, _ in batch]
+
+    def _expire(self, key) -> None:
+        try:
+            self.flush_key(key)
+        except Exception:
+            logger.exception("coalesce.flush_failed", key=key)
+
+    def flush_key(self, key) -> None:
+        """Flush one key's batch now, e.g. before its ticket is closed"""
+        with self._lock:
+            items = self._take(key)
+        if items:
+            self.flush(key, items)
+
+    def drain(self) -> None:
+        """Flush every pending batch; used on shutdown"""
+        with self._lock:
+            keys = list(self._pending)
+        for key in keys:
+            self.flush_key(key)
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import threading
+import log
+
+logger = log.get("events")
+
+# Event types; each is one [ts, event, ticket_id, user_id, actor_id] record
+OPENED = "opened"      # actor: the user
+MESSAGE = "message"    # actor: the user
+REPLY = "reply"        # actor: the admin who replied
+CLOSED = "closed"      # actor: the user (/close) or the admin (/close_ticket)
+EXPIRED = "expired"    # actor: None, closed by retention
+
+# ------------------------- EVENT LOG -------------------------
+class EventLog:
+    """Append-only JSON-lines log of ticket events, passed on to subscribers
+
+    Records are written in the order they are emitted and each
+    subscriber sees them in that order, under the log's lock, so
+    running aggregates never observe a reply before its ticket opened.
+    Once the file passes max_bytes it is rotated to path + ".1" (the
+    previous rotation is dropped). With path=None nothing is written
+    and events only reach subscribers.
+
+    emit() only queues the line in memory; flush() writes the queued
+    lines in one write. The engine's WriteBehind calls it alongside the
+    store flush, and close() flushes what is left.
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = 20 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.emitted = 0
+        self.on_mutation = None
+        self._subscribers = []
+        self._pending = []
+        self._file = None
+        self._lock = threading.Lock()
+        # One writer at a time keeps batches in emit order
+        self._write_lock = threading.Lock()
+        # Rotated file first, then the live one: what earlier runs logged
+        self._previous = {}
+        if path is not None:
+            for p in (f"{path}.1", path):
+                self._previous[p] = os.path.getsize(p) if os.path.exists(p) else 0
+
+    def subscribe(self, fn) -> None:
+        """Call fn(ts, event, ticket_id, user_id, actor_id) for every event from now on"""
+        with self._lock:
+            self._subscribers.append(fn)
+
+    def emit(self, event: str, ticket_id: str, user_id: int, actor_id: int = None, ts: float = None) -> None:
+        record = [round(time.time() if ts is None else ts, 3), event, ticket_id, user_id, actor_id]
+        with self._lock:
+            if self.path is not None:
+                self._pending.append(json.dumps(record, separators=(",", ":")) + "\n")
+            self.emitted += 1
+            for fn in self._subscribers:
+                try:
+                    fn(*record)
+                except Exception:
+                    logger.exception("events.subscriber_failed", event=event)
+        if self.path is not None and self.on_mutation is not None:
+            self.on_mutation()
+
+    def flush(self) -> None:
+        """Append every queued record to the file; blocking"""
+        with self._write_lock:
+            with self._lock:
+                lines, self._pending = self._pending, []
+            if lines:
+                self._write("".join(lines))
+
+    def _write(self, lines: str) -> None:
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(lines)
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._file.close()
+            os.replace(self.path, f"{self.path}.1")
+            self._file = open(self.path, "a", encoding="utf-8")
+            # Earlier runs' lines now sit at the start of the rotated file
+            self._previous = {f"{self.path}.1": self._previous.get(self.path, 0), self.path: 0}
+
+    def previous_records(self, since: float = 0):
+        """Yield records logged before this EventLog was created with ts >= since, oldest first
+
+        Everything emitted since then has already reached the subscribers,
+        so replaying this and then the live events counts each one once.
+        """
+        for path, end in self._previous.items():
+            if not end:
+                continue
+            with open(path, "rb") as f:
+                for line in f:
+                    end -= len(line)
+                    if end < 0:
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record[0] >= since:
+                        yield record
+
+    def close(self) -> None:
+        """Flush and close the file"""
+        self.flush()
+        with self._write_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
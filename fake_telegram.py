@@ -0,0 +1,302 @@
+"""Local stand-in for the Telegram Bot API, for load tests
+
+Serves the handful of methods the bots use (getMe, getUpdates,
+sendMessage, copyMessage, copyMessages, editMessageText,
+createForumTopic, closeForumTopic, answerCallbackQuery, setWebhook, deleteWebhook, getWebhookInfo) with a fixed per-request latency and
+seeded 429 injection on sendMessage. Point a bot at it with
+TELEGRAM_API_URL=http://127.0.0.1:PORT.
+
+Run standalone:
+    python fake_telegram.py [--port 8081] [--latency-ms 20] [--flood-rate 0.01]
+"""
+import json
+import time
+import random
+import threading
+from collections import defaultdict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+
+BOT_USER = {"id": 999000, "is_bot": True, "first_name": "Support", "username": "fake_support_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+# ------------------------- FAKE API -------------------------
+class FakeTelegram:
+    """In-process fake Bot API with update injection and per-update latency tracking
+
+    Updates passed to push() are handed out by getUpdates. The time each
+    update is delivered is remembered per originating chat, and the next
+    sendMessage to that chat completes the oldest one, which gives the
+    update's end-to-end latency as seen from Telegram.
+    """
+
+    def __init__(self, port: int = 8081, latency_ms: float = 0, flood_rate: float = 0.0,
+                 retry_after: int = 1, seed: int = 1):
+        self.port = port
+        self.latency = latency_ms / 1000
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+        self.updates = deque()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.sent = defaultdict(list)        # chat_id -> [(message_id, text)]
+        self.topics = {}                     # message_thread_id -> [(message_id, text)] posted in it
+        self.answer_chats = {}               # update_id -> chat whose next send answers it
+        self.awaiting = defaultdict(deque)   # chat_id -> delivery times of unanswered updates
+        self.latencies = []
+        self.calls = defaultdict(int)
+        self.floods = 0
+        self.polled = threading.Event()
+
+        self._cond = threading.Condition()
+        self._server = None
+
+    # ---- driver side ----
+    def push(self, update: dict, answer_chat: int = None) -> None:
+        """Queue an update; it counts as answered by the next send to answer_chat (default: its own chat)"""
+        with self._cond:
+            update["update_id"] = self.next_update_id
+            self.next_update_id += 1
+            if answer_chat is not None:
+                self.answer_chats[update["update_id"]] = answer_chat
+            self.updates.append(update)
+            self._cond.notify_all()
+
+    def outstanding(self) -> int:
+        with self._cond:
+            return len(self.updates) + sum(len(q) for q in self.awaiting.values())
+
+    def wait_idle(self, timeout: float, stall: float = 15) -> bool:
+        """Wait until every pushed update was delivered and answered
+
+        Gives up early when nothing was answered for stall seconds, e.g.
+        because a reply failed for good.
+        """
+        deadline = time.monotonic() + timeout
+        last, progressed = -1, time.monotonic()
+        while time.monotonic() < deadline:
+            remaining = self.outstanding()
+            if not remaining:
+                return True
+            if remaining != last:
+                last, progressed = remaining, time.monotonic()
+            elif time.monotonic() - progressed > stall:
+                return False
+            time.sleep(0.01)
+        return False
+
+    def wait_quiet(self, quiet: float = 0.3, timeout: float = 10) -> None:
+        """Wait until no API call has arrived for quiet seconds (trailing forwards and echoes)"""
+        if self.flood_rate:
+            # Sends answered 429 come back after retry_after plus jitter
+            quiet = max(quiet, self.retry_after + 0.6)
+        deadline = time.monotonic() + timeout
+        last = -1
+        while time.monotonic() < deadline:
+            total = sum(self.calls.values()) - self.calls["getUpdates"]
+            if total == last:
+                return
+            last = total
+            time.sleep(quiet)
+
+    # ---- API methods ----
+    def _get_updates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        self.polled.set()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.updates and self.updates[0]["update_id"] < offset:
+                self.updates.popleft()
+            while not self.updates and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            batch = [self.updates.popleft() for _ in range(min(limit, len(self.updates)))]
+            now = time.monotonic()
+            for update in batch:
+                chat = self.answer_chats.pop(update["update_id"], None) or _origin_chat(update)
+                self.awaiting[chat].append(now)
+        return batch
+
+    def _send_message(self, params: dict):
+        chat_id = int(params["chat_id"])
+        with self._cond:
+            if self.flood_rate and self.random.random() < self.flood_rate:
+                self.floods += 1
+                return None
+            self.next_message_id += 1
+            message_id = self.next_message_id
+            text = str(params.get("text", ""))
+            self.sent[chat_id].append((message_id, text))
+            self._post_in_topic(params, message_id, text)
+            waiting = self.awaiting.get(chat_id)
+            if waiting:
+                self.latencies.append(time.monotonic() - waiting.popleft())
+        return _message(message_id, chat_id, text)
+
+    def _copy_messages(self, params: dict):
+        chat_id = int(params["chat_id"])
+        ids = params.get("message_ids") or [params.get("message_id")]
+        if isinstance(ids, str):
+            ids = json.loads(ids)
+        copied = []
+        with self._cond:
+            for _ in ids:
+                self.next_message_id += 1
+                copied.append({"message_id": self.next_message_id})
+                self.sent[chat_id].append((self.next_message_id, str(params.get("caption", ""))))
+                self._post_in_topic(params, self.next_message_id, str(params.get("caption", "")))
+            waiting = self.awaiting.get(chat_id)
+            if waiting:
+                self.latencies.append(time.monotonic() - waiting.popleft())
+        return copied
+
+    def _post_in_topic(self, params: dict, message_id: int, text: str) -> None:
+        thread_id = params.get("message_thread_id")
+        if thread_id is not None and int(thread_id) in self.topics:
+            self.topics[int(thread_id)].append((message_id, text))
+
+    def _create_forum_topic(self, params: dict):
+        with self._cond:
+            # A topic's ID is the ID of the service message that opened it
+            self.next_message_id += 1
+            self.topics[self.next_message_id] = []
+        return {"message_thread_id": self.next_message_id, "name": str(params.get("name", "")),
+                "icon_color": 7322096}
+
+    def call(self, method: str, params: dict):
+        """Return (http_status, payload) for one API call"""
+        self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self._get_updates(params)}
+        if method == "sendMessage":
+            result = self._send_message(params)
+            if result is None:
+                return 429, {"ok": False, "error_code": 429,
+                             "description": f"Too Many Requests: retry after {self.retry_after}",
+                             "parameters": {"retry_after": self.retry_after}}
+            return 200, {"ok": True, "result": result}
+        if method == "copyMessage":
+            return 200, {"ok": True, "result": self._copy_messages(params)[0]}
+        if method == "copyMessages":
+            return 200, {"ok": True, "result": self._copy_messages(params)}
+        if method == "createForumTopic":
+            return 200, {"ok": True, "result": self._create_forum_topic(params)}
+        if method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        if method == "editMessageText":
+            return 200, {"ok": True, "result": _message(int(params.get("message_id", 0)),
+                                                         int(params["chat_id"]), str(params.get("text", "")))}
+        if method == "getWebhookInfo":
+            return 200, {"ok": True, "result": {"url": "", "has_custom_certificate": False, "pending_update_count": 0}}
+        # setWebhook, deleteWebhook, answerCallbackQuery, close, ...
+        return 200, {"ok": True, "result": True}
+
+    # ---- HTTP ----
+    def start(self) -> None:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                url = urlparse(self.path)
+                method = url.path.rstrip("/").rsplit("/", 1)[-1]
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                params.update(_parse_body(self.headers.get("Content-Type", ""), body))
+                status, payload = fake.call(method, params)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="fake-telegram").start()
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+# ------------------------- HELPERS -------------------------
+def _parse_body(content_type: str, body: bytes) -> dict:
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    # Form fields carry JSON-encoded values for non-string parameters
+    params = {}
+    for key, value in parse_qsl(body.decode()):
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+def _message(message_id: int, chat_id: int, text: str) -> dict:
+    chat_type = "private" if chat_id > 0 else "supergroup"
+    return {"message_id": message_id, "date": int(time.time()), "from": BOT_USER,
+            "chat": {"id": chat_id, "type": chat_type}, "text": text}
+
+def _origin_chat(update: dict) -> int:
+    for key in ("message", "edited_message"):
+        if key in update:
+            return update[key]["chat"]["id"]
+    if "callback_query" in update:
+        return update["callback_query"]["message"]["chat"]["id"]
+    return 0
+
+def text_update(chat_id: int, user_id: int, message_id: int, text: str, reply_to: int = None,
+                thread_id: int = None) -> dict:
+    """Build a message update the way Telegram sends it"""
+    chat_type = "private" if chat_id > 0 else "supergroup"
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": chat_type},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    if thread_id is not None:
+        message["message_thread_id"] = thread_id
+        message["is_topic_message"] = True
+    if reply_to is not None:
+        message["reply_to_message"] = {
+            "message_id": reply_to, "date": int(time.time()), "from": BOT_USER,
+            "chat": {"id": chat_id, "type": chat_type}, "text": "",
+        }
+    return {"message": message}
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--flood-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    fake = FakeTelegram(args.port, args.latency_ms, args.flood_rate)
+    fake.start()
+    print(f"Fake Bot API on http://127.0.0.1:{fake.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
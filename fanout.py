@@ -0,0 +1,62 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ------------------------- RESULTS -------------------------
+class FanOutResult:
+    """Outcome of sending to one chat: the sent message or the error raised"""
+
+    __slots__ = ("chat_id", "message", "error")
+
+    def __init__(self, chat_id: int, message=None, error: Exception = None):
+        self.chat_id = chat_id
+        self.message = message
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+# ------------------------- ASYNC FAN-OUT -------------------------
+async def fan_out(send, chat_ids, max_concurrency: int = 10) -> list:
+    """Run send(chat_id) for every chat concurrently, at most max_concurrency at a time
+
+    A failure for one chat never cancels the others; every chat gets a
+    FanOutResult in the same order as chat_ids.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def send_one(chat_id):
+        async with semaphore:
+            try:
+                return FanOutResult(chat_id, message=await send(chat_id))
+            except Exception as e:
+                return FanOutResult(chat_id, error=e)
+
+    return await asyncio.gather(*(send_one(chat_id) for chat_id in chat_ids))
+
+# ------------------------- THREADED FAN-OUT -------------------------
+_executor = None
+# telebot handler threads can make their first fan-out at the same time
+_executor_lock = threading.Lock()
+
+def fan_out_sync(send, chat_ids, max_concurrency: int = 10) -> list:
+    """Blocking counterpart of fan_out() for synchronous bots, backed by a shared thread pool"""
+    chat_ids = list(chat_ids)
+    if len(chat_ids) <= 1:
+        return [_send_sync(send, chat_id) for chat_id in chat_ids]
+    return list(_shared_executor(max_concurrency).map(lambda chat_id: _send_sync(send, chat_id), chat_ids))
+
+def _shared_executor(max_concurrency: int) -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="fanout")
+    return _executor
+
+def _send_sync(send, chat_id) -> FanOutResult:
+    try:
+        return FanOutResult(chat_id, message=send(chat_id))
+    except Exception as e:
+        return FanOutResult(chat_id, error=e)
@@ -0,0 +1,74 @@
+import time
+from contextlib import contextmanager
+import metrics
+import log
+
+logger = log.get("startup")
+
+# ------------------------- HEALTH PAYLOADS -------------------------
+# Shared by the Flask keep-alive server and the webhook server so both
+# answer / and /status the same way.
+HOME_TEXT = "Telegram Support Bot is alive and running!"
+_analytics = None
+
+def status_payload() -> dict:
+    """Body of the /status endpoint"""
+    ready = is_ready()
+    return {
+        "status": "online" if ready else "starting",
+        "service": "Telegram Support Bot",
+        "message": "Bot is running and ready to handle support tickets" if ready
+                   else "Bot is loading its state and will start handling updates shortly",
+        "startup": startup_summary(),
+        "metrics": metrics.summary(),
+    }
+
+def stats_payload() -> dict:
+    """Body of the /stats endpoint: rolling SLA figures from analytics.py"""
+    return {"analytics": _analytics() if _analytics is not None else None}
+
+def watch_analytics(report) -> None:
+    """Point /stats at a report function: TicketAnalytics.report, or in multi-worker mode the router's ShardPool.stats"""
+    global _analytics
+    _analytics = report
+
+def liveness() -> tuple:
+    """(status, body) for /healthz: the process is up and serving HTTP"""
+    return 200, "ok"
+
+def readiness() -> tuple:
+    """(status, body) for /readyz: 503 until routing state is loaded and polling can start"""
+    return (200, "ready") if is_ready() else (503, "starting")
+
+# ------------------------- STARTUP PHASES -------------------------
+# Each bot records how long imports, state loading and connecting took
+# and flips ready once it can route updates. Background warm-up that
+# finishes after that is recorded too, without holding readiness back.
+_phases = {}
+_ready_at = None
+
+def record_phase(name: str, seconds: float) -> None:
+    _phases[name] = round(seconds, 4)
+
+@contextmanager
+def phase(name: str):
+    """Time a block of startup work under name"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+def mark_ready(started: float) -> None:
+    """Flip readiness; started is the perf_counter() value taken at the top of the bot module"""
+    global _ready_at
+    if _ready_at is None:
+        _ready_at = time.perf_counter() - started
+        record_phase("total", _ready_at)
+        logger.info("startup.ready", **{f"{name}_ms": round(seconds * 1000, 1) for name, seconds in _phases.items()})
+
+def is_ready() -> bool:
+    return _ready_at is not None
+
+def startup_summary() -> dict:
+    return {"ready": is_ready(), "phases": dict(_phases)}
@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from collections import OrderedDict
+from ticket_ids import is_time_ordered
+
+# Telegram rejects messages longer than 4096 characters
+MESSAGE_LIMIT = 4096
+
+USER = "user"
+ADMIN = "admin"
+
+# ------------------------- HISTORY LOG -------------------------
+class HistoryLog:
+    """Per-ticket conversation history in append-only files
+
+    Each ticket gets its own JSON-lines file holding one compact
+    [ts, role, sender_id, text] array per message, under a two-character
+    prefix directory so no single directory grows unbounded; time-ordered
+    IDs share their leading characters, so those use their last two
+    (random) characters instead. Appending
+    and reading a ticket only touch that ticket's file, so both stay
+    flat however much history exists overall. History outlives the
+    ticket: closing or expiring a ticket keeps its file.
+
+    append() only queues the line in memory, so handlers on the event loop
+    never touch the disk; flush() writes each ticket's queued lines in one
+    write to an append handle kept open for the max_open most recently
+    written tickets. The engine's WriteBehind calls it alongside the store
+    flush, and reading a ticket flushes that ticket first.
+    """
+
+    def __init__(self, root: str = "ticket_history", max_open: int = 256):
+        self.root = root
+        self.max_open = max_open
+        self.on_mutation = None
+        # ticket_id -> lines not yet on disk
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        # ticket_id -> append handle, least recently written first
+        self._handles = OrderedDict()
+        # One writer at a time keeps each ticket's lines in order
+        self._write_lock = threading.Lock()
+
+    def _path(self, ticket_id: str) -> str:
+        prefix = ticket_id[-2:] if is_time_ordered(ticket_id) else ticket_id[:2]
+        return os.path.join(self.root, prefix, f"{ticket_id}.jsonl")
+
+    def exists(self, ticket_id: str) -> bool:
+        """True if the ticket has ever had history, open or closed"""
+        return ticket_id in self._pending or os.path.exists(self._path(ticket_id))
+
+    @staticmethod
+    def valid_id(ticket_id: str) -> bool:
+        return bool(ticket_id) and ticket_id.isalnum() and len(ticket_id) <= 32
+
+    def append(self, ticket_id: str, role: str, sender_id: int, text: str) -> None:
+        """Queue one message for the next flush"""
+        line = json.dumps([int(time.time()), role, sender_id, text], ensure_ascii=False, separators=(",", ":"))
+        with self._pending_lock:
+            self._pending.setdefault(ticket_id, []).append(line + "\n")
+        if self.on_mutation is not None:
+            self.on_mutation()
+
+    def flush(self) -> None:
+        """Append every queued line to its ticket's file; blocking"""
+        with self._write_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            for ticket_id, lines in pending.items():
+                self._write(ticket_id, lines)
+
+    def _flush_ticket(self, ticket_id: str) -> None:
+        with self._write_lock:
+            with self._pending_lock:
+                lines = self._pending.pop(ticket_id, None)
+            if lines:
+                self._write(ticket_id, lines)
+
+    def _write(self, ticket_id: str, lines: list) -> None:
+        f = self._handles.pop(ticket_id, None)
+        if f is None:
+            path = self._path(ticket_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            f = open(path, "a", encoding="utf-8")
+            if len(self._handles) >= self.max_open:
+                self._handles.popitem(last=False)[1].close()
+        self._handles[ticket_id] = f
+        # A single write per batch so readers never see half a record
+        f.write("".join(lines))
+        f.flush()
+
+    def close(self) -> None:
+        """Flush and close every open handle"""
+        self.flush()
+        with self._write_lock:
+            for f in self._handles.values():
+                f.close()
+            self._handles.clear()
+
+    def entries(self, ticket_id: str):
+        """Yield (ts, role, sender_id, text) oldest first, reading the file lazily"""
+        self._flush_ticket(ticket_id)
+        try:
+            f = open(self._path(ticket_id), "r", encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    ts, role, sender_id, text = json.loads(line)
+                except ValueError:
+                    # Line still being written by another worker
+                    break
+                yield ts, role, sender_id, text
+
+    def pages(self, ticket_id: str, limit: int = MESSAGE_LIMIT):
+        """Yield formatted history chunks of at most limit characters each"""
+        page = []
+        size = 0
+        for ts, role, sender_id, text in self.entries(ticket_id):
+            stamp = datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M")
+            who = "👤 User" if role == USER else f"🛠 Admin {sender_id}"
+            entry = f"[{stamp}] {who}:\n{text}\n"
+            # A single oversized message is split across chunks on its own
+            while len(entry) > limit:
+                if page:
+                    yield "\n".join(page)
+                    page, size = [], 0
+                yield entry[:limit]
+                entry = entry[limit:]
+            if size + len(entry) + 1 > limit and page:
+                yield "\n".join(page)
+                page, size = [], 0
+            page.append(entry)
+            size += len(entry) + 1
+        if page:
+            yield "\n".join(page)
@@ -0,0 +1,116 @@
+import time
+import threading
+from collections import OrderedDict
+
+# Verdicts; check() returns None for messages that may go through
+DUPLICATE = "duplicate"        # same content as a recent message from the user
+RATE_LIMITED = "rate_limited"  # this message pushed the user over the limit; they are now muted
+MUTED = "muted"                # the user is serving a mute
+
+# Recent fingerprints remembered per user for duplicate detection
+RECENT_FINGERPRINTS = 8
+
+# ------------------------- INGRESS GUARD -------------------------
+class _UserState:
+    __slots__ = ("window", "previous", "current", "group", "recent")
+
+    def __init__(self):
+        self.window = 0
+        self.previous = 0
+        self.current = 0
+        self.group = None
+        self.recent = {}
+
+class IngressGuard:
+    """Per-user flood and duplicate check, run before a user message does any I/O
+
+    Rates use a sliding-window counter: the count of the current fixed
+    window plus the previous window's count weighted by how much of it
+    still overlaps the sliding window. That is two integers per user
+    instead of a timestamp per message. A user who goes over
+    max_messages per window_s is muted for mute_s; the message that
+    tripped the limit returns RATE_LIMITED (so the bot can say so once)
+    and later ones MUTED until the mute ends. Exact repeats of one of the
+    user's last few messages within duplicate_window_s return DUPLICATE;
+    content is compared by hash only. Items of one album count as one
+    message.
+
+    Memory is bounded: per-user state is an LRU of at most max_users
+    entries and mutes an insertion-ordered map of at most max_users
+    entries, oldest dropped first. Every check is a few dict operations
+    under one lock. max_messages=0 turns rate limiting off and
+    duplicate_window_s=0 the duplicate check.
+    """
+
+    def __init__(self, max_messages: int = 20, window_s: float = 60, duplicate_window_s: float = 30,
+                 mute_s: float = 300, max_users: int = 50000, clock=time.monotonic):
+        self.max_messages = max_messages
+        self.window = window_s
+        self.duplicate_window = duplicate_window_s
+        self.mute_s = mute_s
+        self.max_users = max_users
+        self.clock = clock
+
+        self.checked = 0
+        self.dropped = {DUPLICATE: 0, RATE_LIMITED: 0, MUTED: 0}
+        self._users = OrderedDict()
+        self._mutes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, user_id: int, fingerprint: str, group=None):
+        """None if the message may proceed, else DUPLICATE, RATE_LIMITED or MUTED"""
+        now = self.clock()
+        with self._lock:
+            self.checked += 1
+            verdict = self._check(user_id, hash(fingerprint), group, now)
+            if verdict is not None:
+                self.dropped[verdict] += 1
+            return verdict
+
+    def _check(self, user_id: int, digest: int, group, now: float):
+        until = self._mutes.get(user_id)
+        if until is not None:
+            if now < until:
+                return MUTED
+            del self._mutes[user_id]
+
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState()
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+
+        if self.max_messages and (group is None or group != state.group):
+            window = int(now // self.window)
+            if window != state.window:
+                state.previous = state.current if window == state.window + 1 else 0
+                state.current = 0
+                state.window = window
+            overlap = 1 - (now % self.window) / self.window
+            if state.previous * overlap + state.current >= self.max_messages:
+                self._mute(user_id, now)
+                return RATE_LIMITED
+            state.current += 1
+        state.group = group
+
+        if self.duplicate_window:
+            seen = state.recent.get(digest)
+            if seen is not None and now - seen < self.duplicate_window:
+                return DUPLICATE
+            state.recent.pop(digest, None)
+            state.recent[digest] = now
+            if len(state.recent) > RECENT_FINGERPRINTS:
+                del state.recent[next(iter(state.recent))]
+        return None
+
+    def _mute(self, user_id: int, now: float) -> None:
+        self._mutes[user_id] = now + self.mute_s
+        # Every mute lasts mute_s, so the oldest entries expire first
+        while self._mutes and (len(self._mutes) > self.max_users or next(iter(self._mutes.values())) <= now):
+            self._mutes.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"checked": self.checked, "dropped": dict(self.dropped), "muted_now": len(self._mutes)}
@@ -1,25 +1,54 @@
-from flask import Flask
+import metrics
+import log
 from threading import Thread
+from health import HOME_TEXT, status_payload, stats_payload, liveness, readiness
 
-# Create Flask app for keep-alive functionality
-app = Flask('')
+logger = log.get("keep_alive")
 
-@app.route('/')
-def home():
-    """Health check endpoint to keep the bot alive"""
-    return "Telegram Support Bot is alive and running!"
+def create_app():
+    """Build the Flask app; Flask is imported here so it stays off the bot's startup path"""
+    from flask import Flask, Response
 
-@app.route('/status')
-def status():
-    """Status endpoint for monitoring"""
-    return {
-        "status": "online",
-        "service": "Telegram Support Bot",
-        "message": "Bot is running and ready to handle support tickets"
-    }
+    # Create Flask app for keep-alive functionality
+    app = Flask('')
+
+    @app.route('/')
+    def home():
+        """Health check endpoint to keep the bot alive"""
+        return HOME_TEXT
+
+    @app.route('/status')
+    def status():
+        """Status endpoint for monitoring"""
+        return status_payload()
+
+    @app.route('/stats')
+    def stats():
+        """Response-time and resolution analytics as JSON"""
+        return stats_payload()
+
+    @app.route('/healthz')
+    def healthz():
+        """Liveness probe"""
+        code, body = liveness()
+        return Response(body, status=code, content_type="text/plain")
+
+    @app.route('/readyz')
+    def readyz():
+        """Readiness probe: 503 until the bot has loaded its state"""
+        code, body = readiness()
+        return Response(body, status=code, content_type="text/plain")
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        """Prometheus scrape endpoint"""
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+    return app
 
 def run():
     """Run the Flask server"""
+    app = create_app()
     # Bind to 0.0.0.0 and port 8000 as per requirements
     app.run(host='0.0.0.0', port=8000, debug=False)
 
@@ -28,4 +57,4 @@ def keep_alive():
     t = Thread(target=run)
     t.daemon = True  # Dies when main thread dies
     t.start()
-    print("Keep-alive server started on port 8000")
+    logger.info("keep_alive.started", port=8000)
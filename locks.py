@@ -0,0 +1,17 @@
+import threading
+
+# ------------------------- STRIPED LOCKS -------------------------
+class StripedLock:
+    """A fixed pool of locks handed out by key hash
+
+    Work on different keys (users, tickets) runs in parallel while work
+    on the same key is serialized, without keeping one lock per key alive
+    for ever. Two keys may share a stripe; that only costs some
+    parallelism, never correctness.
+    """
+
+    def __init__(self, stripes: int = 64, factory=threading.RLock):
+        self._locks = [factory() for _ in range(stripes)]
+
+    def __call__(self, key):
+        return self._locks[hash(key) % len(self._locks)]
@@ -0,0 +1,204 @@
+"""Structured JSON logging that keeps formatting and stdout off the hot path
+
+Call sites log an event name plus fields instead of a formatted string:
+
+    logger = log.get(__name__)
+    logger.info("ticket.forwarded", ticket_id=ticket_id, admins=3)
+
+A record is put on a bounded queue in the calling thread and formatted
+and written by a listener thread; when the queue is full the record is
+dropped and counted, so a slow stdout never stalls a handler. Each line
+is one JSON object:
+
+    {"ts": ..., "level": "info", "logger": "bot", "event": "ticket.forwarded",
+     "correlation_id": "u1042", "handler": "message", "user_id": 7, "ticket_id": "...", ...}
+
+metrics.timed() opens a context per update with a correlation ID (the
+update_id when the library exposes one), the handler name and the
+user; the engine binds the ticket once it is known, so every line an
+update produces can be joined to its ticket. Fields named in
+REDACTED_FIELDS (message bodies) are replaced by their length unless
+LOG_REDACT=0. Records logged with sampled=True are high-volume events
+kept at the LOG_SAMPLE rate for their level; the decision is made per
+correlation ID, so a sampled update keeps all of its lines.
+"""
+import os
+import sys
+import json
+import queue
+import random
+import atexit
+import logging
+import itertools
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+# Message bodies; logged as their length unless LOG_REDACT=0
+REDACTED_FIELDS = frozenset({"text", "caption", "content"})
+
+# High-volume (sampled=True) events kept per level; WARNING and above are never sampled
+DEFAULT_SAMPLING = "DEBUG=0.01,INFO=0.1"
+
+# Third-party loggers that log every request (URLs carry message text) below WARNING
+QUIET_LOGGERS = ("httpx", "httpcore", "urllib3", "telegram", "TeleBot", "werkzeug", "apscheduler")
+
+_context = contextvars.ContextVar("log_context", default=None)
+_ids = itertools.count(1)
+_handler = None
+_listener = None
+
+# ------------------------- LOGGERS -------------------------
+class Logger:
+    """Thin wrapper over logging.Logger taking an event name and keyword fields"""
+
+    __slots__ = ("_logger",)
+
+    def __init__(self, name: str):
+        self._logger = logging.getLogger(name)
+
+    def _log(self, level: int, event: str, fields: dict, sampled: bool = False, exc_info=None) -> None:
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, exc_info=exc_info,
+                             extra={"fields": fields, "context": _context.get(), "sampled": sampled})
+
+    def debug(self, event: str, sampled: bool = False, **fields) -> None:
+        self._log(logging.DEBUG, event, fields, sampled)
+
+    def info(self, event: str, sampled: bool = False, **fields) -> None:
+        self._log(logging.INFO, event, fields, sampled)
+
+    def warning(self, event: str, **fields) -> None:
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event: str, **fields) -> None:
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event: str, **fields) -> None:
+        """Error with the current exception's traceback"""
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+def get(name: str) -> Logger:
+    return Logger(name)
+
+# ------------------------- CORRELATION -------------------------
+def begin(handler: str, subject=None):
+    """Open the log context of one update; subject is the handler's first argument
+
+    Returns a token for end(). Works for python-telegram-bot's Update and
+    telebot's Message / CallbackQuery.
+    """
+    update_id = getattr(subject, "update_id", None)
+    correlation_id = f"u{update_id}" if update_id is not None else f"{os.getpid()}-{next(_ids)}"
+    context = {"correlation_id": correlation_id, "handler": handler}
+    user = getattr(subject, "effective_user", None) or getattr(subject, "from_user", None)
+    if user is not None:
+        context["user_id"] = user.id
+    return _context.set(context)
+
+def end(token) -> None:
+    _context.reset(token)
+
+def bind(**fields) -> None:
+    """Add fields (e.g. ticket_id) to every later line of the current update"""
+    context = _context.get()
+    if context is not None:
+        _context.set({**context, **fields})
+
+# ------------------------- OUTPUT -------------------------
+class JsonFormatter(logging.Formatter):
+    def __init__(self, redact: bool = True):
+        super().__init__()
+        self.redact = redact
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        context = getattr(record, "context", None)
+        if context:
+            entry.update(context)
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if self.redact:
+            for key in REDACTED_FIELDS.intersection(entry):
+                value = entry[key]
+                entry[key] = f"<{len(value)} chars>" if isinstance(value, str) else "<redacted>"
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _Sampler(logging.Filter):
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False):
+            return True
+        rate = self.rates.get(record.levelno, 1.0)
+        if rate >= 1:
+            return True
+        context = getattr(record, "context", None)
+        if context is None:
+            return random.random() < rate
+        # Same decision for every line of one update
+        return hash(context["correlation_id"]) % 10000 < rate * 10000
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """Enqueue records as they are; formatting happens on the listener thread"""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def parse_sampling(spec: str) -> dict:
+    """"DEBUG=0.01,INFO=0.1" -> {logging.DEBUG: 0.01, logging.INFO: 0.1}"""
+    rates = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, rate = part.partition("=")
+        level = logging.getLevelName(name.strip().upper())
+        if isinstance(level, int) and level < logging.WARNING:
+            rates[level] = float(rate)
+    return rates
+
+def setup() -> None:
+    """Route all logging through the queue from LOG_LEVEL, LOG_REDACT, LOG_SAMPLE and LOG_QUEUE_SIZE"""
+    global _handler, _listener
+    if _listener is not None:
+        return
+    level = logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").upper())
+    if not isinstance(level, int):
+        level = logging.INFO
+    records = queue.Queue(int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+
+    _handler = _NonBlockingQueueHandler(records)
+    _handler.addFilter(_Sampler(parse_sampling(os.getenv("LOG_SAMPLE", DEFAULT_SAMPLING))))
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter(redact=os.getenv("LOG_REDACT", "1") != "0"))
+    _listener = QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.handlers[:] = [_handler]
+    root.setLevel(level)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(level, logging.WARNING))
+
+def stats() -> dict:
+    if _handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped}
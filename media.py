@@ -0,0 +1,54 @@
+"""Helpers for relaying photos, documents, voice notes and videos
+
+Both bots relay media by reference: copy_message / copy_messages make
+Telegram duplicate the message server-side, and when a message cannot
+be copied (protected content) the file is re-sent by its file_id. No
+file is ever downloaded, so relaying costs the same for a 50 MB video
+as for a sticker-sized photo.
+"""
+
+# Content types relayed between users and admins; all of them accept a caption
+MEDIA_KINDS = ("photo", "document", "video", "animation", "audio", "voice")
+
+# Telegram's caption limit
+CAPTION_LIMIT = 1024
+
+# Albums arrive as one message per item sharing a media_group_id; items
+# are collected for this long before the album is forwarded as a whole
+ALBUM_WINDOW_MS = 1000
+ALBUM_MAX_ITEMS = 10
+
+def media_kind(message):
+    """The message's media type from MEDIA_KINDS, or None for text and other content"""
+    for kind in MEDIA_KINDS:
+        if getattr(message, kind, None):
+            return kind
+    return None
+
+def file_id_of(message, kind: str) -> str:
+    media = getattr(message, kind)
+    # Photos come as a list of sizes, largest last
+    if isinstance(media, (list, tuple)):
+        media = media[-1]
+    return media.file_id
+
+def fingerprint(message) -> str:
+    """What makes two user messages the same for duplicate suppression: text, or file plus caption"""
+    kind = media_kind(message)
+    if not kind:
+        return getattr(message, "text", None) or ""
+    media = getattr(message, kind)
+    if isinstance(media, (list, tuple)):
+        media = media[-1]
+    return f"{kind}:{media.file_unique_id}:{getattr(message, 'caption', None) or ''}"
+
+def describe(message) -> str:
+    """Text stand-in for history, search and admin echoes, e.g. "[photo] receipt" """
+    kind = media_kind(message)
+    caption = getattr(message, "caption", None) or ""
+    return f"[{kind}] {caption}".strip() if kind else caption
+
+def caption_with(header: str, caption) -> str:
+    """Prefix a caption with a header, trimmed to Telegram's caption limit"""
+    text = f"{header}\n\n{caption}" if caption else header
+    return text if len(text) <= CAPTION_LIMIT else text[:CAPTION_LIMIT - 1] + "…"
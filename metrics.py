@@ -0,0 +1,252 @@
+"""Runtime metrics for both bots, rendered in Prometheus text format
+
+Counters and histograms are plain Python objects guarded by one lock
+each, cheap enough to update on every update and every API call.
+Gauges that describe state (open tickets, queue depth) are callbacks
+evaluated only when /metrics is scraped. In multi-worker mode the router
+also renders every worker's samples, labelled with their shard.
+"""
+import time
+import bisect
+import asyncio
+import functools
+import threading
+import log
+
+logger = log.get("updates")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from a fast in-memory handler to a slow API call
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_sources = []
+_started = time.time()
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{n}="{str(v)}"' for n, v in pairs) + "}"
+
+# ------------------------- METRIC TYPES -------------------------
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self.values.values())
+
+    kind = "counter"
+
+    def samples(self):
+        with self._lock:
+            items = list(self.values.items())
+        for labels, value in items:
+            yield self.name, tuple(zip(self.labelnames, labels)), value
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self.series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    kind = "histogram"
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(s[0]), s[1], s[2]) for labels, s in self.series.items()]
+        for labels, counts, total, count in items:
+            pairs = tuple(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket", pairs + (("le", le),), cumulative
+            yield f"{self.name}_sum", pairs, total
+            yield f"{self.name}_count", pairs, count
+
+class Gauge:
+    """Gauge whose value comes from a callback at scrape time"""
+
+    def __init__(self, name: str, help_text: str, fn=None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        _registry.append(self)
+
+    def set_function(self, fn) -> None:
+        self.fn = fn
+
+    def value(self):
+        if self.fn is None:
+            return None
+        try:
+            return self.fn()
+        except Exception:
+            return None
+
+    kind = "gauge"
+
+    def samples(self):
+        value = self.value()
+        if value is not None:
+            yield self.name, (), value
+
+# ------------------------- BOT METRICS -------------------------
+update_duration = Histogram(
+    "bot_update_duration_seconds", "Time spent handling one update", ("handler",)
+)
+update_errors = Counter(
+    "bot_update_errors_total", "Updates whose handler raised", ("handler",)
+)
+api_duration = Histogram(
+    "bot_api_request_duration_seconds", "Telegram Bot API call latency", ("method",)
+)
+api_errors = Counter(
+    "bot_api_errors_total", "Failed Telegram Bot API calls", ("method", "error")
+)
+ingress_dropped = Counter(
+    "bot_ingress_dropped_total", "User messages dropped by the anti-spam guard", ("reason",)
+)
+store_flush_duration = Histogram(
+    "bot_store_flush_duration_seconds", "Time to flush pending ticket writes to disk"
+)
+store_bytes = Gauge("bot_store_disk_bytes", "Bytes on disk used by the ticket store")
+open_tickets = Gauge("bot_open_tickets", "Currently open tickets")
+ticket_mappings = Gauge("bot_ticket_mappings", "Admin message to ticket mappings held")
+send_queue_depth = Gauge("bot_send_queue_depth", "Outbound sends waiting in the send queue")
+webhook_queue_depth = Gauge("bot_webhook_queue_depth", "Webhook updates waiting for a handler")
+flush_pending = Gauge("bot_store_pending_mutations", "Mutations waiting for the next flush")
+uptime = Gauge("bot_uptime_seconds", "Seconds since the process started", lambda: round(time.time() - _started, 1))
+
+# ------------------------- HELPERS -------------------------
+def timed(handler: str):
+    """Decorator recording latency and errors of a sync or async handler
+
+    Each call also opens the update's log context (correlation ID,
+    handler, user) and ends with a sampled "update.handled" line.
+    """
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                token = log.begin(handler, args[0] if args else None)
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    update_errors.inc(handler)
+                    logger.exception("update.failed")
+                    raise
+                finally:
+                    _finish(handler, started, token)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            token = log.begin(handler, args[0] if args else None)
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                update_errors.inc(handler)
+                logger.exception("update.failed")
+                raise
+            finally:
+                _finish(handler, started, token)
+        return wrapper
+    return decorator
+
+def _finish(handler: str, started: float, token) -> None:
+    elapsed = time.perf_counter() - started
+    update_duration.observe(elapsed, handler)
+    logger.info("update.handled", sampled=True, latency_ms=round(elapsed * 1000, 2))
+    log.end(token)
+
+def watch_store(store, persistence=None, outbox=None) -> None:
+    """Point the state gauges at the live store, write-behind and send queue"""
+    store_bytes.set_function(store.disk_bytes)
+    open_tickets.set_function(lambda: store.counts()[0])
+    ticket_mappings.set_function(lambda: store.counts()[1])
+    if persistence is not None:
+        flush_pending.set_function(lambda: persistence.pending)
+    if outbox is not None:
+        send_queue_depth.set_function(outbox.depth)
+
+def families(labels: tuple = ()) -> list:
+    """Every metric as (name, kind, help, samples), each sample's labels extended by labels
+
+    A sample is (series name, ((label, value), ...), value); the result is
+    plain tuples so a worker can send it to the router.
+    """
+    return [
+        (m.name, m.kind, m.help, [(series, pairs + labels, value) for series, pairs, value in m.samples()])
+        for m in _registry
+    ]
+
+def add_source(fn) -> None:
+    """Also render the families fn() returns, e.g. the router pulling its workers'"""
+    _sources.append(fn)
+
+def render() -> str:
+    """All metrics in Prometheus text exposition format"""
+    merged = {}
+    parts = [families()]
+    for fn in _sources:
+        try:
+            parts.append(fn())
+        except Exception:
+            logger.exception("metrics.source_failed")
+    # Samples of one metric from several processes go under a single HELP/TYPE
+    for part in parts:
+        for name, kind, help_text, samples in part:
+            merged.setdefault(name, (kind, help_text, []))[2].extend(samples)
+
+    lines = []
+    for name, (kind, help_text, samples) in merged.items():
+        if not samples and kind == "gauge":
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{series}{_labels(pairs)} {value}" for series, pairs, value in samples)
+    return "\n".join(lines) + "\n"
+
+def summary() -> dict:
+    """Small JSON-friendly overview for /status"""
+    handled = sum(s[2] for s in list(update_duration.series.values()))
+    return {
+        "uptime_seconds": uptime.value(),
+        "updates_handled": handled,
+        "update_errors": update_errors.total(),
+        "api_errors": api_errors.total(),
+        "ingress_dropped": ingress_dropped.total(),
+        "open_tickets": open_tickets.value(),
+        "ticket_mappings": ticket_mappings.value(),
+        "send_queue_depth": send_queue_depth.value(),
+    }
@@ -0,0 +1,141 @@
+import time
+import asyncio
+import threading
+import metrics
+
+# ------------------------- WRITE-BEHIND -------------------------
+class WriteBehind:
+    """Coalesces store writes and flushes them off the handler path
+
+    The store applies every mutation in memory right away and only calls
+    mutated() here. Pending writes are flushed when interval_ms has
+    passed or max_pending mutations have piled up, whichever comes first.
+    bot.py runs the flusher as a task that hands the blocking flush to
+    the default executor; working_bot.py runs it on its own thread.
+    stop() always performs a final flush. Other buffered writers (the
+    history log) can follow() the store and are flushed with it.
+    """
+
+    def __init__(self, store, interval_ms: int = 200, max_pending: int = 100):
+        self.store = store
+        self.interval = interval_ms / 1000
+        self.max_pending = max_pending
+
+        self.pending = 0
+        self.flush_count = 0
+        self.mutations_flushed = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._loop = None
+        self._event = None
+        self._task = None
+        self._thread = None
+        self._thread_event = threading.Event()
+        self._followers = []
+
+        store.on_mutation = self.mutated
+
+    def follow(self, writer) -> None:
+        """Also flush writer (anything with flush() and an on_mutation hook) on every flush"""
+        writer.on_mutation = self.mutated
+        self._followers.append(writer)
+
+    # ---- producers ----
+    def mutated(self) -> None:
+        """Record one pending mutation and wake the flusher once the batch is full"""
+        with self._lock:
+            self.pending += 1
+            full = self.pending >= self.max_pending
+        if full:
+            self._wake()
+
+    def _wake(self) -> None:
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._event.set)
+        self._thread_event.set()
+
+    # ---- flushing ----
+    def flush(self) -> None:
+        """Flush everything pending to disk; blocking"""
+        with self._lock:
+            batch, self.pending = self.pending, 0
+        if not batch:
+            return
+        started = time.perf_counter()
+        self.store.flush()
+        for writer in self._followers:
+            writer.flush()
+        elapsed = (time.perf_counter() - started) * 1000
+        metrics.store_flush_duration.observe(elapsed / 1000)
+        with self._lock:
+            self.flush_count += 1
+            self.mutations_flushed += batch
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self.total_flush_ms += elapsed
+
+    def stats(self) -> dict:
+        """Flush counters for tuning interval_ms and max_pending"""
+        with self._lock:
+            return {
+                "pending": self.pending,
+                "flushes": self.flush_count,
+                "mutations_flushed": self.mutations_flushed,
+                "avg_batch": round(self.mutations_flushed / self.flush_count, 1) if self.flush_count else 0,
+                "last_flush_ms": round(self.last_flush_ms, 2),
+                "avg_flush_ms": round(self.total_flush_ms / self.flush_count, 2) if self.flush_count else 0,
+                "max_flush_ms": round(self.max_flush_ms, 2),
+            }
+
+    # ---- asyncio flusher ----
+    def start_async(self) -> None:
+        """Start the flusher as a task on the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        self._task = self._loop.create_task(self._run_async())
+
+    async def _run_async(self) -> None:
+        while not self._stopped:
+            try:
+                await asyncio.wait_for(self._event.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._event.clear()
+            if self.pending:
+                await self._loop.run_in_executor(None, self.flush)
+        self.flush()
+
+    async def stop_async(self) -> None:
+        """Stop the flusher task after a final flush"""
+        self._stopped = True
+        if self._task is not None:
+            self._event.set()
+            await self._task
+            self._task = None
+        else:
+            self.flush()
+
+    # ---- threaded flusher ----
+    def start_thread(self) -> None:
+        """Start the flusher on a daemon thread"""
+        self._thread = threading.Thread(target=self._run_thread, daemon=True, name="write-behind")
+        self._thread.start()
+
+    def _run_thread(self) -> None:
+        while not self._stopped:
+            self._thread_event.wait(self.interval)
+            self._thread_event.clear()
+            self.flush()
+
+    def stop(self) -> None:
+        """Stop the flusher thread after a final flush"""
+        self._stopped = True
+        if self._thread is not None:
+            self._thread_event.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
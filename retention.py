@@ -0,0 +1,84 @@
+import time
+import threading
+import log
+
+logger = log.get("retention")
+
+# ------------------------- RETENTION -------------------------
+class Retention:
+    """Bounds the ticket state: idle tickets expire, mappings are capped
+
+    Each sweep finds every open ticket with no activity for ticket_ttl
+    seconds and every one opened more than max_age seconds ago (a range
+    scan over the time-ordered ticket IDs) and hands them to the engine to
+    close, then evicts mappings of the least recently active tickets until
+    at most max_mappings remain. A zero ttl, age or cap turns
+    that part off. Sweeps run as a repeating job on the bot's
+    application job queue (bot.py) or on a daemon thread
+    (working_bot.py), never inline in a handler.
+    """
+
+    def __init__(self, store, ticket_ttl_hours: float = 72, max_mappings: int = 100_000,
+                 interval_s: float = 600, max_age_hours: float = 0):
+        self.store = store
+        self.ticket_ttl = ticket_ttl_hours * 3600
+        self.max_age = max_age_hours * 3600
+        self.max_mappings = max_mappings
+        self.interval = interval_s
+
+        self.sweeps = 0
+        self.tickets_expired = 0
+        self.mappings_evicted = 0
+        self.last_sweep_ms = 0.0
+
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def sweep(self, expire) -> list:
+        """Expire idle and aged tickets and enforce the mapping cap; returns what expire returned for each
+
+        expire(ticket_id, user_id) closes one ticket and returns a tuple
+        describing it, or None if it was no longer open by then.
+        """
+        started = time.perf_counter()
+        due = self.store.idle_tickets(self.ticket_ttl) if self.ticket_ttl > 0 else []
+        if self.max_age > 0:
+            due += self.store.tickets_opened_between(0, time.time() - self.max_age)
+        closed = [c for c in (expire(ticket_id, user_id) for ticket_id, user_id in dict(due).items()) if c is not None]
+        evicted = self.store.evict_mappings(self.max_mappings) if self.max_mappings > 0 else []
+        self.sweeps += 1
+        self.tickets_expired += len(closed)
+        self.mappings_evicted += len(evicted)
+        self.last_sweep_ms = (time.perf_counter() - started) * 1000
+        if closed or evicted:
+            logger.info("retention.swept", closed=len(closed), evicted=len(evicted),
+                        duration_ms=round(self.last_sweep_ms, 2))
+        return closed
+
+    def stats(self) -> dict:
+        return {
+            "sweeps": self.sweeps,
+            "tickets_expired": self.tickets_expired,
+            "mappings_evicted": self.mappings_evicted,
+            "last_sweep_ms": round(self.last_sweep_ms, 2),
+        }
+
+    # ---- threaded scheduler ----
+    def start_thread(self, expire, on_closed) -> None:
+        """Sweep every interval on a daemon thread, passing each of expire's results to on_closed"""
+        def run():
+            while not self._stopped.wait(self.interval):
+                try:
+                    for closed in self.sweep(expire):
+                        on_closed(*closed)
+                except Exception:
+                    logger.exception("retention.sweep_failed")
+
+        self._thread = threading.Thread(target=run, daemon=True, name="retention")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,188 @@
+"""Full-text search over ticket history
+
+An SQLite FTS5 table is the inverted index: one row per message with
+the text indexed and ticket_id / ts stored alongside. Handlers only
+queue (ticket_id, role, text) in memory; a background thread inserts
+queued messages in batches, so indexing never runs on the message path.
+
+Backfill from existing history files:
+    python search_index.py rebuild [HISTORY_DIR] [INDEX_DB]
+"""
+import os
+import re
+import time
+import queue
+import sqlite3
+import threading
+import log
+
+logger = log.get("search")
+
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+    text,
+    ticket_id UNINDEXED,
+    role UNINDEXED,
+    ts UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '3 4 5'
+);
+"""
+
+TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+# Terms shorter than this match exactly; shorter prefixes match most of the index
+MIN_PREFIX = 3
+
+# Only the newest matching messages are scored and grouped, so a very
+# common term costs bounded work however large the index grows
+MAX_CANDIDATES = 5000
+
+# ------------------------- SEARCH INDEX -------------------------
+class SearchIndex:
+    """Incrementally maintained inverted index of user and admin messages
+
+    add() is a non-blocking enqueue. The writer thread drains the queue
+    every interval_ms (or once batch_size messages are waiting) and
+    inserts them in one transaction. search() matches every term as a
+    prefix and ranks tickets by BM25 relevance or by latest activity.
+    """
+
+    def __init__(self, path: str = "ticket_search.db", interval_ms: int = 500, batch_size: int = 500):
+        self.path = path
+        self.interval = interval_ms / 1000
+        self.batch_size = batch_size
+        self.available = False
+        self.indexed = 0
+
+        self._queue = queue.Queue()
+        self._conn = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        self._stopped = False
+
+    def load(self) -> None:
+        """Open the index; search stays disabled if this SQLite build lacks FTS5"""
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            self._conn.executescript(SEARCH_SCHEMA)
+        except sqlite3.OperationalError as e:
+            logger.warning("search.disabled", error=str(e))
+            return
+        self.available = True
+
+    # ---- writes ----
+    def add(self, ticket_id: str, role: str, text: str) -> None:
+        """Queue a message for indexing; returns immediately"""
+        if self.available:
+            self._queue.put((text, ticket_id, role, int(time.time())))
+            if self._queue.qsize() >= self.batch_size:
+                self._wake.set()
+
+    def flush(self) -> None:
+        """Insert everything queued so far in one transaction"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT INTO messages (text, ticket_id, role, ts) VALUES (?, ?, ?, ?)", batch)
+        self.indexed += len(batch)
+
+    def start_thread(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True, name="search-index")
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error("search.flush_failed", error=str(e))
+
+    def stop(self) -> None:
+        """Stop the writer after indexing what is still queued"""
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.available:
+            self.flush()
+
+    # ---- reads ----
+    @staticmethod
+    def query_for(terms: str) -> str:
+        """Turn free text into an FTS5 query: every word must match, as a prefix"""
+        words = TERM_RE.findall(terms.lower())
+        return " ".join(f'"{w}"*' if len(w) >= MIN_PREFIX else f'"{w}"' for w in words)
+
+    def search(self, terms: str, limit: int = 10, by_recency: bool = False) -> list:
+        """Return [(ticket_id, matching messages, last match ts)] best first
+
+        Only the MAX_CANDIDATES newest matching messages are considered.
+        """
+        match = self.query_for(terms)
+        if not self.available or not match:
+            return []
+        # rank is the per-message BM25 score and a ticket scores as its best
+        # message. Rowids grow with insertion, so rowid order is recency.
+        order = "last_ts DESC" if by_recency else "score, last_ts DESC"
+        sql = (
+            "SELECT ticket_id, COUNT(*), MAX(ts) AS last_ts, MIN(score) AS score FROM ("
+            "SELECT ticket_id, ts, rank AS score FROM messages WHERE messages MATCH ? "
+            "ORDER BY rowid DESC LIMIT ?"
+            f") GROUP BY ticket_id ORDER BY {order} LIMIT ?"
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, (match, MAX_CANDIDATES, limit)).fetchall()
+        return [(ticket_id, count, last_ts) for ticket_id, count, last_ts, _ in rows]
+
+    def close(self) -> None:
+        self.stop()
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+                self._conn = None
+
+# ------------------------- BACKFILL -------------------------
+def rebuild(history_dir: str, index_path: str) -> int:
+    """Re-index every history file from scratch, returning the number of messages"""
+    from history import HistoryLog
+
+    index = SearchIndex(index_path)
+    index.load()
+    if not index.available:
+        return 0
+    with index._conn:
+        index._conn.execute("DELETE FROM messages")
+    log = HistoryLog(history_dir)
+    count = 0
+    for prefix in sorted(os.listdir(history_dir)):
+        for name in sorted(os.listdir(os.path.join(history_dir, prefix))):
+            ticket_id = name.split(".", 1)[0]
+            rows = [(text, ticket_id, role, ts) for ts, role, _, text in log.entries(ticket_id)]
+            with index._conn:
+                index._conn.executemany("INSERT INTO messages (text, ticket_id, role, ts) VALUES (?, ?, ?, ?)", rows)
+            count += len(rows)
+    with index._conn:
+        index._conn.execute("INSERT INTO messages (messages) VALUES ('optimize')")
+    index.close()
+    return count
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        raise SystemExit("Usage: python search_index.py rebuild [HISTORY_DIR] [INDEX_DB]")
+    history_dir = sys.argv[2] if len(sys.argv) > 2 else "ticket_history"
+    index_path = sys.argv[3] if len(sys.argv) > 3 else "ticket_search.db"
+    print(f"Indexed {rebuild(history_dir, index_path)} messages into {index_path}")
@@ -0,0 +1,341 @@
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+import queue as queue_mod
+import metrics
+from datetime import timedelta
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# ------------------------- PRIORITIES -------------------------
+# Lower value is sent first when the queue is contended
+PRIORITY_USER = 0    # confirmations and replies the user is waiting for
+PRIORITY_ADMIN = 1   # ticket forwards to admins
+PRIORITY_ECHO = 2    # "You replied to ..." copies in admin chats
+
+# Telegram's documented limits: about 30 messages per second overall and
+# about one per second to a single chat, with short bursts tolerated.
+GLOBAL_RATE = 30.0
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+
+# Exception class names (python-telegram-bot, requests, builtins) worth
+# retrying; matched by name so neither bot library has to be imported here.
+TRANSIENT_ERRORS = {"NetworkError", "TimedOut", "ConnectionError", "Timeout", "TimeoutError"}
+
+# ------------------------- HELPERS -------------------------
+class TokenBucket:
+    """Token bucket that hands out reservations instead of blocking"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def wait(self, now: float) -> float:
+        """Seconds until a token is available; takes nothing"""
+        tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def reserve(self, now: float) -> float:
+        """Take one token and return how many seconds to wait before using it"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def block_until(self, now: float, until: float) -> None:
+        """Drain the bucket so the next token is not available before until"""
+        refilled = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.tokens = min(refilled, 1 - (until - now) * self.rate)
+        self.updated = now
+
+def retry_after_of(error: Exception):
+    """Seconds Telegram asked us to wait for a 429, or None if error is not a flood limit"""
+    # python-telegram-bot: telegram.error.RetryAfter.retry_after (int or timedelta)
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is None:
+        # pyTelegramBotAPI: ApiTelegramException with error_code 429
+        if getattr(error, "error_code", None) == 429:
+            params = (getattr(error, "result_json", None) or {}).get("parameters") or {}
+            retry_after = params.get("retry_after", 1)
+    if isinstance(retry_after, timedelta):
+        retry_after = retry_after.total_seconds()
+    return float(retry_after) if retry_after is not None else None
+
+def is_transient(error: Exception) -> bool:
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+class _Limiter:
+    """Global and per-chat token buckets plus the retry policy shared by both queues"""
+
+    def __init__(self, global_rate, chat_rate, chat_burst, max_retries, max_chats, clock):
+        self.clock = clock
+        self.global_bucket = TokenBucket(global_rate, global_rate, clock())
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = OrderedDict()
+        self.max_chats = max_chats
+        self.max_retries = max_retries
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _chat_bucket(self, chat_id, now) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+            if len(self.chat_buckets) > self.max_chats:
+                self.chat_buckets.popitem(last=False)
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def ready_in(self, chat_id) -> float:
+        """Seconds until the chat's bucket has a token; takes nothing"""
+        now = self.clock()
+        return self._chat_bucket(chat_id, now).wait(now)
+
+    def take(self, chat_id) -> None:
+        """Take a token from the chat's bucket once ready_in() is 0"""
+        now = self.clock()
+        self._chat_bucket(chat_id, now).reserve(now)
+
+    def reserve_global(self) -> float:
+        """Take a global token and return how many seconds to wait before using it"""
+        return self.global_bucket.reserve(self.clock())
+
+    def backoff(self, chat_id, error: Exception, attempt: int):
+        """Return the delay before retrying, or None if the error should be raised"""
+        if attempt >= self.max_retries:
+            return None
+        retry_after = retry_after_of(error)
+        if retry_after is not None:
+            # Hold back every send to this chat, not only the one that failed
+            now = self.clock()
+            self._chat_bucket(chat_id, now).block_until(now, now + retry_after)
+            return retry_after + random.uniform(0, 0.5)
+        if is_transient(error):
+            return min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+        return None
+
+# ------------------------- ASYNC QUEUE -------------------------
+class AsyncSendQueue:
+    """Rate-limited priority queue for python-telegram-bot sends
+
+    send() enqueues a zero-argument coroutine factory such as
+    lambda: bot.send_message(...) and resolves with its result once a
+    worker has sent it within the global and per-chat limits. 429s are
+    retried after Telegram's retry_after plus jitter, transient network
+    errors with jittered exponential backoff. Workers start on first use.
+
+    A send whose chat has no token left is parked with that chat's other
+    waiting sends instead of holding a worker, and released in priority
+    order as the chat's bucket refills; one slow admin chat never stalls
+    sends to anyone else. Only the short global wait is slept through.
+    """
+
+    def __init__(self, workers: int = 8, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: int = CHAT_BURST, max_retries: int = 3, max_chats: int = 10_000,
+                 clock=time.monotonic, sleep=asyncio.sleep):
+        self.limiter = _Limiter(global_rate, chat_rate, chat_burst, max_retries, max_chats, clock)
+        self.workers = workers
+        self.sleep = sleep
+        self._queue = None
+        self._tasks = []
+        self._seq = itertools.count()
+        # chat_id -> heap of jobs waiting for that chat's bucket
+        self._parked = {}
+
+    def depth(self) -> int:
+        queued = self._queue.qsize() if self._queue else 0
+        return queued + sum(map(len, self._parked.values()))
+
+    def _start(self) -> None:
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def send(self, chat_id: int, call, priority: int = PRIORITY_ADMIN, method: str = "sendMessage"):
+        if self._queue is None:
+            self._start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((priority, next(self._seq), chat_id, call, method, future, 0, False))
+        return await future
+
+    def _park(self, job) -> bool:
+        """Park a job whose chat is busy; False if it can go now (its chat token is then taken)"""
+        chat_id = job[2]
+        parked = self._parked.get(chat_id)
+        if parked is None:
+            wait = self.limiter.ready_in(chat_id)
+            if not wait:
+                self.limiter.take(chat_id)
+                return False
+            parked = self._parked[chat_id] = []
+            asyncio.get_running_loop().call_later(wait, self._release, chat_id)
+        heapq.heappush(parked, job)
+        return True
+
+    def _release(self, chat_id) -> None:
+        """Hand the chat's best parked job back to the workers once its bucket has a token"""
+        parked = self._parked.get(chat_id)
+        if parked is None or self._queue is None:
+            return
+        wait = self.limiter.ready_in(chat_id)
+        if not wait:
+            self.limiter.take(chat_id)
+            self._queue.put_nowait(heapq.heappop(parked)[:-1] + (True,))
+            if not parked:
+                del self._parked[chat_id]
+                return
+            wait = self.limiter.ready_in(chat_id)
+        asyncio.get_running_loop().call_later(wait, self._release, chat_id)
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            priority, seq, chat_id, call, method, future, attempt, released = job
+            try:
+                if not released and self._park(job):
+                    continue
+                delay = self.limiter.reserve_global()
+                if delay:
+                    await self.sleep(delay)
+                started = time.perf_counter()
+                try:
+                    result = await call()
+                except Exception as e:
+                    metrics.api_errors.inc(method, type(e).__name__)
+                    retry_in = self.limiter.backoff(chat_id, e, attempt)
+                    if retry_in is None:
+                        self.limiter.failed += 1
+                        if not future.done():
+                            future.set_exception(e)
+                    else:
+                        self.limiter.retried += 1
+                        job = (priority, seq, chat_id, call, method, future, attempt + 1, False)
+                        asyncio.get_running_loop().call_later(retry_in, self._queue.put_nowait, job)
+                else:
+                    self.limiter.sent += 1
+                    if not future.done():
+                        future.set_result(result)
+                finally:
+                    metrics.api_duration.observe(time.perf_counter() - started, method)
+            finally:
+                self._queue.task_done()
+
+    async def stop(self) -> None:
+        """Cancel the workers; anything still queued is dropped"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self._parked = {}
+
+# ------------------------- THREADED QUEUE -------------------------
+class SyncSendQueue:
+    """Blocking counterpart of AsyncSendQueue for pyTelegramBotAPI
+
+    send() takes a zero-argument callable such as
+    lambda: bot.send_message(...), blocks until a worker thread has sent
+    it and returns its result or raises its final error. Sends to a busy
+    chat are parked the same way as in AsyncSendQueue.
+    """
+
+    def __init__(self, workers: int = 8, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: int = CHAT_BURST, max_retries: int = 3, max_chats: int = 10_000,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.limiter = _Limiter(global_rate, chat_rate, chat_burst, max_retries, max_chats, clock)
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self._queue = queue_mod.PriorityQueue()
+        self._seq = itertools.count()
+        # chat_id -> heap of jobs waiting for that chat's bucket
+        self._parked = {}
+        self._threads = [
+            threading.Thread(target=self._worker, daemon=True, name=f"send-queue-{i}") for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._queue.qsize() + sum(map(len, self._parked.values()))
+
+    def send(self, chat_id: int, call, priority: int = PRIORITY_ADMIN, method: str = "sendMessage"):
+        future = Future()
+        self._queue.put((priority, next(self._seq), chat_id, call, method, future, 0, False))
+        return future.result()
+
+    def _park(self, job) -> bool:
+        """Park a job whose chat is busy; False if it can go now (its chat token is then taken)"""
+        chat_id = job[2]
+        with self._lock:
+            parked = self._parked.get(chat_id)
+            if parked is None:
+                wait = self.limiter.ready_in(chat_id)
+                if not wait:
+                    self.limiter.take(chat_id)
+                    return False
+                parked = self._parked[chat_id] = []
+                self._release_later(wait, chat_id)
+            heapq.heappush(parked, job)
+            return True
+
+    def _release(self, chat_id) -> None:
+        """Hand the chat's best parked job back to the workers once its bucket has a token"""
+        with self._lock:
+            parked = self._parked[chat_id]
+            wait = self.limiter.ready_in(chat_id)
+            if not wait:
+                self.limiter.take(chat_id)
+                self._queue.put(heapq.heappop(parked)[:-1] + (True,))
+                if not parked:
+                    del self._parked[chat_id]
+                    return
+                wait = self.limiter.ready_in(chat_id)
+            self._release_later(wait, chat_id)
+
+    def _release_later(self, wait: float, chat_id) -> None:
+        timer = threading.Timer(wait, self._release, (chat_id,))
+        timer.daemon = True
+        timer.start()
+
+    def _worker(self) -> None:
+        while True:
+            job = self._queue.get()
+            priority, seq, chat_id, call, method, future, attempt, released = job
+            if not released and self._park(job):
+                continue
+            with self._lock:
+                delay = self.limiter.reserve_global()
+            if delay:
+                self.sleep(delay)
+            started = time.perf_counter()
+            try:
+                result = call()
+            except Exception as e:
+                metrics.api_errors.inc(method, type(e).__name__)
+                with self._lock:
+                    retry_in = self.limiter.backoff(chat_id, e, attempt)
+                if retry_in is None:
+                    self.limiter.failed += 1
+                    future.set_exception(e)
+                else:
+                    self.limiter.retried += 1
+                    job = (priority, seq, chat_id, call, method, future, attempt + 1, False)
+                    timer = threading.Timer(retry_in, self._queue.put, (job,))
+                    timer.daemon = True
+                    timer.start()
+            else:
+                self.limiter.sent += 1
+                future.set_result(result)
+            finally:
+                metrics.api_duration.observe(time.perf_counter() - started, method)
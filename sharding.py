@@ -0,0 +1,447 @@
+"""Multi-worker mode: updates partitioned by user across worker processes
+
+The router process receives raw update dicts (webhook or getUpdates),
+works out which user an update belongs to and puts it on that user's
+shard queue. Each worker process owns the tickets of its shard in its
+own store and handles its queue in order, so per-user ordering holds.
+Admin replies and /reply or /close_ticket commands are routed through a
+SharedIndex that every worker writes its mappings into. Views that need
+every shard (metrics) are pulled from the workers over a pipe each.
+"""
+import os
+import json
+import signal
+import time
+import sqlite3
+import asyncio
+import itertools
+import threading
+import multiprocessing
+import urllib.request
+import log
+import metrics
+from analytics import build_report
+from storage import TicketStore, JournalStore, state_file_exists, read_state_file
+
+logger = log.get("router")
+
+# ------------------------- SHARED INDEX -------------------------
+SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    message_id INTEGER PRIMARY KEY,
+    ticket_id  TEXT NOT NULL,
+    user_id    INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_ticket ON messages(ticket_id);
+CREATE TABLE IF NOT EXISTS tickets (
+    ticket_id TEXT PRIMARY KEY,
+    user_id   INTEGER NOT NULL
+);
+"""
+
+class SharedIndex:
+    """Cross-process routing index (message_id and ticket_id -> user) in a WAL-mode SQLite file
+
+    Each process opens its own connection on first use. Writes commit
+    immediately so the router sees a mapping as soon as the admin copy
+    it points at exists.
+    """
+
+    def __init__(self, path: str = "ticket_index.db"):
+        self.path = path
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SHARED_SCHEMA)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _write(self, statements) -> None:
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+
+    def add_mapping(self, message_id: int, ticket_id: str, user_id: int) -> None:
+        self._write([("INSERT OR REPLACE INTO messages VALUES (?, ?, ?)", (message_id, ticket_id, user_id))])
+
+    def open_ticket(self, user_id: int, ticket_id: str) -> None:
+        self._write([("INSERT OR REPLACE INTO tickets VALUES (?, ?)", (ticket_id, user_id))])
+
+    def close_ticket(self, ticket_id: str) -> None:
+        self._write([
+            ("DELETE FROM messages WHERE ticket_id = ?", (ticket_id,)),
+            ("DELETE FROM tickets WHERE ticket_id = ?", (ticket_id,)),
+        ])
+
+    def remove_messages(self, message_ids) -> None:
+        self._write([("DELETE FROM messages WHERE message_id = ?", (m,)) for m in message_ids])
+
+    def lookup_message(self, message_id: int):
+        with self._lock:
+            return self._connection().execute(
+                "SELECT ticket_id, user_id FROM messages WHERE message_id = ?", (message_id,)
+            ).fetchone()
+
+    def ticket_user(self, ticket_id: str):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT user_id FROM tickets WHERE ticket_id = ?", (ticket_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+# ------------------------- SHARDED STORE -------------------------
+class ShardedStore(TicketStore):
+    """A worker's local store that mirrors routing entries into the SharedIndex"""
+
+    def __init__(self, local: TicketStore, shared: SharedIndex, shard: int, count: int,
+                 legacy_json: str = "ticket_data.json"):
+        self.local = local
+        self.shared = shared
+        self.shard = shard
+        self.count = count
+        self.legacy_json = legacy_json
+
+    # WriteBehind attaches itself through on_mutation; the local store is
+    # the one that actually defers writes
+    @property
+    def on_mutation(self):
+        return self.local.on_mutation
+
+    @on_mutation.setter
+    def on_mutation(self, callback):
+        self.local.on_mutation = callback
+
+    def load(self) -> None:
+        # Only a shard's first start takes over its part of the single-instance
+        # state; a shard whose tickets were all closed since is simply empty
+        fresh = not self.local.exists()
+        self.local.load()
+        if fresh and self.legacy_json and state_file_exists(self.legacy_json):
+            self._import_legacy()
+
+    def exists(self) -> bool:
+        return self.local.exists()
+
+    def _import_legacy(self) -> None:
+        """Take over this shard's part of a single-instance ticket_data.json"""
+        data = read_state_file(self.legacy_json)
+        for user_id, ticket_id in data.get("user_tickets", {}).items():
+            if shard_for(int(user_id), self.count) == self.shard:
+                self.open_ticket(int(user_id), ticket_id)
+        for message_id, (ticket_id, user_id) in data.get("ticket_mappings", {}).items():
+            if shard_for(int(user_id), self.count) == self.shard:
+                self.add_mapping(int(message_id), ticket_id, int(user_id))
+        self.flush()
+
+    def add_mapping(self, message_id: int, ticket_id: str, user_id: int) -> None:
+        self.local.add_mapping(message_id, ticket_id, user_id)
+        self.shared.add_mapping(message_id, ticket_id, user_id)
+
+    def open_ticket(self, user_id: int, ticket_id: str) -> None:
+        self.local.open_ticket(user_id, ticket_id)
+        self.shared.open_ticket(user_id, ticket_id)
+
+    def close_ticket(self, ticket_id: str) -> None:
+        self.local.close_ticket(ticket_id)
+        self.shared.close_ticket(ticket_id)
+
+    def touch(self, ticket_id: str, ts: float = None) -> None:
+        self.local.touch(ticket_id, ts)
+
+    def idle_tickets(self, max_idle_seconds: float) -> list:
+        return self.local.idle_tickets(max_idle_seconds)
+
+    def evict_mappings(self, max_mappings: int) -> list:
+        victims = self.local.evict_mappings(max_mappings)
+        if victims:
+            self.shared.remove_messages(victims)
+        return victims
+
+    def get_mapping(self, message_id: int):
+        return self.local.get_mapping(message_id)
+
+    def get_user_ticket(self, user_id: int):
+        return self.local.get_user_ticket(user_id)
+
+    def get_ticket_user(self, ticket_id: str):
+        return self.local.get_ticket_user(ticket_id)
+
+    def set_thread(self, ticket_id: str, thread_id: int) -> None:
+        # Routing by thread goes through the mapping the engine adds alongside
+        self.local.set_thread(ticket_id, thread_id)
+
+    def get_thread(self, ticket_id: str):
+        return self.local.get_thread(ticket_id)
+
+    def open_tickets(self) -> list:
+        return self.local.open_tickets()
+
+    def tickets_opened_between(self, start: float, end: float) -> list:
+        return self.local.tickets_opened_between(start, end)
+
+    def flush(self) -> None:
+        self.local.flush()
+
+    def counts(self) -> tuple:
+        return self.local.counts()
+
+    def disk_bytes(self) -> int:
+        return self.local.disk_bytes()
+
+    def close(self) -> None:
+        self.local.close()
+
+def shard_store(shard: int, count: int, index_path: str) -> ShardedStore:
+    """Build the store a worker process uses for its shard"""
+    return ShardedStore(JournalStore(f"ticket_data.shard{shard}.json"), SharedIndex(index_path), shard, count)
+
+# ------------------------- ROUTING -------------------------
+TICKET_COMMANDS = ("/reply", "/close_ticket")
+
+def shard_for(user_id: int, count: int) -> int:
+    return user_id % count
+
+def routing_user(update: dict, index: SharedIndex) -> int:
+    """The user whose shard must handle this update; 0 for anything malformed"""
+    if not isinstance(update, dict):
+        return 0
+    message = update.get("message") or update.get("edited_message")
+    if not isinstance(message, dict):
+        for value in update.values():
+            if isinstance(value, dict) and isinstance(value.get("from"), dict):
+                return value["from"].get("id", 0)
+        return 0
+
+    # Support-group message in a ticket's forum topic
+    if message.get("is_topic_message"):
+        mapping = index.lookup_message(message.get("message_thread_id"))
+        if mapping:
+            return mapping[1]
+
+    # Admin replying to a forwarded ticket message
+    reply = message.get("reply_to_message")
+    if isinstance(reply, dict):
+        mapping = index.lookup_message(reply.get("message_id"))
+        if mapping:
+            return mapping[1]
+
+    # Admin commands that name a ticket
+    text = message.get("text") or ""
+    if isinstance(text, str) and text.startswith(TICKET_COMMANDS):
+        parts = text.split()
+        if len(parts) > 1:
+            user_id = index.ticket_user(parts[1].upper())
+            if user_id is not None:
+                return user_id
+
+    sender = message.get("from") or message.get("chat") or {}
+    return sender.get("id", 0) if isinstance(sender, dict) else 0
+
+# ------------------------- WORKER POOL -------------------------
+class ShardPool:
+    """Router side of multi-worker mode: one process and one queue per shard
+
+    target(shard, count, queue, *args) runs in each worker process and
+    must consume update dicts from queue until it reads None.
+    """
+
+    def __init__(self, count: int, target, index_path: str = "ticket_index.db",
+                 queue_size: int = 1000, args: tuple = ()):
+        self.count = count
+        self.target = target
+        self.index = SharedIndex(index_path)
+        self.queue_size = queue_size
+        self.args = args
+        self.queues = []
+        self.processes = []
+        self.controls = []
+        self.dispatched = [0] * count
+        self._seq = itertools.count()
+        self._collect_lock = threading.Lock()
+
+    def start(self) -> None:
+        ctx = multiprocessing.get_context("spawn")
+        self.queues = [ctx.Queue(self.queue_size) for _ in range(self.count)]
+        controls = [ctx.Pipe() for _ in range(self.count)]
+        requests = [ctx.Pipe() for _ in range(self.count)]
+        self.controls = [router_end for router_end, _ in controls]
+        self.processes = [
+            ctx.Process(target=_worker_entry,
+                        args=(self.target, i, self.count, q, controls[i][1], requests[i][1], self.args),
+                        name=f"shard-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+        for process in self.processes:
+            process.start()
+        for i, (router_end, _) in enumerate(requests):
+            threading.Thread(target=self._answer, args=(router_end,), name=f"shard-{i}-requests", daemon=True).start()
+
+    def dispatch(self, update: dict) -> None:
+        """Queue an update on its shard; blocks while that shard's queue is full"""
+        shard = shard_for(routing_user(update, self.index), self.count)
+        self.dispatched[shard] += 1
+        self.queues[shard].put(update)
+
+    async def dispatch_async(self, update: dict) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.dispatch, update)
+
+    def collect(self, name: str, *args) -> list:
+        """Every worker's answer to its view name(*args), in shard order
+
+        A worker that has not answered within VIEW_TIMEOUT (still loading,
+        or gone) contributes None.
+        """
+        with self._collect_lock:
+            seq = next(self._seq)
+            deadline = time.monotonic() + VIEW_TIMEOUT
+            for conn in self.controls:
+                try:
+                    conn.send((seq, name, args))
+                except OSError:
+                    pass
+            return [_receive(conn, seq, deadline) for conn in self.controls]
+
+    def metrics(self) -> list:
+        """Every worker's metric families, for metrics.add_source"""
+        return [family for part in self.collect("metrics") if part for family in part]
+
+    def stats(self) -> dict:
+        """Every worker's SLA aggregates merged into one report, for health.watch_analytics"""
+        return build_report([part for part in self.collect("stats") if part is not None])
+
+    def _answer(self, conn) -> None:
+        # A worker asking for a view across all shards, via gather()
+        while True:
+            try:
+                name, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            conn.send(self.collect(name, *args))
+
+    def stop(self) -> None:
+        """Let every worker drain its queue, then wait for it to exit"""
+        for q in self.queues:
+            q.put(None)
+        for process in self.processes:
+            process.join()
+
+def _worker_entry(target, shard, count, queue, control, requests, args) -> None:
+    global _link
+    # The router owns shutdown and stops workers with a sentinel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    _link = _Link(shard, control, requests)
+    target(shard, count, queue, *args)
+
+# ------------------------- CROSS-SHARD VIEWS -------------------------
+# Each worker answers the router's view requests on its control pipe from
+# a thread of its own, so a busy or waiting handler never holds one up.
+# A worker that needs a view across every shard asks the router on its
+# requests pipe; the router collects it from all workers, that one included.
+VIEW_TIMEOUT = 5.0
+
+_link = None
+
+class _Link:
+    """A worker's two pipes to the router"""
+
+    def __init__(self, shard: int, control, requests):
+        self.shard = shard
+        self.control = control
+        self.requests = requests
+        self.lock = threading.Lock()
+
+    def serve(self, views: dict) -> None:
+        while True:
+            try:
+                seq, name, args = self.control.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                answer = (seq, True, views[name](*args))
+            except Exception:
+                logger.exception("shard.view_failed", shard=self.shard, view=name)
+                answer = (seq, False, None)
+            self.control.send(answer)
+
+def _receive(conn, seq: int, deadline: float):
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            if remaining <= 0 or not conn.poll(remaining):
+                return None
+            got, ok, value = conn.recv()
+        except (EOFError, OSError):
+            return None
+        # Answers to requests that timed out earlier are skipped
+        if got == seq:
+            return value if ok else None
+
+def serve_views(views: dict = None) -> None:
+    """Start answering the router's view requests in this worker process
+
+    metrics (this worker's families, labelled with its shard) is always
+    served; views maps further names to functions returning picklable data.
+    """
+    shard_label = (("shard", str(_link.shard)),)
+    views = {"metrics": lambda: metrics.families(shard_label), **(views or {})}
+    threading.Thread(target=_link.serve, args=(views,), name="shard-views", daemon=True).start()
+
+def gather(name: str, *args) -> list:
+    """Every worker's answer to view name(*args), this one's included (blocks on the router)"""
+    with _link.lock:
+        _link.requests.send((name, args))
+        return _link.requests.recv()
+
+# ------------------------- UPDATE SOURCES -------------------------
+API_URL = (os.getenv("TELEGRAM_API_URL") or "https://api.telegram.org").rstrip("/")
+
+def _api(token: str, method: str, params: dict, timeout: float = 60):
+    request = urllib.request.Request(
+        f"{API_URL}/bot{token}/{method}",
+        data=json.dumps(params).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())["result"]
+
+async def run_router(pool: ShardPool, token: str, webhook_url: str = "", webhook_path: str = "/webhook",
+                     webhook_secret: str = "", port: int = 8000) -> None:
+    """Feed updates to the pool from a webhook or getUpdates until SIGINT/SIGTERM"""
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    if webhook_url:
+        from webhook_server import WebhookServer
+        server = WebhookServer(pool.dispatch_async, path=webhook_path, secret_token=webhook_secret, port=port)
+        await server.start()
+        params = {"url": f"{webhook_url}{webhook_path}", "drop_pending_updates": True}
+        if webhook_secret:
+            params["secret_token"] = webhook_secret
+        await loop.run_in_executor(None, _api, token, "setWebhook", params)
+        await stop.wait()
+        await server.stop()
+        return
+
+    await loop.run_in_executor(None, _api, token, "deleteWebhook", {"drop_pending_updates": True})
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = await loop.run_in_executor(None, _api, token, "getUpdates", {"offset": offset, "timeout": 30})
+        except Exception as e:
+            logger.error("router.get_updates_failed", error=str(e))
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await pool.dispatch_async(update)
+            offset = update["update_id"] + 1
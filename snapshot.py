@@ -0,0 +1,78 @@
+"""Compact binary snapshot of the ticket index
+
+JSON snapshots cost a full parse plus one index mutation per mapping on
+every boot. This format stores the index as fixed-width columns, so
+loading is a few bulk array copies and one pass to rebuild the dicts:
+
+    header   magic, byte order, ticket count, mapping count, ID bytes
+    ids      ticket IDs joined with newlines (IDs are alphanumeric)
+    users    int64 per ticket
+    activity float64 per ticket (last activity)
+    threads  int64 per ticket (support-group topic, 0 for none)
+    open     uint8 per ticket
+    counts   int64 per ticket (number of mappings)
+    messages int64 per mapping, grouped by ticket in ticket order
+
+Tickets are written in last-activity order, which the index keeps.
+"""
+import os
+import sys
+import struct
+from array import array
+from ticket_index import TicketIndex
+
+MAGIC = b"TKSNAP1"
+HEADER = struct.Struct("<7sc3Q")
+
+def write_snapshot(path: str, columns: tuple) -> None:
+    """Write TicketIndex.columns() to path atomically (temp file, fsync, rename)"""
+    ticket_ids, user_ids, activity, threads, opened, counts, message_ids = columns
+    ids = "\n".join(ticket_ids).encode("ascii")
+    order = b"L" if sys.byteorder == "little" else b"B"
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, order, len(ticket_ids), len(message_ids), len(ids)))
+        f.write(ids)
+        for typecode, column in (("q", user_ids), ("d", activity), ("q", threads), ("B", opened),
+                                 ("q", counts), ("q", message_ids)):
+            array(typecode, column).tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def read_snapshot(path: str) -> TicketIndex:
+    """Load an index written by write_snapshot; raises ValueError if the file isn't one"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path}: truncated snapshot")
+    magic, order, tickets, mappings, id_bytes = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path}: not a ticket snapshot")
+    offset = HEADER.size
+    ticket_ids = data[offset:offset + id_bytes].decode("ascii").split("\n") if tickets else []
+    offset += id_bytes
+
+    columns = []
+    for typecode, count in (("q", tickets), ("d", tickets), ("q", tickets), ("B", tickets),
+                            ("q", tickets), ("q", mappings)):
+        column = array(typecode)
+        end = offset + count * column.itemsize
+        if end > len(data):
+            raise ValueError(f"{path}: truncated snapshot")
+        column.frombytes(data[offset:end])
+        if order != (b"L" if sys.byteorder == "little" else b"B"):
+            column.byteswap()
+        columns.append(column)
+        offset = end
+    return TicketIndex.from_columns(ticket_ids, *columns)
+
+def snapshot_dict(path: str) -> dict:
+    """The snapshot in the JSON snapshot layout, for migrations that read ticket_data.json"""
+    index = read_snapshot(path)
+    return {
+        "ticket_mappings": {m: (t, u) for m, t, u in index.mappings()},
+        "user_tickets": dict(index.open_tickets),
+        "ticket_activity": {t.ticket_id: t.last_activity for t in index.tickets.values()},
+        "ticket_threads": {t.ticket_id: t.thread_id for t in index.tickets.values() if t.thread_id is not None},
+    }
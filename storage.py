@@ -0,0 +1,622 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import log
+from ticket_index import TicketIndex
+from ticket_ids import ID_LENGTH, id_range
+from snapshot import write_snapshot, read_snapshot, snapshot_dict
+
+logger = log.get("store")
+
+# Ticket activity is recorded to this many seconds; idle timeouts are hours
+TOUCH_RESOLUTION_S = 60
+
+# ------------------------- HELPERS -------------------------
+def binary_snapshot_path(json_path: str) -> str:
+    return f"{os.path.splitext(json_path)[0]}.snap"
+
+def state_file_exists(json_path: str) -> bool:
+    return os.path.exists(binary_snapshot_path(json_path)) or os.path.exists(json_path)
+
+def read_state_file(json_path: str) -> dict:
+    """Journal-store state in the JSON snapshot layout, from the binary snapshot if there is one"""
+    binary_path = binary_snapshot_path(json_path)
+    if os.path.exists(binary_path):
+        return snapshot_dict(binary_path)
+    with open(json_path, "r") as f:
+        return json.load(f)
+
+def _file_sizes(*paths) -> int:
+    """Total size of the given files, ignoring ones that don't exist"""
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+# ------------------------- STORE INTERFACE -------------------------
+class TicketStore:
+    """Interface every ticket storage backend implements
+
+    Handlers only go through these methods, so backends can be swapped
+    without touching the bots. Mutations update the in-memory view
+    immediately; when on_mutation is set (see persistence.WriteBehind)
+    writing them to disk is deferred until flush(), otherwise every
+    mutation is flushed before returning.
+    """
+
+    on_mutation = None
+
+    def _mutated(self) -> None:
+        if self.on_mutation is not None:
+            self.on_mutation()
+        else:
+            self.flush()
+
+    def load(self) -> None:
+        """Open the backing storage and make the state available"""
+        raise NotImplementedError
+
+    def exists(self) -> bool:
+        """True if an earlier run left state on disk, even if no ticket is open"""
+        raise NotImplementedError
+
+    def add_mapping(self, message_id: int, ticket_id: str, user_id: int) -> None:
+        """Map an admin-side message to its ticket"""
+        raise NotImplementedError
+
+    def open_ticket(self, user_id: int, ticket_id: str) -> None:
+        """Record a newly opened ticket for a user"""
+        raise NotImplementedError
+
+    def close_ticket(self, ticket_id: str) -> None:
+        """Drop a ticket and all of its message mappings"""
+        raise NotImplementedError
+
+    def set_thread(self, ticket_id: str, thread_id: int) -> None:
+        """Record the support-group forum topic of an open ticket"""
+        raise NotImplementedError
+
+    def touch(self, ticket_id: str, ts: float = None) -> None:
+        """Record a message on the ticket at ts (default now), keeping it out of idle_tickets()
+
+        Activity is kept to TOUCH_RESOLUTION_S, so a busy ticket costs one
+        write per interval rather than one per message.
+        """
+        raise NotImplementedError
+
+    def idle_tickets(self, max_idle_seconds: float) -> list:
+        """Return [(ticket_id, user_id)] for open tickets idle longer than max_idle_seconds, oldest first"""
+        raise NotImplementedError
+
+    def evict_mappings(self, max_mappings: int) -> list:
+        """Drop mappings of the least recently active tickets until at most max_mappings remain
+
+        Returns the evicted message_ids. Open tickets themselves are kept,
+        only their oldest admin-side messages stop routing replies; the
+        mapping of a ticket's forum topic (see set_thread) is never evicted.
+        """
+        raise NotImplementedError
+
+    def get_mapping(self, message_id: int):
+        """Return (ticket_id, user_id) for an admin-side message, or None"""
+        raise NotImplementedError
+
+    def open_tickets(self) -> list:
+        """Return [(ticket_id, user_id)] for every open ticket"""
+        raise NotImplementedError
+
+    def get_user_ticket(self, user_id: int):
+        """Return the user's open ticket ID, or None"""
+        raise NotImplementedError
+
+    def tickets_opened_between(self, start: float, end: float) -> list:
+        """Return [(ticket_id, user_id)] for open tickets created in [start, end), oldest first
+
+        Ticket IDs are time-ordered (see ticket_ids.py), so this is a range
+        scan over the ID order; tickets with older untimed IDs are skipped.
+        """
+        raise NotImplementedError
+
+    def get_ticket_user(self, ticket_id: str):
+        """Return the user who owns an open ticket, or None"""
+        raise NotImplementedError
+
+    def get_thread(self, ticket_id: str):
+        """Return the forum topic (message_thread_id) of a ticket, or None"""
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Write every pending mutation to disk"""
+        raise NotImplementedError
+
+    def counts(self) -> tuple:
+        """Return (open tickets, message mappings)"""
+        raise NotImplementedError
+
+    def disk_bytes(self) -> int:
+        """Bytes the store currently occupies on disk"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Flush and release the backing storage"""
+        raise NotImplementedError
+
+# ------------------------- JOURNAL STORE -------------------------
+class JournalStore(TicketStore):
+    """Ticket state kept in memory, persisted as a snapshot plus an append-only journal
+
+    Every mutation appends one small JSON line to the journal instead of
+    rewriting the whole file. Once the journal grows past compact_every
+    records it is rotated and folded into a new snapshot on a background
+    thread. Replaying the records is idempotent, so a crash at any point
+    during compaction loses nothing. Snapshots are written in the binary
+    format of snapshot.py next to path (ticket_data.snap); a JSON
+    snapshot at path is still read when there is no binary one. It is
+    left in place once folded into one and ignored from then on;
+    `python storage.py export` writes the current state back to it.
+    """
+
+    def __init__(self, path: str = "ticket_data.json", compact_every: int = 1000):
+        self.snapshot_path = path
+        self.binary_path = binary_snapshot_path(path)
+        base = os.path.splitext(path)[0]
+        self.journal_path = f"{base}.journal"
+        self.compacting_path = f"{base}.journal.compacting"
+        self.compact_every = compact_every
+
+        self.index = TicketIndex()
+
+        self._lock = threading.Lock()
+        self._journal = None
+        self._pending = []
+        self._records = 0
+        self._compactor = None
+
+    # ---- loading ----
+    def exists(self) -> bool:
+        # load() always creates the journal, so any run leaves at least that
+        return any(map(os.path.exists, (self.binary_path, self.snapshot_path, self.journal_path,
+                                        self.compacting_path)))
+
+    def load(self) -> None:
+        """Load the snapshot, replay pending journal records and open the journal for appending"""
+        with self._lock:
+            self.index = TicketIndex()
+            legacy = False
+            try:
+                self.index = read_snapshot(self.binary_path)
+            except FileNotFoundError:
+                legacy = self._load_json_snapshot()
+            except ValueError as e:
+                logger.warning("store.snapshot_unreadable", path=self.binary_path, error=str(e))
+                legacy = self._load_json_snapshot()
+            # A JSON snapshot not yet folded into a binary one counts as pending work
+            legacy = legacy and bool(self.index.tickets)
+
+            # A leftover .compacting file means a compaction was interrupted;
+            # its records are older than anything in the live journal.
+            interrupted = os.path.exists(self.compacting_path)
+            replayed = self._replay(self.compacting_path) + self._replay(self.journal_path)
+
+            if interrupted:
+                # Finish the interrupted compaction before accepting writes
+                self._write_snapshot(self.index.columns())
+                os.remove(self.compacting_path)
+                self._journal = open(self.journal_path, "w")
+                replayed = 0
+            else:
+                self._journal = open(self.journal_path, "a")
+            self._records = replayed + legacy
+
+        if self._records:
+            self.compact_async()
+
+    def _load_json_snapshot(self) -> bool:
+        try:
+            with open(self.snapshot_path, "r") as f:
+                self._load_snapshot(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        return True
+
+    def _load_snapshot(self, data: dict) -> None:
+        """Rebuild the index from the snapshot file layout"""
+        # JSON object keys are always strings; message and user IDs are
+        # canonicalized to int here so lookups with Telegram's int IDs hit.
+        # Snapshots written before activity tracking have no timestamps;
+        # treat their tickets as active as of now.
+        now = time.time()
+        activity = data.get("ticket_activity", {})
+        index = self.index
+        for user_id, ticket_id in data.get("user_tickets", {}).items():
+            index.open_ticket(int(user_id), ticket_id, activity.get(ticket_id, now))
+        for message_id, (ticket_id, user_id) in data.get("ticket_mappings", {}).items():
+            index.add_message(int(message_id), ticket_id, int(user_id), activity.get(ticket_id, now))
+        for ticket_id, thread_id in data.get("ticket_threads", {}).items():
+            index.set_thread(ticket_id, int(thread_id))
+
+    def _replay(self, path: str) -> int:
+        """Apply every complete record in a journal file, returning how many were read"""
+        count = 0
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn write from a crash; everything after it is unusable
+                        break
+                    self._apply(record)
+                    count += 1
+        except FileNotFoundError:
+            pass
+        return count
+
+    def _apply(self, record: dict) -> None:
+        """Apply a single journal record to the in-memory state"""
+        op = record["op"]
+        if op == "map":
+            self.index.add_message(int(record["m"]), record["t"], int(record["u"]), record.get("ts", 0))
+        elif op == "open":
+            self.index.open_ticket(int(record["u"]), record["t"], record.get("ts", 0))
+        elif op == "close":
+            self.index.remove_ticket(record["t"])
+        elif op == "touch":
+            self.index.touch(record["t"], record["ts"])
+        elif op == "thread":
+            self.index.set_thread(record["t"], int(record["th"]))
+        elif op == "evict":
+            self.index.remove_messages(int(m) for m in record["m"])
+
+    # ---- lookups ----
+    def get_mapping(self, message_id: int):
+        return self.index.lookup_message(message_id)
+
+    def get_user_ticket(self, user_id: int):
+        return self.index.user_ticket(user_id)
+
+    def get_ticket_user(self, ticket_id: str):
+        return self.index.ticket_user(ticket_id)
+
+    def get_thread(self, ticket_id: str):
+        return self.index.ticket_thread(ticket_id)
+
+    def open_tickets(self) -> list:
+        with self._lock:
+            return [(t, u) for u, t in self.index.open_tickets.items()]
+
+    def tickets_opened_between(self, start: float, end: float) -> list:
+        low, high = id_range(start, end)
+        with self._lock:
+            return [(t, u) for t, u in self.index.open_between(low, high) if len(t) == ID_LENGTH]
+
+    # ---- mutations ----
+    def add_mapping(self, message_id: int, ticket_id: str, user_id: int) -> None:
+        self._write({"op": "map", "m": message_id, "t": ticket_id, "u": user_id, "ts": time.time()})
+
+    def open_ticket(self, user_id: int, ticket_id: str) -> None:
+        self._write({"op": "open", "u": user_id, "t": ticket_id, "ts": time.time()})
+
+    def close_ticket(self, ticket_id: str) -> None:
+        self._write({"op": "close", "t": ticket_id})
+
+    def set_thread(self, ticket_id: str, thread_id: int) -> None:
+        self._write({"op": "thread", "t": ticket_id, "th": thread_id})
+
+    def touch(self, ticket_id: str, ts: float = None) -> None:
+        ts = time.time() if ts is None else ts
+        ticket = self.index.tickets.get(ticket_id)
+        if ticket is None or ts - ticket.last_activity < TOUCH_RESOLUTION_S:
+            return
+        self._write({"op": "touch", "t": ticket_id, "ts": ts})
+
+    def idle_tickets(self, max_idle_seconds: float) -> list:
+        cutoff = time.time() - max_idle_seconds
+        with self._lock:
+            # The index also keeps superseded tickets that still have mappings
+            return [(t.ticket_id, t.user_id) for t in self.index.idle_tickets(cutoff)
+                    if self.index.user_ticket(t.user_id) == t.ticket_id]
+
+    def evict_mappings(self, max_mappings: int) -> list:
+        with self._lock:
+            excess = len(self.index.messages) - max_mappings
+            victims = self.index.least_recent_messages(excess) if excess > 0 else []
+        if victims:
+            # One record per sweep rather than one per mapping
+            self._write({"op": "evict", "m": victims})
+        return victims
+
+    def _write(self, record: dict) -> None:
+        with self._lock:
+            self._apply(record)
+            self._pending.append(json.dumps(record, separators=(",", ":")))
+        self._mutated()
+
+    def flush(self) -> None:
+        """Append all pending records to the journal in a single write"""
+        with self._lock:
+            if not self._pending:
+                return
+            self._journal.write("\n".join(self._pending) + "\n")
+            self._journal.flush()
+            self._records += len(self._pending)
+            self._pending = []
+            due = self._records >= self.compact_every
+        if due:
+            self.compact_async()
+
+    def counts(self) -> tuple:
+        return len(self.index.open_tickets), len(self.index.messages)
+
+    def disk_bytes(self) -> int:
+        return _file_sizes(self.binary_path, self.snapshot_path, self.journal_path, self.compacting_path)
+
+    # ---- compaction ----
+    def compact_async(self) -> None:
+        """Start a background compaction unless one is already running"""
+        with self._lock:
+            if self._compactor and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self.compact, daemon=True)
+            self._compactor.start()
+
+    def compact(self) -> None:
+        """Fold the journal into a fresh snapshot"""
+        with self._lock:
+            if self._records == 0 or os.path.exists(self.compacting_path):
+                return
+            # Rotate the journal so new writes go to a fresh file while we
+            # serialize a point-in-time copy of the state.
+            self._journal.close()
+            os.replace(self.journal_path, self.compacting_path)
+            self._journal = open(self.journal_path, "a")
+            self._records = 0
+            columns = self.index.columns()
+
+        self._write_snapshot(columns)
+        os.remove(self.compacting_path)
+
+    def _write_snapshot(self, columns: tuple) -> None:
+        # A JSON snapshot at snapshot_path is kept for downgrades; load() no longer reads it
+        write_snapshot(self.binary_path, columns)
+
+    def close(self) -> None:
+        """Flush, compact synchronously and close the journal"""
+        self.flush()
+        if self._compactor:
+            self._compactor.join()
+        self.compact()
+        with self._lock:
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+
+# ------------------------- SQLITE STORE -------------------------
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    ticket_id     TEXT PRIMARY KEY,
+    user_id       INTEGER NOT NULL UNIQUE,
+    last_activity REAL NOT NULL DEFAULT 0,
+    thread_id     INTEGER
+);
+CREATE TABLE IF NOT EXISTS mappings (
+    message_id INTEGER PRIMARY KEY,
+    ticket_id  TEXT NOT NULL,
+    user_id    INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_mappings_ticket ON mappings(ticket_id);
+"""
+
+SQLITE_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_tickets_activity ON tickets(last_activity);
+"""
+
+class SqliteStore(TicketStore):
+    """Ticket state in a WAL-mode SQLite database
+
+    Open tickets are keyed by ticket_id with a unique index on user_id,
+    and mappings are keyed by the admin message_id with an index on
+    ticket_id, so every handler lookup and every close is an index
+    lookup rather than a scan.
+    """
+
+    def __init__(self, path: str = "ticket_data.db", legacy_json: str = "ticket_data.json"):
+        self.path = path
+        self.legacy_json = legacy_json
+        self._conn = None
+        # telebot runs handlers on worker threads; serialize access to the connection
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def load(self) -> None:
+        fresh = not self.exists()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(tickets)")}
+        if "last_activity" not in columns:
+            self._conn.execute("ALTER TABLE tickets ADD COLUMN last_activity REAL NOT NULL DEFAULT 0")
+        if "thread_id" not in columns:
+            self._conn.execute("ALTER TABLE tickets ADD COLUMN thread_id INTEGER")
+        self._conn.executescript(SQLITE_INDEXES)
+        if fresh and self.legacy_json and state_file_exists(self.legacy_json):
+            count = self.import_json(self.legacy_json)
+            logger.info("store.migrated", records=count, source=self.legacy_json, path=self.path)
+
+    def import_json(self, json_path: str) -> int:
+        """Import a legacy ticket_data.json (or its binary snapshot), returning the number of rows written"""
+        data = read_state_file(json_path)
+        now = time.time()
+        tickets = [(t, int(u), now) for u, t in data.get("user_tickets", {}).items()]
+        mappings = [(int(m), v[0], int(v[1])) for m, v in data.get("ticket_mappings", {}).items()]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tickets (ticket_id, user_id, last_activity) VALUES (?, ?, ?)", tickets
+            )
+            self._conn.executemany("INSERT OR REPLACE INTO mappings VALUES (?, ?, ?)", mappings)
+        return len(tickets) + len(mappings)
+
+    # ---- lookups ----
+    def _one(self, sql: str, params: tuple):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def get_mapping(self, message_id: int):
+        return self._one("SELECT ticket_id, user_id FROM mappings WHERE message_id = ?", (message_id,))
+
+    def get_user_ticket(self, user_id: int):
+        row = self._one("SELECT ticket_id FROM tickets WHERE user_id = ?", (user_id,))
+        return row[0] if row else None
+
+    def get_ticket_user(self, ticket_id: str):
+        row = self._one("SELECT user_id FROM tickets WHERE ticket_id = ?", (ticket_id,))
+        return row[0] if row else None
+
+    def get_thread(self, ticket_id: str):
+        row = self._one("SELECT thread_id FROM tickets WHERE ticket_id = ?", (ticket_id,))
+        return row[0] if row else None
+
+    def open_tickets(self) -> list:
+        with self._lock:
+            return self._conn.execute("SELECT ticket_id, user_id FROM tickets").fetchall()
+
+    def tickets_opened_between(self, start: float, end: float) -> list:
+        # A range over the ticket_id primary key index
+        with self._lock:
+            return self._conn.execute(
+                "SELECT ticket_id, user_id FROM tickets WHERE ticket_id >= ? AND ticket_id < ? "
+                "AND length(ticket_id) = ? ORDER BY ticket_id", (*id_range(start, end), ID_LENGTH)
+            ).fetchall()
+
+    # ---- mutations ----
+    # Mutations run inside an open transaction; flush() commits it, so a
+    # batch of mutations costs one WAL sync instead of one each.
+    def add_mapping(self, message_id: int, ticket_id: str, user_id: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO mappings VALUES (?, ?, ?)", (message_id, ticket_id, user_id)
+            )
+        self._mutated()
+
+    def touch(self, ticket_id: str, ts: float = None) -> None:
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            changed = self._conn.execute(
+                "UPDATE tickets SET last_activity = ? WHERE ticket_id = ? AND last_activity <= ?",
+                (ts, ticket_id, ts - TOUCH_RESOLUTION_S),
+            ).rowcount
+        if changed:
+            self._mutated()
+
+    def open_ticket(self, user_id: int, ticket_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM tickets WHERE user_id = ?", (user_id,))
+            self._conn.execute(
+                "INSERT INTO tickets (ticket_id, user_id, last_activity) VALUES (?, ?, ?)",
+                (ticket_id, user_id, time.time()),
+            )
+        self._mutated()
+
+    def set_thread(self, ticket_id: str, thread_id: int) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE tickets SET thread_id = ? WHERE ticket_id = ?", (thread_id, ticket_id))
+        self._mutated()
+
+    def close_ticket(self, ticket_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM mappings WHERE ticket_id = ?", (ticket_id,))
+            self._conn.execute("DELETE FROM tickets WHERE ticket_id = ?", (ticket_id,))
+        self._mutated()
+
+    def idle_tickets(self, max_idle_seconds: float) -> list:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT ticket_id, user_id FROM tickets WHERE last_activity < ? ORDER BY last_activity",
+                (time.time() - max_idle_seconds,),
+            ).fetchall()
+
+    def evict_mappings(self, max_mappings: int) -> list:
+        with self._lock:
+            excess = self._conn.execute("SELECT COUNT(*) FROM mappings").fetchone()[0] - max_mappings
+            if excess <= 0:
+                return []
+            # Mappings whose ticket row is gone (superseded tickets) go first
+            victims = [row[0] for row in self._conn.execute(
+                "SELECT m.message_id FROM mappings m LEFT JOIN tickets t ON t.ticket_id = m.ticket_id "
+                "WHERE t.thread_id IS NULL OR m.message_id != t.thread_id "
+                "ORDER BY COALESCE(t.last_activity, 0), m.message_id LIMIT ?", (excess,)
+            )]
+            self._conn.executemany("DELETE FROM mappings WHERE message_id = ?", [(m,) for m in victims])
+        self._mutated()
+        return victims
+
+    def flush(self) -> None:
+        with self._lock:
+            self._conn.commit()
+
+    def counts(self) -> tuple:
+        with self._lock:
+            tickets = self._conn.execute("SELECT COUNT(*) FROM tickets").fetchone()[0]
+            mappings = self._conn.execute("SELECT COUNT(*) FROM mappings").fetchone()[0]
+        return tickets, mappings
+
+    def disk_bytes(self) -> int:
+        return _file_sizes(self.path, f"{self.path}-wal", f"{self.path}-shm")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+# ------------------------- FACTORY -------------------------
+def open_store(kind: str = "journal") -> TicketStore:
+    """Build the store selected by TICKET_STORE (journal or sqlite)"""
+    kind = (kind or "journal").strip().lower()
+    if kind == "sqlite":
+        return SqliteStore(os.getenv("TICKET_DB", "ticket_data.db"))
+    if kind == "journal":
+        return JournalStore("ticket_data.json")
+    raise ValueError(f"Unknown TICKET_STORE: {kind}")
+
+def export_json(json_path: str = "ticket_data.json") -> int:
+    """Write the journal store's current state to json_path in the JSON snapshot layout
+
+    The downgrade path to versions that only read ticket_data.json; the
+    store is compacted first, so its journal holds nothing newer. Returns
+    the number of open tickets written.
+    """
+    store = JournalStore(json_path)
+    store.load()
+    store.close()
+    data = snapshot_dict(store.binary_path)
+    tmp_path = f"{json_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, json_path)
+    return len(data.get("user_tickets", {}))
+
+if __name__ == "__main__":
+    # python storage.py migrate [ticket_data.json] [ticket_data.db]
+    # python storage.py export [ticket_data.json]
+    import sys
+    if len(sys.argv) < 2 or sys.argv[1] not in ("migrate", "export"):
+        raise SystemExit("Usage: python storage.py migrate [JSON_PATH] [DB_PATH] | export [JSON_PATH]")
+    json_path = sys.argv[2] if len(sys.argv) > 2 else "ticket_data.json"
+    if sys.argv[1] == "export":
+        print(f"Wrote {export_json(json_path)} open tickets to {json_path}")
+        raise SystemExit(0)
+    db_path = sys.argv[3] if len(sys.argv) > 3 else "ticket_data.db"
+    target = SqliteStore(db_path, legacy_json=None)
+    target.load()
+    print(f"Imported {target.import_json(json_path)} records into {db_path}")
+    target.close()
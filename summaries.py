@@ -0,0 +1,158 @@
+import time
+import heapq
+import threading
+from bisect import bisect_left, insort
+from itertools import islice
+
+PREVIEW_CHARS = 80
+
+# ------------------------- TICKET SUMMARIES -------------------------
+class Summary:
+    """What the /open dashboard shows for one open ticket"""
+
+    __slots__ = ("ticket_id", "user_id", "opened_at", "waiting_since", "last_at",
+                 "preview", "messages", "admin_replied", "waiting")
+
+    def __init__(self, ticket_id: str, user_id: int, ts: float):
+        self.ticket_id = ticket_id
+        self.user_id = user_id
+        self.opened_at = ts
+        self.waiting_since = ts
+        self.last_at = ts
+        self.preview = ""
+        self.messages = 0
+        self.admin_replied = False
+        self.waiting = True
+
+    def key(self) -> tuple:
+        """Dashboard position: waiting tickets first, longest wait first, then least recently answered"""
+        if self.waiting:
+            return 0, self.waiting_since, self.ticket_id
+        return 1, self.last_at, self.ticket_id
+
+class TicketSummaries:
+    """Open-ticket summaries kept in dashboard order as messages arrive
+
+    Every summary's key() sits in one sorted list, `order`. An update
+    moves one key (a bisect to drop the old one, an insort for the new
+    one, normally at the end of its half) and a page is a slice of the
+    list, so /open costs the page size whatever the page number, and
+    never scans mappings or history. Summaries live in memory and are
+    rebuilt from the history files of the open tickets on startup.
+    """
+
+    def __init__(self):
+        self.summaries = {}
+        self.order = []
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.summaries)
+
+    def _place(self, summary: Summary) -> None:
+        insort(self.order, summary.key())
+        self.waiting += summary.waiting
+
+    def _unplace(self, summary: Summary) -> None:
+        key = summary.key()
+        i = bisect_left(self.order, key)
+        if i < len(self.order) and self.order[i] == key:
+            del self.order[i]
+            self.waiting -= summary.waiting
+
+    def record(self, ticket_id: str, user_id: int, role: str, text: str, ts: float = None) -> None:
+        """Fold one message into its ticket's summary"""
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            summary = self.summaries.get(ticket_id)
+            if summary is None:
+                summary = self.summaries[ticket_id] = Summary(ticket_id, user_id, ts)
+                self._place(summary)
+            if role == "user":
+                # An answered ticket starts waiting again from this message
+                if not summary.waiting:
+                    self._unplace(summary)
+                    summary.waiting = True
+                    summary.waiting_since = ts
+                    self._place(summary)
+            else:
+                self._unplace(summary)
+                summary.waiting = False
+                summary.admin_replied = True
+                summary.last_at = ts
+                self._place(summary)
+            summary.messages += 1
+            summary.last_at = ts
+            summary.preview = text[:PREVIEW_CHARS]
+
+    def remove(self, ticket_id: str) -> None:
+        with self._lock:
+            summary = self.summaries.pop(ticket_id, None)
+            if summary is not None:
+                self._unplace(summary)
+
+    def page(self, number: int, size: int = 10) -> tuple:
+        """(summaries, open count, waiting count) for one dashboard page (0-based)"""
+        start = number * size
+        with self._lock:
+            rows = [self.summaries[key[2]] for key in self.order[start:start + size]]
+            return rows, len(self.summaries), self.waiting
+
+    def rebuild(self, open_tickets, history, is_open=None) -> None:
+        """Recreate summaries for [(ticket_id, user_id)] from their history files
+
+        Safe to run in the background while messages are recorded: each
+        ticket is folded on the side and swapped in under the lock, so a
+        message recorded meanwhile (history is read after a flush) is
+        already in the file. Tickets is_open(ticket_id, user_id) rejects
+        by then have been closed and are skipped.
+        """
+        for ticket_id, user_id in open_tickets:
+            scratch = TicketSummaries()
+            for ts, role, _, text in history.entries(ticket_id):
+                scratch.record(ticket_id, user_id, role, text, ts)
+            summary = scratch.summaries.get(ticket_id)
+            if summary is None:
+                continue
+            with self._lock:
+                if is_open is not None and not is_open(ticket_id, user_id):
+                    continue
+                previous = self.summaries.get(ticket_id)
+                if previous is not None:
+                    self._unplace(previous)
+                self.summaries[ticket_id] = summary
+                self._place(summary)
+
+def merge_pages(parts, number: int, size: int = 10) -> tuple:
+    """Combine several shards' page(0, (number + 1) * size) into page(number, size) of them all"""
+    rows = heapq.merge(*(part[0] for part in parts), key=Summary.key)
+    start = number * size
+    return (list(islice(rows, start, start + size)),
+            sum(part[1] for part in parts), sum(part[2] for part in parts))
+
+# ------------------------- FORMATTING -------------------------
+def format_wait(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes}m"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 48:
+        return f"{hours}h {minutes}m"
+    return f"{hours // 24}d {hours % 24}h"
+
+def format_page(rows: list, total: int, waiting: int, number: int, size: int = 10):
+    """Dashboard text for a page of summaries plus (has_previous, has_next)"""
+    pages = max((total + size - 1) // size, 1)
+    now = time.time()
+    lines = [f"📋 Open tickets: {total} ({waiting} waiting) — page {number + 1}/{pages}"]
+    for s in rows:
+        if s.waiting:
+            state = f"⏳ waiting {format_wait(now - s.waiting_since)}"
+        else:
+            state = f"✅ answered {format_wait(now - s.last_at)} ago"
+        replied = "" if s.admin_replied else " · no admin reply yet"
+        lines.append(f"\n#{s.ticket_id} · {s.messages} msg · {state}{replied}\n   “{s.preview}”")
+    if not rows:
+        lines.append("\nNo open tickets.")
+    return "\n".join(lines), number > 0, number + 1 < pages
@@ -0,0 +1,512 @@
+"""Ticket engine shared by both bot front-ends
+
+Everything that decides what happens to a ticket lives here: which
+ticket a message belongs to, which user an admin reply goes to, what
+is recorded, and the text of every reply. bot.py (python-telegram-bot)
+and working_bot.py (pyTelegramBotAPI) are transport adapters: they turn
+library updates into engine calls and deliver what the engine returns
+through their own send queue. Nothing here imports a Telegram library,
+so the engine can be driven directly from scripts and benchmarks.
+"""
+import os
+import time
+import threading
+from datetime import datetime, timezone
+from storage import open_store
+from persistence import WriteBehind
+from retention import Retention
+from history import HistoryLog, USER, ADMIN
+from search_index import SearchIndex
+from summaries import TicketSummaries, format_page, merge_pages
+from locks import StripedLock
+from ticket_ids import TicketIds
+from events import EventLog, OPENED, MESSAGE, REPLY, CLOSED, EXPIRED
+from analytics import TicketAnalytics, build_report, format_stats
+from ingress import IngressGuard
+import health
+import log
+
+logger = log.get("engine")
+
+# ------------------------- TEXTS -------------------------
+START_ADMIN = (
+    "👋 Welcome Admin!\n"
+    "You will receive user questions here.\n"
+    "Reply to any message to respond to the user.\n\n"
+    "Use /debug to check your admin status."
+)
+START_USER = (
+    "👋 Welcome to Nuner Support!\n"
+    "Send your question and our team will reply here.\n"
+    "📝 Tip: Send one question per message.\n\n"
+    "Use /close to close your current ticket."
+)
+HELP_ADMIN = (
+    "ℹ️ Admin Help:\n"
+    "• Reply to any user message to respond\n"
+    "• In the support group, write in a ticket's topic to respond\n"
+    "• /reply <TICKET_ID> <message> - reply to a specific ticket\n"
+    "• /close_ticket <TICKET_ID> - close a ticket (no ID needed inside its topic)\n"
+    "• /history <TICKET_ID> [page] - show a ticket's conversation\n"
+    "• /search [-r] <terms> - find tickets by message text\n"
+    "• /open - list open tickets, longest waiting first\n"
+    "• /stats - response times, resolution times and per-admin activity\n"
+    "• /whoami - show your chat ID\n"
+    "• /debug - show debug information"
+)
+HELP_USER = (
+    "ℹ️ User Help:\n"
+    "• Send a message to create a support ticket\n"
+    "• /close - close your current ticket\n"
+    "• /whoami - show your chat ID"
+)
+ADMIN_AS_USER = (
+    "👋 You're an admin! \n"
+    "If you want to test user functionality, please use a different account.\n"
+    "To reply to users, reply to their messages in the admin chat."
+)
+ADMIN_ONLY = "❌ Admin only command."
+ADMIN_NOT_CONFIGURED = "(Admin chat not configured. Set ADMIN_CHAT_ID or SUPPORT_GROUP_ID in .env)"
+FORWARD_FAILED = "Error sending message to admin. Please try again later."
+NO_OPEN_TICKET = "You don't have any open tickets."
+TICKET_NOT_FOUND = "Ticket not found."
+NOT_A_TICKET = "This message is not associated with any ticket."
+NO_SEARCH_RESULTS = "No matching tickets."
+USAGE_REPLY = "Usage: /reply <TICKET_ID> <message>"
+USAGE_CLOSE_TICKET = "Usage: /close_ticket <TICKET_ID>"
+USAGE_HISTORY = "Usage: /history <TICKET_ID> [page]"
+USAGE_SEARCH = "Usage: /search [-r] <terms>\n-r ranks by most recent instead of best match"
+
+def confirmation(ticket_id: str, created: bool, count: int = 1, kind: str = "message") -> str:
+    """What the user is told after sending count messages (or files of the given kind)"""
+    if created:
+        return f"✅ Your ticket #{ticket_id} has been created. Admin will reply here.\nUse /close to close this ticket."
+    if count > 1:
+        noun = "messages" if kind == "message" else "files"
+        return f"ℹ️ Your {count} {noun} have been added to ticket #{ticket_id}."
+    return f"ℹ️ Your {kind} has been added to ticket #{ticket_id}."
+
+def forward_header(ticket_id: str, user, user_id: int, texts: list, in_topic: bool = False) -> str:
+    """The admin-chat forward for one message or a coalesced burst"""
+    count = f" ({len(texts)} messages)" if len(texts) > 1 else ""
+    hint = "↩️ Reply by writing in this topic." if in_topic else "↩️ Reply by replying to this message."
+    return (
+        f"🆕 Ticket #{ticket_id}{count}\n"
+        f"From: {pretty_user(user)} (ID: {user_id})\n\n"
+        + "\n\n".join(texts) + "\n\n"
+        + hint
+    )
+
+def media_header(ticket_id: str, user, user_id: int, count: int = 1, in_topic: bool = False) -> str:
+    """Caption for a relayed file, or the message sent ahead of an album"""
+    sender = f"From: {pretty_user(user)} (ID: {user_id})"
+    if in_topic:
+        hint = "↩️ Reply by writing in this topic."
+    else:
+        hint = "↩️ Reply by replying to any of them." if count > 1 else "↩️ Reply by replying to this message."
+    if count > 1:
+        return f"🆕 Ticket #{ticket_id} ({count} files)\n{sender}\n{hint}"
+    return f"🆕 Ticket #{ticket_id}\n{sender}\n{hint}"
+
+def topic_name(ticket_id: str, user) -> str:
+    """Forum topic title for a ticket; Telegram allows at most 128 characters"""
+    return f"#{ticket_id} {pretty_user(user)}"[:128]
+
+def support_reply(ticket_id: str, content: str = "") -> str:
+    return f"💬 Support (#{ticket_id}):\n{content}" if content else f"💬 Support (#{ticket_id}):"
+
+def reply_echo(ticket_id: str, content: str) -> str:
+    return f"💬 You replied to #{ticket_id}:\n{content}"
+
+def closed_notice(ticket_id: str) -> str:
+    return f"✅ Ticket #{ticket_id} has been closed."
+
+def closed_by_support(ticket_id: str) -> str:
+    return f"✅ Your ticket #{ticket_id} has been closed by support."
+
+def muted_notice(seconds: float) -> str:
+    minutes = max(int(seconds // 60), 1)
+    return (
+        "⏳ You're sending messages too quickly. "
+        f"New messages will be ignored for the next {minutes} min; please wait and send your question once."
+    )
+
+def expiry_notice(ticket_id: str) -> str:
+    return (
+        f"⌛ Ticket #{ticket_id} was closed after a period of inactivity.\n"
+        "Send a new message any time to open a new ticket."
+    )
+
+def more_history(ticket_id: str, page_no: int) -> str:
+    return f"More history: /history {ticket_id} {page_no}"
+
+def no_history(ticket_id: str, first: int) -> str:
+    return f"No history for #{ticket_id}" + (f" from page {first}." if first > 1 else ".")
+
+def whoami_text(chat_id: int, admin: bool) -> str:
+    return f"Your Chat ID: {chat_id}\nAdmin Status: {'✅ Yes' if admin else '❌ No'}"
+
+def format_search_results(terms: str, results: list) -> str:
+    lines = [f"🔎 Tickets matching \"{terms}\":"]
+    for ticket_id, count, last_ts in results:
+        when = datetime.fromtimestamp(last_ts, timezone.utc).strftime("%Y-%m-%d")
+        lines.append(f"• #{ticket_id} ({count} {'message' if count == 1 else 'messages'}, last {when})")
+    lines.append("\nUse /history <TICKET_ID> to read one.")
+    return "\n".join(lines)
+
+# ------------------------- HELPERS -------------------------
+def parse_admin_ids(value: str) -> list:
+    """Comma-separated chat IDs from ADMIN_CHAT_ID; an invalid list is reported and ignored"""
+    value = (value or "").strip()
+    if not value:
+        return []
+    try:
+        return [int(id_str.strip()) for id_str in value.split(",") if id_str.strip()]
+    except ValueError as e:
+        logger.error("config.invalid_admin_ids", error=str(e))
+        return []
+
+def pretty_user(user) -> str:
+    """Format a user of either library for display"""
+    username = f"@{user.username}" if user.username else "(no username)"
+    first_name = user.first_name or ""
+    last_name = user.last_name or ""
+    return f"{first_name} {last_name} {username}".strip()
+
+def command_args(text: str) -> list:
+    """Words after the command, for libraries that don't split them"""
+    return (text or "").split()[1:]
+
+def parse_ticket_id(args: list):
+    return args[0].upper() if args else None
+
+def parse_history(args: list):
+    """(ticket_id, first_page) for /history, or None if the arguments are invalid"""
+    if not args or not HistoryLog.valid_id(args[0]) or (len(args) > 1 and not args[1].isdigit()):
+        return None
+    return args[0].upper(), max(int(args[1]), 1) if len(args) > 1 else 1
+
+def parse_search(args: list):
+    """(terms, by_recency) for /search, or None if there is nothing searchable"""
+    by_recency = bool(args) and args[0] == "-r"
+    terms = " ".join(args[1:] if by_recency else args)
+    if not SearchIndex.query_for(terms):
+        return None
+    return terms, by_recency
+
+# ------------------------- ENGINE -------------------------
+class TicketEngine:
+    """Ticket state and routing rules, independent of the Telegram library
+
+    All state goes through one TicketStore. Check-then-act sequences
+    (open a ticket unless the user has one, file a message under it,
+    close it) hold that user's lock, so telebot's handler threads work
+    on different users in parallel but never interleave on one user; in
+    the asyncio bot the locks are never contended.
+    """
+
+    def __init__(self, store, admin_ids=(), history=None, search=None, summaries=None,
+                 persistence=None, retention=None, history_pages_per_command: int = 5, open_page_size: int = 10,
+                 ids=None, support_group=None, events=None, analytics=None, guard=None):
+        self.store = store
+        self.admin_ids = list(admin_ids)
+        self.support_group = support_group
+        self.history = history or HistoryLog()
+        self.search = search or SearchIndex()
+        self.summaries = summaries or TicketSummaries()
+        self.persistence = persistence or WriteBehind(store)
+        self.persistence.follow(self.history)
+        self.retention = retention or Retention(store)
+        self.guard = guard or IngressGuard()
+        self.history_pages_per_command = history_pages_per_command
+        self.open_page_size = open_page_size
+        self._user_locks = StripedLock()
+        # Multi-worker mode sets this to sharding.gather, so admin views cover every shard
+        self.gather = None
+        # An ID is taken if an open ticket or any history (closed tickets too) uses it
+        self.ids = ids or TicketIds(
+            taken=lambda ticket_id: self.store.get_ticket_user(ticket_id) is not None
+            or self.history.exists(ticket_id)
+        )
+        # Every ticket event is logged and folded into the SLA aggregates
+        self.events = events or EventLog()
+        self.analytics = analytics or TicketAnalytics()
+        self.events.subscribe(self.analytics.record)
+        if self.events.path is not None:
+            self.persistence.follow(self.events)
+            # Live events wait until warm() has replayed the log of earlier runs
+            self.analytics.hold()
+
+    @classmethod
+    def from_env(cls, store=None, events_path: str = None):
+        """Build the engine from the environment the bots are configured with"""
+        store = store or open_store(os.getenv("TICKET_STORE", "journal"))
+        return cls(
+            store,
+            admin_ids=parse_admin_ids(os.getenv("ADMIN_CHAT_ID", "")),
+            # A forum supergroup where each ticket gets its own topic; replaces per-admin copies
+            support_group=int(os.getenv("SUPPORT_GROUP_ID") or 0) or None,
+            history=HistoryLog(os.getenv("HISTORY_DIR", "ticket_history")),
+            search=SearchIndex(os.getenv("SEARCH_DB", "ticket_search.db")),
+            events=EventLog(events_path or os.getenv("EVENT_LOG", "ticket_events.jsonl")),
+            # Writes are coalesced and flushed off the hot path every
+            # FLUSH_INTERVAL_MS or every FLUSH_MAX_PENDING mutations
+            persistence=WriteBehind(
+                store,
+                interval_ms=int(os.getenv("FLUSH_INTERVAL_MS", "200")),
+                max_pending=int(os.getenv("FLUSH_MAX_PENDING", "100")),
+            ),
+            # Idle tickets auto-close after TICKET_TTL_HOURS, any ticket after
+            # TICKET_MAX_AGE_HOURS (0 = never), and at most MAX_MAPPINGS message
+            # mappings are kept; the sweep runs every RETENTION_INTERVAL_S
+            retention=Retention(
+                store,
+                ticket_ttl_hours=float(os.getenv("TICKET_TTL_HOURS", "72")),
+                max_mappings=int(os.getenv("MAX_MAPPINGS", "100000")),
+                interval_s=float(os.getenv("RETENTION_INTERVAL_S", "600")),
+                max_age_hours=float(os.getenv("TICKET_MAX_AGE_HOURS", "0")),
+            ),
+            # Each user may send SPAM_MAX_MESSAGES per SPAM_WINDOW_S (0 = no limit)
+            # before being muted for SPAM_MUTE_S; exact repeats within
+            # SPAM_DUPLICATE_WINDOW_S are dropped (0 = allow)
+            guard=IngressGuard(
+                max_messages=int(os.getenv("SPAM_MAX_MESSAGES", "20")),
+                window_s=float(os.getenv("SPAM_WINDOW_S", "60")),
+                duplicate_window_s=float(os.getenv("SPAM_DUPLICATE_WINDOW_S", "30")),
+                mute_s=float(os.getenv("SPAM_MUTE_S", "300")),
+                max_users=int(os.getenv("SPAM_MAX_USERS", "50000")),
+            ),
+            history_pages_per_command=int(os.getenv("HISTORY_PAGES_PER_COMMAND", "5")),
+            open_page_size=int(os.getenv("OPEN_PAGE_SIZE", "10")),
+        )
+
+    # ---- lifecycle ----
+    def load(self) -> None:
+        """Load what routing needs: tickets and the search index; call warm() afterwards"""
+        self.store.load()
+        self.search.load()
+
+    def warm(self) -> None:
+        """Rebuild the dashboard summaries and SLA aggregates; runs in the background after startup"""
+        with health.phase("warm"):
+            self.summaries.rebuild(
+                self.store.open_tickets(), self.history,
+                is_open=lambda ticket_id, user_id: self.store.get_user_ticket(user_id) == ticket_id,
+            )
+            self.analytics.replay(self.events.previous_records())
+
+    def warm_async(self) -> threading.Thread:
+        thread = threading.Thread(target=self.warm, name="summaries-warm", daemon=True)
+        thread.start()
+        return thread
+
+    def start_threads(self, on_expired) -> None:
+        """Background workers for the threaded front-end; on_expired(ticket_id, user_id, thread_id) notifies users"""
+        self.persistence.start_thread()
+        self.retention.start_thread(self._expire, on_expired)
+        self.search.start_thread()
+
+    def stop_threads(self) -> None:
+        self.retention.stop()
+        self.search.close()
+        self.persistence.stop()
+        self.history.close()
+        self.store.close()
+        self.events.close()
+
+    def stats(self) -> dict:
+        return {
+            "persistence": self.persistence.stats(),
+            "retention": self.retention.stats(),
+            "tickets": {
+                "open_from_last_24h": len(self.tickets_opened_between(time.time() - 86400, time.time() + 1)),
+                "id_collisions": self.ids.collisions,
+            },
+            "events": {"emitted": self.events.emitted, "replayed": self.analytics.replayed},
+            "ingress": self.guard.stats(),
+        }
+
+    # ---- routing ----
+    def is_admin(self, chat_id: int) -> bool:
+        """Check if the given chat ID belongs to an admin or is the support group"""
+        return chat_id in self.admin_ids or (self.support_group is not None and chat_id == self.support_group)
+
+    @property
+    def admins_configured(self) -> bool:
+        return bool(self.admin_ids) or self.support_group is not None
+
+    # ---- support group topics ----
+    def ticket_thread(self, ticket_id: str):
+        """The forum topic (message_thread_id) of an open ticket, or None"""
+        return self.store.get_thread(ticket_id)
+
+    def user_thread(self, user_id: int):
+        """The forum topic of the user's open ticket, or None"""
+        ticket_id = self.store.get_user_ticket(user_id)
+        return self.store.get_thread(ticket_id) if ticket_id else None
+
+    def attach_thread(self, ticket_id: str, user_id: int, thread_id: int) -> None:
+        """Record a ticket's forum topic; anything posted in it then routes to the ticket
+
+        The thread ID is also stored as the ticket's one message mapping,
+        so route_reply(message_thread_id) finds it and multi-worker
+        routing needs nothing new.
+        """
+        self.store.set_thread(ticket_id, thread_id)
+        self.store.add_mapping(thread_id, ticket_id, user_id)
+
+    def user_ticket(self, user_id: int):
+        """Return (ticket_id, created), opening a ticket if the user has none"""
+        with self._user_locks(user_id):
+            ticket_id = self.store.get_user_ticket(user_id)
+            if ticket_id:
+                return ticket_id, False
+            ticket_id = self.ids.new()
+            self.store.open_ticket(user_id, ticket_id)
+            self.events.emit(OPENED, ticket_id, user_id, user_id)
+            return ticket_id, True
+
+    def ticket_user(self, ticket_id: str):
+        return self.store.get_ticket_user(ticket_id)
+
+    def tickets_opened_between(self, start: float, end: float) -> list:
+        """[(ticket_id, user_id)] for open tickets created in [start, end), oldest first"""
+        return self.store.tickets_opened_between(start, end)
+
+    def route_reply(self, message_id: int):
+        """(ticket_id, user_id) for the admin-chat message being replied to, or None"""
+        return self.store.get_mapping(message_id)
+
+    def map_delivered(self, results, ticket_id: str, user_id: int) -> int:
+        """Map every message in a fan-out's results to the ticket; returns how many admins got it
+
+        Forwards are sent in the background, so the ticket may have been
+        closed meanwhile; its copies are then left unmapped, since close
+        already dropped the ticket's mappings.
+        """
+        delivered = 0
+        is_open = self.store.get_ticket_user(ticket_id) == user_id
+        for result in results:
+            if result.ok:
+                # copy_messages returns one MessageId per album item
+                sent = result.message if isinstance(result.message, (list, tuple)) else [result.message]
+                for message in sent if is_open else ():
+                    self.store.add_mapping(message.message_id, ticket_id, user_id)
+                delivered += 1
+            else:
+                logger.error("admin.send_failed", ticket_id=ticket_id, admin_id=result.chat_id, error=str(result.error))
+        return delivered
+
+    # ---- messages ----
+    def record(self, ticket_id: str, user_id: int, role: str, sender_id: int, text: str) -> None:
+        """Append a message to the ticket's history, its summary and the search queue"""
+        self.history.append(ticket_id, role, sender_id, text)
+        self.summaries.record(ticket_id, user_id, role, text)
+        self.search.add(ticket_id, role, text)
+
+    def user_message(self, user_id: int, text: str):
+        """File a user's message under their ticket; returns (ticket_id, created)"""
+        # Held across both steps so a concurrent /close can't land in between
+        with self._user_locks(user_id):
+            ticket_id, created = self.user_ticket(user_id)
+            log.bind(ticket_id=ticket_id)
+            self.store.touch(ticket_id)
+            self.record(ticket_id, user_id, USER, user_id, text)
+            self.events.emit(MESSAGE, ticket_id, user_id, user_id)
+        return ticket_id, created
+
+    def admin_message(self, ticket_id: str, user_id: int, admin_id: int, text: str) -> None:
+        log.bind(ticket_id=ticket_id)
+        # Retention measures idleness from here; topic mode adds no mapping per message
+        self.store.touch(ticket_id)
+        self.record(ticket_id, user_id, ADMIN, admin_id, text)
+        self.events.emit(REPLY, ticket_id, user_id, admin_id)
+
+    # ---- closing ----
+    def _close(self, ticket_id: str, user_id: int, closed_by: int) -> None:
+        """Remove the ticket, its mappings and its dashboard entry; the caller holds the user's lock"""
+        self.store.close_ticket(ticket_id)
+        self.summaries.remove(ticket_id)
+        self.events.emit(CLOSED, ticket_id, user_id, closed_by)
+        log.bind(ticket_id=ticket_id)
+
+    def close_user_ticket(self, user_id: int):
+        """Close the user's open ticket; returns its ID, or None if there was none"""
+        with self._user_locks(user_id):
+            ticket_id = self.store.get_user_ticket(user_id)
+            if ticket_id:
+                self._close(ticket_id, user_id, user_id)
+            return ticket_id
+
+    def close_by_admin(self, ticket_id: str, admin_id: int = None):
+        """Close a ticket by ID; returns its user, or None if it doesn't exist"""
+        user_id = self.store.get_ticket_user(ticket_id)
+        if not user_id:
+            return None
+        with self._user_locks(user_id):
+            # The user may have closed it while we waited for the lock
+            if self.store.get_ticket_user(ticket_id) != user_id:
+                return None
+            self._close(ticket_id, user_id, admin_id)
+            return user_id
+
+    def expire(self) -> list:
+        """Run one retention sweep; returns the [(ticket_id, user_id, thread_id)] it closed"""
+        return self.retention.sweep(self._expire)
+
+    def _expire(self, ticket_id: str, user_id: int):
+        with self._user_locks(user_id):
+            # The user or an admin may have closed it since the sweep looked
+            if self.store.get_ticket_user(ticket_id) != user_id:
+                return None
+            # Closing drops the forum topic, which the front-end still has to close
+            thread_id = self.store.get_thread(ticket_id)
+            self.store.close_ticket(ticket_id)
+            self.summaries.remove(ticket_id)
+            self.events.emit(EXPIRED, ticket_id, user_id)
+            return ticket_id, user_id, thread_id
+
+    # ---- admin views ----
+    def views(self) -> dict:
+        """This shard's parts of the admin views, served to the other workers in multi-worker mode"""
+        return {"open": lambda size: self.summaries.page(0, size), "stats": self.analytics.snapshot}
+
+    def open_page(self, page: int = 0):
+        """Dashboard text for a page plus (has_previous, has_next); blocks on the other shards if any"""
+        size = self.open_page_size
+        if self.gather is None:
+            rows, total, waiting = self.summaries.page(page, size)
+        else:
+            # Each shard's tickets up to the end of this page, merged; a shard that didn't answer is left out
+            parts = [part for part in self.gather("open", (page + 1) * size) if part is not None]
+            rows, total, waiting = merge_pages(parts, page, size)
+        return format_page(rows, total, waiting, page, size)
+
+    def history_pages(self, ticket_id: str, first: int = 1):
+        """Yield (page_no, text) from page first on, then (page_no, None) if more remain
+
+        At most history_pages_per_command pages are produced; pages are
+        read from disk one at a time, so nothing past the last one is read.
+        """
+        sent = 0
+        for page_no, page in enumerate(self.history.pages(ticket_id), 1):
+            if page_no < first:
+                continue
+            if sent == self.history_pages_per_command:
+                yield page_no, None
+                return
+            yield page_no, page
+            sent += 1
+
+    def stats_text(self) -> str:
+        """Text for /stats; blocks on the other shards if any"""
+        if self.gather is None:
+            return format_stats(self.analytics.report())
+        # A shard that didn't answer is left out
+        parts = [part for part in self.gather("stats") if part is not None]
+        return format_stats(build_report(parts, bucket_s=self.analytics.bucket_s))
+
+    def search_tickets(self, terms: str, by_recency: bool = False) -> str:
+        """Search result text for /search"""
+        results = self.search.search(terms, by_recency=by_recency)
+        return format_search_results(terms, results) if results else NO_SEARCH_RESULTS
@@ -0,0 +1,84 @@
+import time
+import secrets
+import threading
+
+# Crockford base32: no I, L, O or U, and the digits sort in ASCII order,
+# so comparing IDs as strings compares their creation times
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+# Seconds are counted from 2024-01-01 UTC; six characters last until 2058
+EPOCH = 1704067200
+TIME_CHARS = 6
+RANDOM_CHARS = 4
+ID_LENGTH = TIME_CHARS + RANDOM_CHARS
+RANDOM_SPACE = len(ALPHABET) ** RANDOM_CHARS
+
+# ------------------------- ENCODING -------------------------
+def _encode(value: int, width: int) -> str:
+    chars = []
+    for _ in range(width):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+def _decode(text: str) -> int:
+    value = 0
+    for char in text:
+        value = value * 32 + ALPHABET.index(char)
+    return value
+
+def is_time_ordered(ticket_id: str) -> bool:
+    """True for IDs from TicketIds; the older 8-character hex IDs carry no time"""
+    return len(ticket_id) == ID_LENGTH and all(c in ALPHABET for c in ticket_id)
+
+def created_at(ticket_id: str):
+    """Unix time (to the second) a ticket ID was issued, or None for older IDs"""
+    if not is_time_ordered(ticket_id):
+        return None
+    return EPOCH + _decode(ticket_id[:TIME_CHARS])
+
+def id_range(start: float, end: float) -> tuple:
+    """(low, high) such that low <= ticket_id < high selects IDs issued in [start, end)"""
+    def bound(ts):
+        second = min(max(int(ts) - EPOCH, 0), 32 ** TIME_CHARS - 1)
+        return _encode(second, TIME_CHARS) + ALPHABET[0] * RANDOM_CHARS
+    return bound(start), bound(end)
+
+# ------------------------- GENERATOR -------------------------
+class TicketIds:
+    """Short, time-ordered ticket IDs that are checked for collisions
+
+    An ID is six characters of creation second followed by four random
+    ones, so the birthday bound applies per second rather than over all
+    tickets ever opened. IDs issued in the current second are kept in a
+    set, which makes the in-process check O(1); taken(ticket_id), if
+    given, is asked as well to cover IDs issued before a restart or by
+    another worker. If the clock steps back, the last second is reused so
+    IDs never go backwards.
+    """
+
+    def __init__(self, taken=None, clock=time.time):
+        self.taken = taken
+        self.clock = clock
+        self.collisions = 0
+        self._second = -1
+        self._issued = set()
+        self._lock = threading.Lock()
+
+    def new(self) -> str:
+        with self._lock:
+            second = max(int(self.clock()) - EPOCH, self._second)
+            # Move on to the next second rather than dig for the last free suffixes
+            if second == self._second and len(self._issued) >= RANDOM_SPACE // 2:
+                second += 1
+            if second != self._second:
+                self._second = second
+                self._issued.clear()
+            prefix = _encode(second, TIME_CHARS)
+            while True:
+                ticket_id = prefix + _encode(secrets.randbelow(RANDOM_SPACE), RANDOM_CHARS)
+                if ticket_id not in self._issued and not (self.taken and self.taken(ticket_id)):
+                    break
+                self.collisions += 1
+            self._issued.add(ticket_id)
+            return ticket_id
@@ -0,0 +1,203 @@
+from bisect import bisect_left
+from itertools import chain, repeat
+from collections import OrderedDict
+
+# ------------------------- TICKET INDEX -------------------------
+class Ticket:
+    """One ticket with its owner and every admin-side message mapped to it"""
+
+    __slots__ = ("ticket_id", "user_id", "message_ids", "last_activity", "thread_id")
+
+    def __init__(self, ticket_id: str, user_id: int, last_activity: float):
+        self.ticket_id = ticket_id
+        self.user_id = user_id
+        self.message_ids = set()
+        self.last_activity = last_activity
+        self.thread_id = None
+
+class TicketIndex:
+    """Ticket-centric view of the routing state with both mapping directions
+
+    message_id -> Ticket answers admin replies, ticket_id -> Ticket holds
+    the message_ids to drop on close, and user_id -> ticket_id tracks the
+    user's open ticket. Tickets are kept in last-activity order so idle
+    tickets can be collected from the front without a full scan, and open
+    ticket IDs are also kept sorted, which for time-ordered IDs is
+    creation order, so a creation-time range is two bisects. Message
+    and user IDs must be ints; the stores canonicalize them on load.
+    """
+
+    def __init__(self):
+        self.messages = {}
+        self.tickets = OrderedDict()
+        self.open_tickets = {}
+        self.open_ids = []
+        self._unsorted = False
+
+    def __len__(self) -> int:
+        return len(self.tickets)
+
+    def _touch(self, ticket_id: str, user_id: int, ts: float) -> Ticket:
+        ticket = self.tickets.get(ticket_id)
+        if ticket is None:
+            ticket = self.tickets[ticket_id] = Ticket(ticket_id, user_id, ts)
+        elif ts >= ticket.last_activity:
+            ticket.last_activity = ts
+            self.tickets.move_to_end(ticket_id)
+        return ticket
+
+    def _sorted_ids(self) -> list:
+        # Older random IDs arrive out of order on load; sort once when next needed
+        if self._unsorted:
+            self.open_ids.sort()
+            self._unsorted = False
+        return self.open_ids
+
+    def _unlist(self, ticket_id: str) -> None:
+        ids = self._sorted_ids()
+        i = bisect_left(ids, ticket_id)
+        if i < len(ids) and ids[i] == ticket_id:
+            del ids[i]
+
+    # ---- mutations ----
+    def open_ticket(self, user_id: int, ticket_id: str, ts: float) -> None:
+        """Register a ticket as the user's open ticket"""
+        self._touch(ticket_id, user_id, ts)
+        previous = self.open_tickets.get(user_id)
+        if previous == ticket_id:
+            return
+        if previous is not None:
+            self._unlist(previous)
+        self.open_tickets[user_id] = ticket_id
+        # New time-ordered IDs sort last, so this is normally an append
+        if self.open_ids and ticket_id < self.open_ids[-1]:
+            self._unsorted = True
+        self.open_ids.append(ticket_id)
+
+    def set_thread(self, ticket_id: str, thread_id: int) -> None:
+        """Attach the ticket's support-group forum topic"""
+        ticket = self.tickets.get(ticket_id)
+        if ticket is not None:
+            ticket.thread_id = thread_id
+
+    def touch(self, ticket_id: str, ts: float) -> None:
+        """Record activity on a known ticket"""
+        ticket = self.tickets.get(ticket_id)
+        if ticket is not None:
+            self._touch(ticket_id, ticket.user_id, ts)
+
+    def add_message(self, message_id: int, ticket_id: str, user_id: int, ts: float) -> None:
+        """Map an admin-side message to a ticket; activity is only recorded by open_ticket() and touch()"""
+        previous = self.messages.get(message_id)
+        if previous is not None and previous.ticket_id != ticket_id:
+            previous.message_ids.discard(message_id)
+        ticket = self.tickets.get(ticket_id) or self._touch(ticket_id, user_id, ts)
+        ticket.message_ids.add(message_id)
+        self.messages[message_id] = ticket
+
+    def remove_ticket(self, ticket_id: str):
+        """Drop a ticket and its mappings in O(messages of that ticket); returns the Ticket or None"""
+        ticket = self.tickets.pop(ticket_id, None)
+        if ticket is None:
+            return None
+        for message_id in ticket.message_ids:
+            self.messages.pop(message_id, None)
+        if self.open_tickets.get(ticket.user_id) == ticket_id:
+            del self.open_tickets[ticket.user_id]
+            self._unlist(ticket_id)
+        return ticket
+
+    def remove_messages(self, message_ids) -> None:
+        """Drop individual mappings; tickets left with no mappings are dropped unless still open"""
+        for message_id in message_ids:
+            ticket = self.messages.pop(message_id, None)
+            if ticket is None:
+                continue
+            ticket.message_ids.discard(message_id)
+            if not ticket.message_ids and self.open_tickets.get(ticket.user_id) != ticket.ticket_id:
+                self.tickets.pop(ticket.ticket_id, None)
+
+    # ---- lookups ----
+    def lookup_message(self, message_id: int):
+        """Return (ticket_id, user_id) for an admin-side message, or None"""
+        ticket = self.messages.get(message_id)
+        return (ticket.ticket_id, ticket.user_id) if ticket else None
+
+    def user_ticket(self, user_id: int):
+        return self.open_tickets.get(user_id)
+
+    def ticket_user(self, ticket_id: str):
+        ticket = self.tickets.get(ticket_id)
+        return ticket.user_id if ticket and self.open_tickets.get(ticket.user_id) == ticket_id else None
+
+    def ticket_thread(self, ticket_id: str):
+        ticket = self.tickets.get(ticket_id)
+        return ticket.thread_id if ticket else None
+
+    def idle_tickets(self, cutoff: float):
+        """Yield tickets whose last activity is older than cutoff, oldest first"""
+        for ticket in self.tickets.values():
+            if ticket.last_activity >= cutoff:
+                break
+            yield ticket
+
+    def open_between(self, low: str, high: str):
+        """Yield (ticket_id, user_id) for open tickets with low <= ticket_id < high, in ID order"""
+        ids = self._sorted_ids()
+        for i in range(bisect_left(ids, low), bisect_left(ids, high)):
+            yield ids[i], self.tickets[ids[i]].user_id
+
+    def least_recent_messages(self, count: int) -> list:
+        """Return up to count message_ids, taken from the least recently active tickets first
+
+        A ticket's forum topic is mapped like a message but never returned:
+        evicting it would stop routing everything posted in the topic.
+        """
+        victims = []
+        for ticket in self.tickets.values():
+            if len(victims) >= count:
+                break
+            candidates = ticket.message_ids - {ticket.thread_id} if ticket.thread_id else ticket.message_ids
+            victims.extend(sorted(candidates)[:count - len(victims)])
+        return victims
+
+    # ---- serialization ----
+    def mappings(self):
+        """Yield (message_id, ticket_id, user_id) for every mapping"""
+        for message_id, ticket in self.messages.items():
+            yield message_id, ticket.ticket_id, ticket.user_id
+
+    def columns(self) -> tuple:
+        """The index as parallel per-ticket columns plus message IDs grouped by ticket, for snapshot.py"""
+        tickets = list(self.tickets.values())
+        open_ids = set(self.open_tickets.values())
+        return (
+            [t.ticket_id for t in tickets],
+            [t.user_id for t in tickets],
+            [t.last_activity for t in tickets],
+            [t.thread_id or 0 for t in tickets],
+            [t.ticket_id in open_ids for t in tickets],
+            [len(t.message_ids) for t in tickets],
+            list(chain.from_iterable(t.message_ids for t in tickets)),
+        )
+
+    @classmethod
+    def from_columns(cls, ticket_ids, user_ids, activity, threads, opened, counts, message_ids):
+        """Rebuild an index from columns() output without replaying one mutation per mapping"""
+        index = cls()
+        tickets = []
+        start = 0
+        for ticket_id, user_id, ts, thread_id, is_open, count in zip(
+                ticket_ids, user_ids, activity, threads, opened, counts):
+            ticket = Ticket(ticket_id, user_id, ts)
+            ticket.thread_id = thread_id or None
+            ticket.message_ids = set(message_ids[start:start + count])
+            start += count
+            tickets.append(ticket)
+            if is_open:
+                index.open_tickets[user_id] = ticket_id
+        index.tickets = OrderedDict(zip(ticket_ids, tickets))
+        # Mappings are grouped by ticket, so each ticket repeats once per message
+        index.messages = dict(zip(message_ids, chain.from_iterable(map(repeat, tickets, counts))))
+        index.open_ids = sorted(index.open_tickets.values())
+        return index
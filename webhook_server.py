@@ -0,0 +1,219 @@
+"""Async webhook ingestion server for Telegram updates
+
+Runs on the bot's own event loop, so webhook mode needs neither the
+polling loop nor the Flask keep-alive thread. Besides the webhook path
+it serves the same /, /status, /stats, /healthz, /readyz and /metrics routes as
+keep_alive.py.
+
+Replay recorded updates against a local instance:
+    python webhook_server.py replay updates.jsonl [--url URL] [--secret TOKEN]
+"""
+import hmac
+import json
+import asyncio
+from http import HTTPStatus
+import metrics
+import log
+from health import HOME_TEXT, status_payload, stats_payload, liveness, readiness
+
+logger = log.get("webhook")
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+def _plain(status: int, body: str) -> tuple:
+    return status, "text/plain", body
+
+# ------------------------- SERVER -------------------------
+class WebhookServer:
+    """Minimal HTTP/1.1 server that queues Telegram updates for a handler
+
+    Updates are put on a bounded queue and consumed by `workers` tasks
+    calling handler(update_dict). With one worker (the default) updates
+    are handled strictly in arrival order. When the queue stays full for
+    longer than backpressure_timeout the request is answered with 503 and
+    Telegram redelivers the update later.
+    """
+
+    def __init__(self, handler, path: str = "/webhook", secret_token: str = "",
+                 host: str = "0.0.0.0", port: int = 8000, queue_size: int = 1000,
+                 workers: int = 1, backpressure_timeout: float = 5.0):
+        self.handler = handler
+        self.path = path
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.backpressure_timeout = backpressure_timeout
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+        self.received = 0
+        self.rejected = 0
+        self.handler_errors = 0
+
+        self.routes = {
+            ("GET", "/"): lambda: (200, "text/plain; charset=utf-8", HOME_TEXT),
+            ("GET", "/status"): lambda: (200, "application/json", json.dumps(status_payload())),
+            ("GET", "/stats"): lambda: (200, "application/json", json.dumps(stats_payload())),
+            ("GET", "/healthz"): lambda: _plain(*liveness()),
+            ("GET", "/readyz"): lambda: _plain(*readiness()),
+            ("GET", "/metrics"): lambda: (200, metrics.CONTENT_TYPE, metrics.render()),
+        }
+        self._server = None
+        self._tasks = []
+
+    def route(self, method: str, path: str, fn) -> None:
+        """Register fn() -> (status, content_type, body) for an extra endpoint"""
+        self.routes[(method, path)] = fn
+
+    async def start(self) -> None:
+        metrics.webhook_queue_depth.set_function(self.queue.qsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        logger.info("webhook.listening", host=self.host, port=self.port, path=self.path)
+
+    async def stop(self) -> None:
+        """Stop accepting requests, finish queued updates and stop the workers"""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.handler(update)
+            except asyncio.CancelledError:
+                raise
+            except BaseException:
+                # Whatever one update raises, the worker must live on to handle the next
+                self.handler_errors += 1
+                update_id = update.get("update_id") if isinstance(update, dict) else None
+                logger.exception("webhook.handler_failed", update_id=update_id)
+            finally:
+                self.queue.task_done()
+
+    # ---- HTTP ----
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, content_type, payload = await self._dispatch(method, path, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                self._write_response(writer, status, content_type, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise ValueError("Request header too large")
+        if len(head) > MAX_HEADER_BYTES:
+            raise ValueError("Request header too large")
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0"))
+        if length > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], headers, body
+
+    async def _dispatch(self, method: str, path: str, headers: dict, body: bytes):
+        if path == self.path:
+            if method != "POST":
+                return 405, "text/plain", "Method Not Allowed"
+            return await self._accept_update(headers, body)
+        route = self.routes.get((method, path))
+        if route is None:
+            return 404, "text/plain", "Not Found"
+        # Off the loop: in multi-worker mode /metrics waits on the workers
+        return await asyncio.get_running_loop().run_in_executor(None, route)
+
+    async def _accept_update(self, headers: dict, body: bytes):
+        if self.secret_token and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            return 403, "text/plain", "Forbidden"
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return 400, "text/plain", "Bad Request"
+        # Telegram only ever sends an Update object
+        if not isinstance(update, dict):
+            return 400, "text/plain", "Bad Request"
+        try:
+            await asyncio.wait_for(self.queue.put(update), self.backpressure_timeout)
+        except asyncio.TimeoutError:
+            # Handlers are behind; Telegram retries non-2xx deliveries
+            self.rejected += 1
+            return 503, "text/plain", "Busy"
+        self.received += 1
+        return 200, "text/plain", "OK"
+
+    @staticmethod
+    def _write_response(writer, status: int, content_type: str, payload, keep_alive: bool) -> None:
+        body = payload.encode() if isinstance(payload, str) else payload
+        head = (
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+
+# ------------------------- LOCAL REPLAY -------------------------
+def replay(path: str, url: str, secret_token: str = "") -> None:
+    """POST every update in a JSON-lines file to a running webhook server"""
+    import urllib.request
+    import urllib.error
+
+    sent = failed = 0
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            request = urllib.request.Request(url, data=line.encode(), method="POST")
+            request.add_header("Content-Type", "application/json")
+            if secret_token:
+                request.add_header("X-Telegram-Bot-Api-Secret-Token", secret_token)
+            try:
+                urllib.request.urlopen(request).read()
+                sent += 1
+            except urllib.error.HTTPError as e:
+                failed += 1
+                print(f"HTTP {e.code} for update: {line.strip()[:80]}")
+    print(f"Replayed {sent} updates, {failed} rejected")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    replay_cmd = sub.add_parser("replay", help="POST recorded updates to a webhook")
+    replay_cmd.add_argument("file")
+    replay_cmd.add_argument("--url", default="http://127.0.0.1:8000/webhook")
+    replay_cmd.add_argument("--secret", default="")
+    args = parser.parse_args()
+    replay(args.file, args.url, args.secret)
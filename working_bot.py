@@ -1,97 +1,327 @@
-from keep_alive import keep_alive
-keep_alive()
+import time
+# Startup phases are measured from here; see health.py
+STARTED = time.perf_counter()
 
 import os
-import json
+import sys
+import signal
+import asyncio
+import threading
+import contextvars
+import concurrent.futures
 import telebot
-from uuid import uuid4
 from dotenv import load_dotenv
+import ticket_engine as te
+from ticket_engine import TicketEngine
+from coalesce import SyncCoalescer
+from media import MEDIA_KINDS, media_kind, file_id_of, describe, fingerprint, caption_with, ALBUM_WINDOW_MS, ALBUM_MAX_ITEMS
+from keep_alive import keep_alive
+from locks import StripedLock
+from ingress import RATE_LIMITED
+import metrics
+import health
+import log
+from fanout import fan_out_sync
+from send_queue import SyncSendQueue, PRIORITY_USER, PRIORITY_ADMIN, PRIORITY_ECHO, GLOBAL_RATE, CHAT_RATE
+
+# webhook_server and sharding are imported where they're used, so polling
+# mode with one worker doesn't pay for them at startup
+health.record_phase("imports", time.perf_counter() - STARTED)
+
+# pyTelegramBotAPI adapter for ticket_engine; handlers run on telebot's
+# worker threads and send through the rate-limited outbox.
 
 # Load environment
 load_dotenv()
+# JSON log lines via a background writer; LOG_LEVEL, LOG_REDACT, LOG_SAMPLE
+log.setup()
+logger = log.get("bot")
+
 BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 ADMIN_CHAT_ID_ENV = os.getenv("ADMIN_CHAT_ID", "").strip()
 
-print(f"Bot token present: {bool(BOT_TOKEN)}")
-print(f"Admin chat ID: {ADMIN_CHAT_ID_ENV}")
+logger.info("config.loaded", bot_token_present=bool(BOT_TOKEN), admin_chat_id=ADMIN_CHAT_ID_ENV)
 
 if not BOT_TOKEN:
-    print("ERROR: BOT_TOKEN is missing!")
+    logger.error("config.missing_bot_token")
     exit(1)
 
-# Parse admin IDs
-ADMIN_CHAT_IDS = []
-if ADMIN_CHAT_ID_ENV:
-    try:
-        ADMIN_CHAT_IDS = [int(id_str.strip()) for id_str in ADMIN_CHAT_ID_ENV.split(",") if id_str.strip()]
-        print(f"Loaded admin IDs: {ADMIN_CHAT_IDS}")
-    except ValueError as e:
-        print(f"ERROR: Invalid ADMIN_CHAT_ID format: {e}")
+# Webhook mode is enabled by setting WEBHOOK_URL to the bot's public base URL
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+PORT = int(os.getenv("PORT", "8000"))
+
+# WORKERS > 1 partitions updates by user across that many worker processes
+WORKERS = int(os.getenv("WORKERS", "1"))
+SHARED_INDEX_DB = os.getenv("SHARED_INDEX_DB", "ticket_index.db")
+
+# Maximum number of admin sends in flight at once
+FANOUT_CONCURRENCY = int(os.getenv("ADMIN_FANOUT_CONCURRENCY", "10"))
 
 # Initialize bot
-bot = telebot.TeleBot(BOT_TOKEN)
+# TELEGRAM_API_URL points the bot at a local fake API (load tests only)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL + "/bot{0}/{1}"
+# Handlers run on HANDLER_THREADS worker threads; different users' updates proceed in parallel
+HANDLER_THREADS = int(os.getenv("HANDLER_THREADS", "8"))
+bot = telebot.TeleBot(BOT_TOKEN, num_threads=HANDLER_THREADS)
+
+# Rate-limited outbound queue shared by all handler threads
+outbox = SyncSendQueue(
+    global_rate=float(os.getenv("SEND_GLOBAL_RATE", GLOBAL_RATE)),
+    chat_rate=float(os.getenv("SEND_CHAT_RATE", CHAT_RATE)),
+)
+
+COALESCE_WINDOW_MS = int(os.getenv("COALESCE_WINDOW_MS", "0"))
+COALESCE_MAX_BATCH = int(os.getenv("COALESCE_MAX_BATCH", "10"))
 
-# Data storage
-ticket_mappings = {}
-user_tickets = {}
+# Ticket state, history, search and dashboard
+engine = TicketEngine.from_env()
+ADMIN_CHAT_IDS = engine.admin_ids
+if ADMIN_CHAT_IDS:
+    logger.info("config.admins", admin_ids=ADMIN_CHAT_IDS)
+
+# With SUPPORT_GROUP_ID set, tickets go to one forum topic each in that
+# supergroup instead of a copy per admin chat
+SUPPORT_GROUP_ID = engine.support_group
+if SUPPORT_GROUP_ID:
+    logger.info("config.support_group", support_group=SUPPORT_GROUP_ID)
+
+# One topic per ticket even when two handler threads forward for it at once
+topic_locks = StripedLock(64, factory=threading.Lock)
+
+# Admin-side sends (forwards, echoes, topic closes) run on background
+# threads so a handler is free once the user is answered and the admin
+# chats' 1 msg/s limit never holds up other updates. A user's sends all
+# go to the same single-threaded executor, which keeps them in order.
+background_pools = [
+    concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix=f"admin-send-{i}")
+    for i in range(max(1, FANOUT_CONCURRENCY))
+]
+background = set()
+background_lock = threading.Lock()
 
 def load_data():
-    global ticket_mappings, user_tickets
+    with health.phase("load"):
+        engine.load()
+    # Dashboard summaries are rebuilt from history in the background
+    engine.warm_async()
+    metrics.watch_store(engine.store, engine.persistence, outbox)
+    health.watch_analytics(engine.analytics.report)
+    logger.info("store.loaded", open_tickets=engine.store.counts()[0])
+
+def notify_expired(ticket_id, user_id, thread_id):
+    in_background(close_topic, thread_id, user_id=user_id)
     try:
-        with open("ticket_data.json", "r") as f:
-            data = json.load(f)
-            ticket_mappings = data.get("ticket_mappings", {})
-            user_tickets = data.get("user_tickets", {})
-        print("✓ Data loaded from file")
-    except (FileNotFoundError, json.JSONDecodeError):
-        ticket_mappings = {}
-        user_tickets = {}
-        print("✓ Starting with empty data")
-
-def save_data():
-    with open("ticket_data.json", "w") as f:
-        json.dump({
-            "ticket_mappings": ticket_mappings,
-            "user_tickets": user_tickets
-        }, f, indent=2)
-
-def new_ticket_id():
-    return str(uuid4())[:8].upper()
-
-def pretty_user(user):
-    username = f"@{user.username}" if user.username else "(no username)"
-    first_name = user.first_name or ""
-    last_name = user.last_name or ""
-    return f"{first_name} {last_name} {username}".strip()
+        outbox.send(user_id, lambda: bot.send_message(user_id, te.expiry_notice(ticket_id)), PRIORITY_ECHO)
+    except Exception as e:
+        logger.error("user.notify_failed", ticket_id=ticket_id, user_id=user_id, error=str(e))
+
+def in_background(fn, *args, user_id=None):
+    """Run an admin-side send without waiting for it; shutdown waits for what's left"""
+    pool = background_pools[(user_id or 0) % len(background_pools)]
+    with background_lock:
+        future = pool.submit(contextvars.copy_context().run, fn, *args)
+        background.add(future)
+    future.add_done_callback(background_done)
+
+def background_done(future):
+    with background_lock:
+        background.discard(future)
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("background.failed", error=repr(future.exception()))
+
+def settle():
+    """Wait for the admin-side sends still in flight"""
+    with background_lock:
+        futures = list(background)
+    concurrent.futures.wait(futures)
+
+def drain_handlers():
+    """Let telebot's handler threads finish every update they were given, then stop them"""
+    pool = bot.worker_pool
+    if not bot.threaded or pool is None:
+        return
+    while not pool.tasks.empty():
+        time.sleep(0.05)
+    # Joins each worker after its current update
+    pool.close()
+
+def shutdown(signum=None, frame=None):
+    """Stop taking updates, finish the ones in flight, then flush and close the store"""
+    # Updates fetched but not yet handled are never acknowledged, so Telegram redelivers them
+    bot.stop_polling()
+    drain_handlers()
+    albums.drain()
+    if coalescer is not None:
+        coalescer.drain()
+    settle()
+    engine.stop_threads()
+    logger.info("store.flushed", **engine.persistence.stats())
+    if signum is not None:
+        sys.exit(0)
+
+def open_keyboard(page, has_previous, has_next):
+    markup = telebot.types.InlineKeyboardMarkup()
+    buttons = []
+    if has_previous:
+        buttons.append(telebot.types.InlineKeyboardButton("◀️ Previous", callback_data=f"open:{page - 1}"))
+    buttons.append(telebot.types.InlineKeyboardButton("🔄 Refresh", callback_data=f"open:{page}"))
+    if has_next:
+        buttons.append(telebot.types.InlineKeyboardButton("Next ▶️", callback_data=f"open:{page + 1}"))
+    markup.row(*buttons)
+    return markup
 
 def is_admin(chat_id):
-    return chat_id in ADMIN_CHAT_IDS
+    return engine.is_admin(chat_id)
+
+def reply(message, text, **kwargs):
+    """Reply to message through the send queue, so it waits out the chat's limit and 429s are retried"""
+    return outbox.send(message.chat.id, lambda: bot.reply_to(message, text, **kwargs), PRIORITY_USER)
+
+def admit(message):
+    """Anti-spam check for a user's message; False means drop it without doing anything else"""
+    verdict = engine.guard.check(message.from_user.id, fingerprint(message), message.media_group_id)
+    if verdict is None:
+        return True
+    metrics.ingress_dropped.inc(verdict)
+    if verdict == RATE_LIMITED:
+        # Told once per mute; further messages are dropped silently
+        outbox.send(message.chat.id, lambda: bot.reply_to(message, te.muted_notice(engine.guard.mute_s)), PRIORITY_ECHO)
+    return False
+
+def ticket_topic(ticket_id, user):
+    """The ticket's forum topic in the support group, created on first use; None if it can't be created"""
+    with topic_locks(ticket_id):
+        thread_id = engine.ticket_thread(ticket_id)
+        if thread_id is not None or engine.ticket_user(ticket_id) != user.id:
+            # No new topic for a ticket closed while its forward waited
+            return thread_id
+        try:
+            topic = outbox.send(
+                SUPPORT_GROUP_ID,
+                lambda: bot.create_forum_topic(SUPPORT_GROUP_ID, te.topic_name(ticket_id, user)),
+                PRIORITY_ADMIN, "createForumTopic",
+            )
+        except Exception as e:
+            logger.error("topic.create_failed", ticket_id=ticket_id, error=str(e))
+            return None
+        engine.attach_thread(ticket_id, user.id, topic.message_thread_id)
+        return topic.message_thread_id
+
+def close_topic(thread_id):
+    """Close a closed ticket's forum topic so the group's topic list only shows live tickets"""
+    if thread_id is None:
+        return
+    try:
+        outbox.send(SUPPORT_GROUP_ID, lambda: bot.close_forum_topic(SUPPORT_GROUP_ID, thread_id),
+                    PRIORITY_ECHO, "closeForumTopic")
+    except Exception as e:
+        logger.error("topic.close_failed", thread_id=thread_id, error=str(e))
+
+def relay_to_admins(call_for, ticket_id, user_id, priority=PRIORITY_ADMIN, method="sendMessage", thread_id=None):
+    """Send call_for(chat_id, thread_id)() to the admins and return how many got it
+
+    In support-group mode (thread_id given) that is one post into the
+    ticket's topic, which routes by thread and needs no mapping;
+    otherwise every admin chat gets a copy concurrently and each
+    delivered copy is mapped to the ticket.
+    """
+    if thread_id is not None:
+        try:
+            outbox.send(SUPPORT_GROUP_ID, call_for(SUPPORT_GROUP_ID, thread_id), priority, method)
+        except Exception as e:
+            logger.error("topic.post_failed", ticket_id=ticket_id, thread_id=thread_id, error=str(e))
+            return 0
+        return 1
+    results = fan_out_sync(
+        lambda admin_id: outbox.send(admin_id, call_for(admin_id, None), priority, method),
+        ADMIN_CHAT_IDS,
+        FANOUT_CONCURRENCY,
+    )
+    return engine.map_delivered(results, ticket_id, user_id)
+
+def send_to_admins(text, ticket_id, user_id, priority=PRIORITY_ADMIN, thread_id=None):
+    return relay_to_admins(
+        lambda chat_id, thread: lambda: bot.send_message(chat_id, text, message_thread_id=thread),
+        ticket_id, user_id, priority, thread_id=thread_id,
+    )
+
+def copy_or_resend(chat_id, message, caption, thread_id=None):
+    """Copy a media message server-side, or re-send it by file_id if it can't be copied"""
+    try:
+        return bot.copy_message(chat_id, message.chat.id, message.message_id, caption=caption,
+                                message_thread_id=thread_id)
+    except telebot.apihelper.ApiTelegramException as e:
+        if e.error_code != 400:
+            raise
+        # Protected content can't be copied, but its file_id is still reusable
+        kind = media_kind(message)
+        return getattr(bot, f"send_{kind}")(chat_id, file_id_of(message, kind), caption=caption,
+                                             message_thread_id=thread_id)
+
+def copy_album(chat_id, messages, thread_id=None):
+    """Copy an album as one grouped message, or item by item if it can't be copied as a whole"""
+    # copy_messages only exists from pyTelegramBotAPI 4.15; requirements.txt pins 4.14.0
+    if hasattr(bot, "copy_messages"):
+        try:
+            return bot.copy_messages(chat_id, messages[0].chat.id, [m.message_id for m in messages],
+                                     message_thread_id=thread_id)
+        except telebot.apihelper.ApiTelegramException as e:
+            if e.error_code != 400:
+                raise
+    return [copy_or_resend(chat_id, m, m.caption, thread_id) for m in messages]
+
+def topic_ticket(message):
+    """The ticket whose support-group topic message was posted in, or None"""
+    if not SUPPORT_GROUP_ID or message.chat.id != SUPPORT_GROUP_ID or not message.is_topic_message:
+        return None
+    mapping = engine.route_reply(message.message_thread_id)
+    return mapping[0] if mapping else None
+
+def deliver_admin_reply(message, ticket_id, user_id, content):
+    """Send an admin's text reply to the user, record it and echo it to the admin chats"""
+    try:
+        outbox.send(user_id, lambda: bot.send_message(user_id, te.support_reply(ticket_id, content)), PRIORITY_USER)
+    except Exception as e:
+        reply(message, f"Error sending message to user: {e}")
+        logger.error("admin.reply_failed", ticket_id=ticket_id, user_id=user_id, error=str(e))
+        return False
+    engine.admin_message(ticket_id, user_id, message.from_user.id, content)
+
+    # Forward admin reply to admin chat and map it; the support group
+    # needs no echo, the reply is already in the topic
+    if not SUPPORT_GROUP_ID:
+        in_background(send_to_admins, te.reply_echo(ticket_id, content), ticket_id, user_id, PRIORITY_ECHO,
+                      user_id=user_id)
+    logger.info("admin.replied", sampled=True, admin_id=message.from_user.id, ticket_id=ticket_id)
+    return True
 
 # Bot command handlers
 @bot.message_handler(commands=['start'])
+@metrics.timed("start")
 def handle_start(message):
-    chat_id = message.chat.id
-    
-    if is_admin(chat_id):
-        bot.reply_to(message,
-            "👋 Welcome Admin!\n"
-            "You will receive user questions here.\n"
-            "Reply to any message to respond to the user.\n\n"
-            "Use /debug to check your admin status."
-        )
-    else:
-        bot.reply_to(message,
-            "👋 Welcome to Nuner Support!\n"
-            "Send your question and our team will reply here.\n"
-            "📝 Tip: Send one question per message.\n\n"
-            "Use /close to close your current ticket."
-        )
+    reply(message, te.START_ADMIN if is_admin(message.chat.id) else te.START_USER)
+
+@bot.message_handler(commands=['help'])
+@metrics.timed("help")
+def handle_help(message):
+    reply(message, te.HELP_ADMIN if is_admin(message.chat.id) else te.HELP_USER)
+
+@bot.message_handler(commands=['whoami'])
+@metrics.timed("whoami")
+def handle_whoami(message):
+    reply(message, te.whoami_text(message.chat.id, is_admin(message.chat.id)))
 
 @bot.message_handler(commands=['debug'])
+@metrics.timed("debug")
 def handle_debug(message):
     chat_id = message.chat.id
     user = message.from_user
-    
+    stats = engine.stats()
+
     debug_info = (
         f"🛠 DEBUG INFO:\n"
         f"• Your Chat ID: {chat_id}\n"
@@ -101,131 +331,450 @@ def handle_debug(message):
         f"• ADMIN_CHAT_IDS: {ADMIN_CHAT_IDS}\n"
         f"• Is Admin: {is_admin(chat_id)}\n"
         f"• Bot Token Present: {bool(BOT_TOKEN)}\n"
-        f"• Admin IDs Configured: {bool(ADMIN_CHAT_IDS)}"
+        f"• Admin IDs Configured: {bool(ADMIN_CHAT_IDS)}\n"
+        f"• Persistence: {stats['persistence']}\n"
+        f"• Retention: {stats['retention']}\n"
+        f"• Tickets: {stats['tickets']}\n"
+        f"• Events: {stats['events']}\n"
+        f"• Ingress: {stats['ingress']}\n"
+        f"• Logging: {log.stats()}"
     )
-    
-    print(f"DEBUG: {debug_info}")
-    bot.reply_to(message, debug_info)
+
+    logger.debug("debug.shown", chat_id=chat_id)
+    reply(message, debug_info)
 
 @bot.message_handler(commands=['close'])
+@metrics.timed("close")
 def handle_close(message):
     if message.chat.type != "private":
         return
-        
+
     user_id = message.from_user.id
-    ticket_id = user_tickets.get(user_id)
-    
+    if coalescer is not None:
+        # Forward what the user sent just before /close while the ticket still exists
+        coalescer.flush_key(user_id)
+
+    # Remove the user's ticket and all mappings for it
+    thread_id = engine.user_thread(user_id) if SUPPORT_GROUP_ID else None
+    ticket_id = engine.close_user_ticket(user_id)
     if not ticket_id:
-        bot.reply_to(message, "You don't have any open tickets.")
-        return
-        
-    # Remove user's ticket
-    user_tickets.pop(user_id, None)
-    
-    # Remove all mappings for this ticket
-    global ticket_mappings
-    ticket_mappings = {k: v for k, v in ticket_mappings.items() if v[0] != ticket_id}
-    
-    save_data()
-    bot.reply_to(message, f"✅ Ticket #{ticket_id} has been closed.")
+        reply(message, te.NO_OPEN_TICKET)
+        return
+    reply(message, te.closed_notice(ticket_id))
+    in_background(close_topic, thread_id, user_id=user_id)
+
+@bot.message_handler(commands=['close_ticket'])
+@metrics.timed("close_ticket")
+def handle_close_ticket(message):
+    if not is_admin(message.chat.id):
+        reply(message, te.ADMIN_ONLY)
+        return
+
+    ticket_id = te.parse_ticket_id(te.command_args(message.text)) or topic_ticket(message)
+    if not ticket_id:
+        reply(message, te.USAGE_CLOSE_TICKET)
+        return
+
+    thread_id = engine.ticket_thread(ticket_id) if SUPPORT_GROUP_ID else None
+    user_id = engine.close_by_admin(ticket_id, message.from_user.id)
+    if not user_id:
+        reply(message, te.TICKET_NOT_FOUND)
+        return
+
+    reply(message, te.closed_notice(ticket_id))
+    in_background(close_topic, thread_id, user_id=user_id)
+    try:
+        outbox.send(user_id, lambda: bot.send_message(user_id, te.closed_by_support(ticket_id)), PRIORITY_USER)
+    except Exception as e:
+        logger.error("user.notify_failed", ticket_id=ticket_id, user_id=user_id, error=str(e))
+
+@bot.message_handler(commands=['reply'])
+@metrics.timed("reply")
+def handle_reply(message):
+    if not is_admin(message.chat.id):
+        reply(message, te.ADMIN_ONLY)
+        return
+
+    # Keep the reply's own line breaks: split off the command and ticket ID only
+    parts = (message.text or "").split(maxsplit=2)
+    if len(parts) < 3:
+        reply(message, te.USAGE_REPLY)
+        return
+
+    ticket_id = te.parse_ticket_id(parts[1:])
+    user_id = engine.ticket_user(ticket_id)
+    if not user_id:
+        reply(message, te.TICKET_NOT_FOUND)
+        return
+
+    if deliver_admin_reply(message, ticket_id, user_id, parts[2]):
+        reply(message, "✅ Sent to user.")
+
+@bot.message_handler(commands=['history'])
+@metrics.timed("history")
+def handle_history(message):
+    chat_id = message.chat.id
+    if not is_admin(chat_id):
+        reply(message, te.ADMIN_ONLY)
+        return
+
+    parsed = te.parse_history(te.command_args(message.text))
+    if not parsed:
+        reply(message, te.USAGE_HISTORY)
+        return
+    ticket_id, first = parsed
+
+    # Each page is read from disk only when it is about to be sent
+    sent = 0
+    for page_no, page in engine.history_pages(ticket_id, first):
+        if page is None:
+            reply(message, te.more_history(ticket_id, page_no))
+            break
+        outbox.send(chat_id, lambda page=page: bot.send_message(chat_id, page), PRIORITY_USER)
+        sent += 1
+
+    if not sent:
+        reply(message, te.no_history(ticket_id, first))
+
+@bot.message_handler(commands=['search'])
+@metrics.timed("search")
+def handle_search(message):
+    if not is_admin(message.chat.id):
+        reply(message, te.ADMIN_ONLY)
+        return
+
+    parsed = te.parse_search(te.command_args(message.text))
+    if not parsed:
+        reply(message, te.USAGE_SEARCH)
+        return
+    reply(message, engine.search_tickets(*parsed))
+
+@bot.message_handler(commands=['open'])
+@metrics.timed("open")
+def handle_open(message):
+    if not is_admin(message.chat.id):
+        reply(message, te.ADMIN_ONLY)
+        return
+    text, has_previous, has_next = engine.open_page(0)
+    outbox.send(message.chat.id, lambda: bot.send_message(
+        message.chat.id, text, reply_markup=open_keyboard(0, has_previous, has_next)
+    ), PRIORITY_USER)
+
+@bot.message_handler(commands=['stats'])
+@metrics.timed("stats")
+def handle_stats(message):
+    if not is_admin(message.chat.id):
+        reply(message, te.ADMIN_ONLY)
+        return
+    reply(message, engine.stats_text())
+
+@bot.callback_query_handler(func=lambda call: (call.data or "").startswith("open:"))
+@metrics.timed("open_page")
+def handle_open_page(call):
+    bot.answer_callback_query(call.id)
+    if not is_admin(call.message.chat.id):
+        return
+    page = int(call.data.split(":", 1)[1])
+    text, has_previous, has_next = engine.open_page(page)
+    try:
+        outbox.send(call.message.chat.id, lambda: bot.edit_message_text(
+            text, call.message.chat.id, call.message.message_id,
+            reply_markup=open_keyboard(page, has_previous, has_next),
+        ), PRIORITY_USER, "editMessageText")
+    except Exception as e:
+        # Refresh with nothing changed is rejected as "message is not modified"
+        logger.debug("dashboard.not_updated", error=str(e))
 
 # Handle regular messages
 @bot.message_handler(func=lambda message: True)
+@metrics.timed("message")
 def handle_message(message):
     try:
         chat_id = message.chat.id
         user_id = message.from_user.id
         text = message.text or ""
-        
-        print(f"Received message from {user_id} in chat {chat_id}: {text}")
-        
+
+        # Flood and duplicate check comes before anything else, logging included
+        if message.chat.type == "private" and not is_admin(chat_id) and not admit(message):
+            return
+
+        logger.debug("message.received", sampled=True, chat_id=chat_id, text=text)
+
+        # Anything written in a ticket's support-group topic goes to its user
+        if SUPPORT_GROUP_ID and chat_id == SUPPORT_GROUP_ID:
+            if message.is_topic_message and not message.from_user.is_bot:
+                mapping = engine.route_reply(message.message_thread_id)
+                if mapping:
+                    deliver_admin_reply(message, *mapping, text)
+                else:
+                    reply(message, te.NOT_A_TICKET)
+            return
+
         # Handle admin replies
         if is_admin(chat_id) and message.reply_to_message:
-            reply_msg_id = message.reply_to_message.message_id
-            mapping = ticket_mappings.get(reply_msg_id)
-            
+            mapping = engine.route_reply(message.reply_to_message.message_id)
             if mapping:
                 ticket_id, target_user_id = mapping
-                content = text
-                
-                try:
-                    # Send reply to user
-                    bot.send_message(target_user_id, f"💬 Support (#{ticket_id}):\n{content}")
-                    
-                    # Forward admin reply to admin chat and map it
-                    for admin_id in ADMIN_CHAT_IDS:
-                        admin_forward = bot.send_message(admin_id, f"💬 You replied to #{ticket_id}:\n{content}")
-                        ticket_mappings[admin_forward.message_id] = (ticket_id, target_user_id)
-                    
-                    save_data()
-                    print(f"Admin {user_id} replied to ticket {ticket_id}")
-                except Exception as e:
-                    bot.reply_to(message, f"Error sending message to user: {e}")
-                    print(f"Error in admin reply: {e}")
+                deliver_admin_reply(message, ticket_id, target_user_id, text)
                 return
-        
+
         # Handle user messages (create/update tickets)
         if message.chat.type == "private" and not is_admin(chat_id):
-            # Check if user has existing ticket
-            ticket_id = user_tickets.get(user_id)
-            if not ticket_id:
-                ticket_id = new_ticket_id()
-                user_tickets[user_id] = ticket_id
-                bot.reply_to(message, f"✅ Your ticket #{ticket_id} has been created. Admin will reply here.\nUse /close to close this ticket.")
+            ticket_id, created = engine.user_message(user_id, text)
+
+            item = (message, ticket_id, created, text)
+            if coalescer is None:
+                forward_user_messages(user_id, [item])
             else:
-                bot.reply_to(message, f"ℹ️ Your message has been added to ticket #{ticket_id}.")
-            
-            # Forward to admin
-            if ADMIN_CHAT_IDS:
-                header = (
-                    f"🆕 Ticket #{ticket_id}\n"
-                    f"From: {pretty_user(message.from_user)} (ID: {user_id})\n\n"
-                    f"{text}\n\n"
-                    f"↩️ Reply by replying to this message."
-                )
-                try:
-                    for admin_id in ADMIN_CHAT_IDS:
-                        admin_msg = bot.send_message(admin_id, header)
-                        ticket_mappings[admin_msg.message_id] = (ticket_id, user_id)
-                    save_data()
-                    print(f"Created/updated ticket {ticket_id} for user {user_id}")
-                except Exception as e:
-                    bot.reply_to(message, "Error sending message to admin. Please try again later.")
-                    print(f"Error forwarding to admin: {e}")
-        
+                coalescer.add(user_id, item, len(text))
+
         # Handle admin messages that aren't replies
         elif is_admin(chat_id):
-            bot.reply_to(message,
-                "👋 You're an admin! \n"
-                "If you want to test user functionality, please use a different account.\n"
-                "To reply to users, reply to their messages in the admin chat."
+            reply(message, te.ADMIN_AS_USER)
+
+    except Exception:
+        logger.exception("message.failed")
+
+def forward_user_messages(user_id, items):
+    """Confirm and forward one message, or a coalesced burst, from the same ticket"""
+    message, ticket_id, _, _ = items[-1]
+    texts = [text for _, _, _, text in items]
+    created = any(created for _, _, created, _ in items)
+    confirmation = te.confirmation(ticket_id, created, len(items))
+    reply(message, confirmation)
+
+    # Forward to admin
+    if not engine.admins_configured:
+        return
+    in_background(forward_to_admins, message, ticket_id, user_id, texts, user_id=user_id)
+
+def forward_to_admins(message, ticket_id, user_id, texts):
+    """Send the forward to every admin, or into the ticket's topic; runs in the background"""
+    thread_id = ticket_topic(ticket_id, message.from_user) if SUPPORT_GROUP_ID else None
+    header = te.forward_header(ticket_id, message.from_user, user_id, texts, in_topic=thread_id is not None)
+    if (not SUPPORT_GROUP_ID or thread_id is not None) and send_to_admins(header, ticket_id, user_id, thread_id=thread_id):
+        logger.info("ticket.forwarded", sampled=True, ticket_id=ticket_id, messages=len(texts))
+    else:
+        reply(message, te.FORWARD_FAILED)
+
+coalescer = (
+    SyncCoalescer(forward_user_messages, COALESCE_WINDOW_MS, COALESCE_MAX_BATCH)
+    if COALESCE_WINDOW_MS > 0 else None
+)
+
+# Handle photos, documents, voice notes and videos in both directions
+@bot.message_handler(content_types=list(MEDIA_KINDS))
+@metrics.timed("media")
+def handle_media(message):
+    try:
+        chat_id = message.chat.id
+        user_id = message.from_user.id
+
+        if is_admin(chat_id):
+            if SUPPORT_GROUP_ID and chat_id == SUPPORT_GROUP_ID:
+                if not message.is_topic_message or message.from_user.is_bot:
+                    return
+                mapping = engine.route_reply(message.message_thread_id)
+            elif message.reply_to_message:
+                mapping = engine.route_reply(message.reply_to_message.message_id)
+            else:
+                return
+            if not mapping:
+                reply(message, te.NOT_A_TICKET)
+                return
+            ticket_id, target_user_id = mapping
+            item = (message, ticket_id, target_user_id)
+            if message.media_group_id:
+                albums.add(("admin", message.media_group_id), item)
+            else:
+                relay_admin_media([item])
+            return
+
+        if message.chat.type != "private" or not admit(message):
+            return
+        if coalescer is not None:
+            # Keep text sent just before the file ahead of it in the admin chat
+            coalescer.flush_key(user_id)
+        ticket_id, created = engine.user_message(user_id, describe(message))
+
+        item = (message, ticket_id, created)
+        if message.media_group_id:
+            albums.add(("user", message.media_group_id), item)
+        else:
+            relay_user_media([item])
+    except Exception:
+        logger.exception("media.failed")
+
+def relay_user_media(items):
+    """Confirm and copy one media message, or one album, to every admin"""
+    message, ticket_id, _ = items[0]
+    user_id = message.from_user.id
+    created = any(created for _, _, created in items)
+    confirmation = te.confirmation(ticket_id, created, len(items), media_kind(message))
+    reply(message, confirmation)
+
+    if not engine.admins_configured:
+        return
+    in_background(copy_to_admins, items, ticket_id, user_id, user_id=user_id)
+
+def copy_to_admins(items, ticket_id, user_id):
+    """Copy the file or album to every admin, or into the ticket's topic; runs in the background"""
+    message = items[0][0]
+    thread_id = ticket_topic(ticket_id, message.from_user) if SUPPORT_GROUP_ID else None
+    if SUPPORT_GROUP_ID and thread_id is None:
+        reply(message, te.FORWARD_FAILED)
+        return
+    header = te.media_header(ticket_id, message.from_user, user_id, len(items), in_topic=thread_id is not None)
+    if len(items) == 1:
+        delivered = relay_to_admins(
+            lambda chat_id, thread: lambda: copy_or_resend(chat_id, message, caption_with(header, message.caption), thread),
+            ticket_id, user_id, method="copyMessage", thread_id=thread_id,
+        )
+    else:
+        # Albums can't carry a header caption, so the header goes first and every copy is mapped
+        messages = sorted((m for m, _, _ in items), key=lambda m: m.message_id)
+        delivered = send_to_admins(header, ticket_id, user_id, thread_id=thread_id)
+        if delivered:
+            delivered = relay_to_admins(
+                lambda chat_id, thread: lambda: copy_album(chat_id, messages, thread),
+                ticket_id, user_id, method="copyMessages", thread_id=thread_id,
             )
-            
+    if delivered:
+        logger.info("media.forwarded", sampled=True, ticket_id=ticket_id, files=len(items))
+    else:
+        reply(message, te.FORWARD_FAILED)
+
+def relay_admin_media(items):
+    """Copy an admin's media reply, or album reply, to the ticket's user"""
+    message, ticket_id, user_id = items[0]
+    header = te.support_reply(ticket_id)
+    try:
+        if len(items) == 1:
+            caption = caption_with(header, message.caption)
+            outbox.send(user_id, lambda: copy_or_resend(user_id, message, caption), PRIORITY_USER, "copyMessage")
+        else:
+            messages = sorted((m for m, _, _ in items), key=lambda m: m.message_id)
+            outbox.send(user_id, lambda: bot.send_message(user_id, header), PRIORITY_USER)
+            outbox.send(user_id, lambda: copy_album(user_id, messages), PRIORITY_USER, "copyMessages")
     except Exception as e:
-        print(f"Error in handle_message: {e}")
+        reply(message, f"Error sending message to user: {e}")
+        return
+
+    descriptions = [describe(m) for m, _, _ in items]
+    for (m, _, _), text in zip(items, descriptions):
+        engine.admin_message(ticket_id, user_id, m.from_user.id, text)
+    if not SUPPORT_GROUP_ID:
+        in_background(send_to_admins, te.reply_echo(ticket_id, "\n".join(descriptions)), ticket_id, user_id,
+                      PRIORITY_ECHO, user_id=user_id)
+    logger.info("admin.replied", sampled=True, admin_id=message.from_user.id, ticket_id=ticket_id, files=len(items))
+
+def flush_album(key, items):
+    direction, _ = key
+    (relay_user_media if direction == "user" else relay_admin_media)(items)
+
+# Album items arrive as separate updates; they are relayed together once the group is complete
+albums = SyncCoalescer(flush_album, ALBUM_WINDOW_MS, ALBUM_MAX_ITEMS)
+
+async def run_webhook():
+    from webhook_server import WebhookServer
+
+    loop = asyncio.get_running_loop()
+
+    # Each update is handled to completion on one of HANDLER_THREADS
+    # threads, so when handlers fall behind the server's bounded queue
+    # fills up and answers 503 instead of piling work onto telebot's pool
+    bot.threaded = False
+    handlers = concurrent.futures.ThreadPoolExecutor(HANDLER_THREADS, thread_name_prefix="webhook-handler")
+
+    async def process(data):
+        update = telebot.types.Update.de_json(data)
+        await loop.run_in_executor(handlers, bot.process_new_updates, [update])
+
+    server = WebhookServer(process, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET, port=PORT,
+                           workers=HANDLER_THREADS)
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await server.start()
+    bot.set_webhook(url=f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET or None,
+                    drop_pending_updates=True)
+    health.mark_ready(STARTED)
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        handlers.shutdown()
+
+def run_shard(shard, count, queue):
+    from sharding import shard_store, serve_views, gather
+    global engine
+    engine = TicketEngine.from_env(shard_store(shard, count, SHARED_INDEX_DB), f"ticket_events.shard{shard}.jsonl")
+    engine.gather = gather
+    load_data()
+    serve_views(engine.views())
+    engine.start_threads(notify_expired)
+
+    # Handle this shard's updates one at a time so per-user order is kept
+    bot.threaded = False
+    while True:
+        data = queue.get()
+        if data is None:
+            break
+        bot.process_new_updates([telebot.types.Update.de_json(data)])
+    shutdown()
 
 def main():
-    print("Starting Nuner Support Bot...")
-    
+    logger.info("bot.starting")
+
+    if WORKERS > 1:
+        from sharding import ShardPool, run_router
+
+        logger.info("bot.running", mode="multi-worker", workers=WORKERS)
+        if not WEBHOOK_URL:
+            keep_alive()
+        pool = ShardPool(WORKERS, run_shard, SHARED_INDEX_DB)
+        pool.start()
+        metrics.add_source(pool.metrics)
+        health.watch_analytics(pool.stats)
+        # Workers load their shards while the router already queues updates for them
+        health.mark_ready(STARTED)
+        try:
+            asyncio.run(run_router(pool, BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, PORT))
+        finally:
+            pool.stop()
+        return
+
+    if not WEBHOOK_URL:
+        # Start the keep-alive server first so /healthz answers while state loads
+        keep_alive()
+
     # Load existing data
     load_data()
-    
-    print("🤖 Nuner Support Bot is running...")
-    print("🌐 Keep-alive server is active on port 8000")
-    print("📧 Bot is ready to handle support tickets!")
-    print("Bot username: @nunersupportbot")
-    
+    engine.start_threads(notify_expired)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    if WEBHOOK_URL:
+        logger.info("bot.running", mode="webhook", port=PORT)
+        asyncio.run(run_webhook())
+        shutdown()
+        return
+
+    logger.info("bot.running", mode="polling", keep_alive_port=8000, username="@nunersupportbot")
+
     try:
         # Start the bot
-        print("Starting bot polling...")
+        bot.remove_webhook()
+        health.mark_ready(STARTED)
         bot.infinity_polling(timeout=60, long_polling_timeout=60)
-    except Exception as e:
-        print(f"Error running bot: {e}")
+        shutdown()
+    except Exception:
+        logger.exception("bot.polling_failed")
+        shutdown()
         # Keep process alive for Flask server
-        import time
-        print("Keeping process alive for Flask server...")
+        logger.info("bot.keep_alive_only")
         while True:
             time.sleep(60)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()